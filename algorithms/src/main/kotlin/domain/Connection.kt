@@ -206,12 +206,24 @@ class Connection(
     }
 
     suspend fun sendMoveForwardWithDistanceAndWait(numberOfGrids: Int) {
-        sendToArduino(movementWithParameterCommand(Movement.MOVE_FORWARD, numberOfGrids * 10))
-        okCommandChannel.receive()
+        sendMoveForwardWithDistance(numberOfGrids)
+        waitForOk()
     }
 
     suspend fun sendTurnCommandWithCountAndWait(movement: Movement, turns: Int) {
+        sendTurnCommandWithCount(movement, turns)
+        waitForOk()
+    }
+
+    suspend fun sendMoveForwardWithDistance(numberOfGrids: Int) {
+        sendToArduino(movementWithParameterCommand(Movement.MOVE_FORWARD, numberOfGrids * 10))
+    }
+
+    suspend fun sendTurnCommandWithCount(movement: Movement, turns: Int) {
         sendToArduino(movementWithParameterCommand(movement, turns * 90))
+    }
+
+    suspend fun waitForOk() {
         okCommandChannel.receive()
     }
 
@@ -337,11 +337,22 @@ class Robot(
         if (isAtFastestPath) {
             val compactList = movements.compact(maxConsecutiveForward = 3)
             println("CompactList: $compactList")
+            if (connection.isConnected) {
+                // The rpi keeps a window of commands in flight to the Arduino, so the whole path is sent up front
+                // and the next move starts when the previous one ends instead of after a round trip
+                for ((movement, count) in compactList) {
+                    if (movement == Movement.MOVE_FORWARD) {
+                        connection.sendMoveForwardWithDistance(count)
+                    } else {
+                        connection.sendTurnCommandWithCount(movement, count)
+                    }
+                }
+            }
             for ((movement, count) in compactList) {
+                if (connection.isConnected) {
+                    connection.waitForOk()
+                }
                 if (movement == Movement.MOVE_FORWARD) {
-                    if (connection.isConnected) {
-                        connection.sendMoveForwardWithDistanceAndWait(count)
-                    }
                     for (i in 0 until count) {
                         if (!connection.isConnected) {
                             delay(250L / (speed ?: 3))
@@ -349,9 +360,6 @@ class Robot(
                         moveForward()
                     }
                 } else {
-                    if (connection.isConnected) {
-                        connection.sendTurnCommandWithCountAndWait(movement, count)
-                    }
                     for (i in 0 until count) {
                         if (!connection.isConnected) {
                             delay(250L / (speed ?: 3))
@@ -154,15 +154,26 @@ public class BluetoothConnectionService {
 		public void run() {
 			byte[] buffer = new byte[1024];
 			int bytes;
+			// messages are newline framed, one read may hold several messages or part of one
+			StringBuilder pending = new StringBuilder();
 
 			while (true) {
 				try {
 					bytes = stream_in.read(buffer);
-					String message = new String(buffer, 0, bytes);
-
-					Intent messaging_intent = new Intent("messaging");
-					messaging_intent.putExtra("read message", message);
-					LocalBroadcastManager.getInstance(context).sendBroadcast(messaging_intent);
+					if (bytes < 0) {
+						break;
+					}
+					pending.append(new String(buffer, 0, bytes));
+
+					int end;
+					while ((end = pending.indexOf("\n")) >= 0) {
+						String message = pending.substring(0, end);
+						pending.delete(0, end + 1);
+
+						Intent messaging_intent = new Intent("messaging");
+						messaging_intent.putExtra("read message", message);
+						LocalBroadcastManager.getInstance(context).sendBroadcast(messaging_intent);
+					}
 				} catch (IOException e) {
 					e.printStackTrace();
 					break;
@@ -219,7 +230,11 @@ public class BluetoothConnectionService {
 	}
 
 	public void write(byte[] message_out) {
-		btt_connected.write(message_out);
+		// terminate every message so the rpi can split messages sent back to back
+		byte[] framed = new byte[message_out.length + 1];
+		System.arraycopy(message_out, 0, framed, 0, message_out.length);
+		framed[message_out.length] = '\n';
+		btt_connected.write(framed);
 	}
 
 	public BluetoothDevice getDevice() {
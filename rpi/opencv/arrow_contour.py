@@ -44,6 +44,18 @@ def getArrowLocation(arrows, robotLocation, robotDir):
     return arrowLocArray
 
 
+#areas of all contours at once with the shoelace formula, the same values contourArea gives for integer points.
+#img_recognition.contour_areas does the same, it is not imported so this script needs nothing beyond OpenCV
+def contourAreas(cnts):
+    lengths = numpy.array([len(c) for c in cnts])
+    starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    points = numpy.concatenate(cnts).reshape(-1, 2).astype(numpy.int64)
+    following = numpy.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    return numpy.abs(numpy.add.reduceat(x * y[following] - x[following] * y, starts)) / 2.0, lengths
+
+
 def getImageLocation(sampleImg, actualImage):
     arrows = []
     # get sample image contours
@@ -58,15 +70,19 @@ def getImageLocation(sampleImg, actualImage):
     imgX = actualImage.shape[1]
     imgY = actualImage.shape[0]
     imgArea = imgX * imgY
-    # for each contour found
-    for (i, c) in enumerate(cnts):
+    if len(cnts) == 0:
+        return arrows
+    # ratio of the area of each object to the area of whole image
+    ratios, lengths = contourAreas(cnts)
+    ratios /= imgArea
+    # for each contour with enough points for 6 edges, approxPolyDP only keeps a subset of them, and larger than
+    # any distance below, the rest skip the polygon and shape checks
+    for i in numpy.flatnonzero((lengths >= 6) & (ratios > 0.015)):
+        c = cnts[i]
+        objectAreaRatio = ratios[i]
         # find number of edges the object has
         peri = cv.arcLength(c, True)
         approx = cv.approxPolyDP(c, 0.01 * peri, True)
-        # find area of the object
-        objectArea = float(cv.contourArea(c))
-        # find ratio of the area of object to the area of whole image
-        objectAreaRatio = objectArea / imgArea
 
         # conditional check
         # if contour matches any of the conditions we are looking for, we append the distance and location
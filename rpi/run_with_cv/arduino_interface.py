@@ -2,39 +2,71 @@ import os
 import serial
 import time
 from queue import Queue
+from serial_pump import SerialPump, CommandWindow
+from device_watcher import DeviceWatcher
+from rpi_log import get_logger
+
+log = get_logger("arduino_interface")
+
+#upper bound on the wait between attempts to open a port that exists but cannot be opened yet
+RETRY_INTERVAL = 0.05
 
 
 class ArduinoWrapper():
 
-    def __init__(self):
-        if os.path.exists('/dev/ttyACM0') == True:
-            self.ser = serial.Serial('/dev/ttyACM0', 115200)
-            print("Listening to Arduino interface....")
-        elif os.path.exists('/dev/ttyACM1') == True:
-            self.ser = serial.Serial('/dev/ttyACM1', 115200)
-            print("Listening to Arduino interface....")
-        else:
+    '''
+        parameters
+            ports - device nodes tried in order, e.g. a pty from the simulation harness
+            window - commands allowed in flight before an acknowledgement, 1 waits for every reply
+            pump - write through a SerialPump thread. False when the caller writes the port itself, like
+                   the async coordinator
+    '''
+    def __init__(self, ports=('/dev/ttyACM0', '/dev/ttyACM1'), window=4, pump=True):
+        self.ports = ports
+        self.ser = self.open_first()
+        if self.ser is None:
            raise Exception("Arduino interface not detected...")
+        #commands are written by the pump thread so a move can be queued behind the one running
+        self.pump = SerialPump(self.ser, CommandWindow(window)) if pump else None
+        self.watcher = DeviceWatcher(ports)
+        log.info("Listening to Arduino interface....")
 
+    #opens the first port that exists, None if there is none
+    def open_first(self):
+        for port in self.ports:
+            if os.path.exists(port) == True:
+                return serial.Serial(port, 115200)
+        return None
+
+    #blocks until the port is back. woken by the device watcher instead of polling, commands written
+    #in the meantime are held by the pump
     def reconnect(self):
+        if self.pump is not None:
+            self.pump.disconnect()
+        start = time.monotonic()
         while(1):
+            port = self.watcher.wait_for()
             try:
-                if os.path.exists('/dev/ttyACM0') == True:
-                    self.ser = serial.Serial('/dev/ttyACM0', 115200)
-                    break
-                if os.path.exists('/dev/ttyACM1') == True:
-                    self.ser = serial.Serial('/dev/ttyACM1', 115200)
-                    break
-                time.sleep(1)
-            except Exception:
-                continue
-        print("Arduino Reconnected...")
+                self.ser = serial.Serial(port, 115200)
+                if self.pump is not None:
+                    self.pump.reset(self.ser)
+                break
+            except Exception as e:
+                #the node can show up before udev gives it the right permissions, wait for the next change
+                log.debug("Failed to open %s: %s", port, e)
+                self.watcher.wait(RETRY_INTERVAL)
+        log.info("Arduino Reconnected after %.3fs...", time.monotonic() - start)
         return self.ser
 
-    def write(self, msg):
-        #serial comms need to encode then can send. 
-        #no need to try catch cause any failure is dead
-        self.ser.write("{}\n".format(msg).encode('UTF-8')) 
+    #queues the command for the pump, which writes it once there is room in the window. returns False since
+    #msg is only queued, sent is called by the pump once it is written to the port
+    def write(self, msg, sent=None):
+        self.pump.submit(msg, sent)
+        return False
+
+    #called by the listener for every line so acknowledgements free their slot in the window
+    def acknowledge(self, msg):
+        self.pump.acknowledge(msg)
 
     def get_connection(self):
         return self.ser
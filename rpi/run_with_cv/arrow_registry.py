@@ -0,0 +1,129 @@
+import json
+import threading
+from rpi_log import get_logger
+
+log = get_logger("arrow_registry")
+
+'''
+    Registry of the arrows recognition has reported, indexed by arena cell
+
+    During exploration the same arrow is seen from many robot positions and every miss reports NOT
+    FOUND, while the PC only needs to hear about each arrow once. The registry counts the sightings of
+    every (x, y, face) in a grid of the arena's cells and passes a report on to the PC the first time
+    the arrow is seen, and once more when it has been seen often enough to be confirmed. Repeats and
+    NOT FOUND are only counted, and arrows off the arena, which the PC throws away, are not sent at all
+
+    One registry lasts an exploration. summary lists every arrow seen with its sightings for the end of
+    the run, reset starts over for the next one
+'''
+
+ARENA_COLUMNS = 15
+ARENA_ROWS = 20
+FACES = "udlr"
+#sightings that confirm an arrow, the report that reaches this is sent again
+CONFIRMATIONS = 3
+
+
+class ArrowRegistry(object):
+
+    '''
+        parameters
+            confirmations - sightings after which an arrow is sent again as confirmed, 1 sends it once
+            forward_all - pass every report on as before, only counting them
+    '''
+    def __init__(self, confirmations=CONFIRMATIONS, forward_all=False, columns=ARENA_COLUMNS, rows=ARENA_ROWS):
+        self.confirmations = confirmations
+        self.forward_all = forward_all
+        self.columns = columns
+        self.rows = rows
+        #recognition reports on the arrow thread, the summary is asked for from the Bluetooth one
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            #sightings of each face of each cell, as sightings[y][x][face]
+            self.sightings = [[dict.fromkeys(FACES, 0) for x in range(self.columns)] for y in range(self.rows)]
+            self.found = 0
+            self.not_found = 0
+            self.repeats = 0
+            self.outside = 0
+            self.sent = 0
+
+    #records a recognition report and returns the message for the PC, None when the PC already knows it
+    def report(self, msg):
+        with self.lock:
+            forward = self.record(msg)
+            if forward or self.forward_all:
+                self.sent += 1
+                return msg
+            return None
+
+    #call with the lock held. True if msg tells the PC something new
+    def record(self, msg):
+        if msg == "NOT FOUND":
+            self.not_found += 1
+            return False
+        if not msg.startswith("arrfound"):
+            return True
+        x, y, face = msg[len("arrfound"):].split(",")
+        x, y = int(x), int(y)
+        if not(0 <= x < self.columns and 0 <= y < self.rows) or face not in FACES:
+            self.outside += 1
+            return False
+        cell = self.sightings[y][x]
+        cell[face] += 1
+        if cell[face] == 1:
+            self.found += 1
+            return True
+        if cell[face] == self.confirmations:
+            return True
+        self.repeats += 1
+        return False
+
+    #takes back a report returned by report that could not be sent, so the next sighting is passed on again
+    def forget(self, msg):
+        with self.lock:
+            self.sent -= 1
+            if msg == "NOT FOUND":
+                self.not_found -= 1
+                return
+            if not msg.startswith("arrfound"):
+                return
+            x, y, face = msg[len("arrfound"):].split(",")
+            x, y = int(x), int(y)
+            #same check as record, a report off the arena was only counted, a negative index would hit another cell
+            if not(0 <= x < self.columns and 0 <= y < self.rows) or face not in FACES:
+                self.outside -= 1
+                return
+            cell = self.sightings[y][x]
+            if cell[face] == 1:
+                self.found -= 1
+            elif cell[face] != self.confirmations:
+                self.repeats -= 1
+            cell[face] -= 1
+
+    #every arrow seen, most sighted first
+    def arrows(self):
+        with self.lock:
+            seen = [(x, y, face, count) for y, row in enumerate(self.sightings) for x, cell in enumerate(row) for face, count in cell.items() if count]
+        return sorted(seen, key=lambda arrow: (-arrow[3], arrow[1], arrow[0], arrow[2]))
+
+    def summary(self):
+        arrows = [{"x": x, "y": y, "face": face, "sightings": count, "confirmed": count >= self.confirmations} for x, y, face, count in self.arrows()]
+        with self.lock:
+            return {"arrows": arrows, "found": self.found, "not_found": self.not_found, "repeats": self.repeats, "outside": self.outside, "sent": self.sent}
+
+    def summary_text(self):
+        summary = self.summary()
+        lines = ["Arrows: {found} found, {sent} reports sent, {repeats} repeats and {not_found} NOT FOUND held back, {outside} off the arena".format(**summary)]
+        for arrow in summary["arrows"]:
+            lines.append("{x:>3},{y:>3},{face} seen {sightings} times{}".format(", confirmed" if arrow["confirmed"] else "", **arrow))
+        return "\n".join(lines)
+
+    #writes the summary to the log and, as JSON, to path
+    def dump(self, path=None):
+        log.info("%s", self.summary_text())
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(self.summary(), f, indent=1)
@@ -0,0 +1,314 @@
+import asyncio
+import os
+import signal
+import socket
+from multiprocessing import Process,Pipe
+from pc_interface import PcWrapper
+from bluetooth_interface import BluetoothWrapper
+from arduino_interface import ArduinoWrapper
+from coordinator import initialize_opencv, dump_arrows, REJECT_DURING_RECONNECT, FORWARD_ALL_ARROWS, ARROW_CONFIRMATIONS
+from arrow_registry import ArrowRegistry
+from router import build_router, AsyncDestination
+from outbound_buffer import OutboundBuffer
+from serial_pump import CommandWindow
+from tracing import Tracer, serve_control
+from rpi_log import get_logger, setup as setup_logging
+
+log = get_logger("async_coordinator")
+
+'''
+    Single event loop coordinator
+
+    Alternative to coordinator.py. Instead of one OS thread blocking on each device, the PC socket, the
+    Bluetooth socket, the Arduino serial port and the recognition pipe are all driven as non-blocking
+    streams on one asyncio loop inside the listener process. The wrappers are still used to set up the
+    devices, so coordinator.py keeps working as the threaded fallback
+'''
+
+'''
+    Class AsyncLink holds the writable side of a link that may be disconnected
+
+    Messages written while there is no connection are kept in a bounded OutboundBuffer and flushed
+    in one writelines on the next attach
+'''
+class AsyncLink(object):
+
+    def __init__(self, name, terminator="", buffer_size=256):
+        self.name = name
+        self.terminator = terminator
+        self.writer = None
+        self.buffer = OutboundBuffer(buffer_size, terminator=terminator)
+
+    def is_connected(self):
+        return self.writer is not None
+
+    def attach(self, writer):
+        self.writer = writer
+        if len(self.buffer) > 0:
+            log.info("Flushing %s interface: %s", self.name, self.buffer.stats())
+            pending = self.buffer.take()
+            writer.writelines(["{}{}".format(msg, self.terminator).encode() for msg, sent in pending])
+            for msg, sent in pending:
+                if sent is not None:
+                    sent()
+
+    def detach(self):
+        self.writer = None
+
+    def write(self, msg, sent=None):
+        if self.writer is None:
+            log.debug("Placed %s in %s queue", msg, self.name)
+            self.buffer.put(msg, sent)
+            return False
+        self.writer.write("{}{}".format(msg, self.terminator).encode())
+        return True
+
+    #writer task entry point, waits for the transport buffer to drain so a slow sink backs up into its router queue.
+    #returns False when msg was only buffered, sent is then called when the next attach flushes it
+    async def send(self, msg, sent=None):
+        writer = self.writer
+        if self.write(msg, sent):
+            await writer.drain()
+            return True
+        return False
+
+
+'''
+    Class AsyncCommandLink is the Arduino link. Like SerialPump it keeps a window of commands in flight
+    and waits for acknowledgements before sending more, so moves queue up in the Arduino's receive buffer
+'''
+class AsyncCommandLink(AsyncLink):
+
+    def __init__(self, name, terminator="", buffer_size=256, window=None):
+        AsyncLink.__init__(self, name, terminator, buffer_size)
+        self.window = window or CommandWindow()
+        #created on first use so it belongs to the running loop
+        self.acknowledged = None
+
+    def attach(self, writer):
+        self.window.reset()
+        AsyncLink.attach(self, writer)
+
+    def acknowledge(self, line):
+        if self.window.acknowledge(line) and self.acknowledged is not None:
+            self.acknowledged.set()
+
+    async def send(self, msg, sent=None):
+        if self.acknowledged is None:
+            self.acknowledged = asyncio.Event()
+        size = len(msg) + len(self.terminator)
+        while self.is_connected() and not self.window.fits(size):
+            self.acknowledged.clear()
+            try:
+                await asyncio.wait_for(self.acknowledged.wait(), self.window.next_deadline())
+            except asyncio.TimeoutError:
+                log.warning("No acknowledgement for %s, releasing its slot", self.window.expire())
+        if self.is_connected():
+            self.window.sent(msg, size)
+        return await AsyncLink.send(self, msg, sent)
+
+
+class AsyncCoordinator(object):
+
+    '''
+        parameters
+            pc_wrapper, bt_wrapper, ar_wrapper - wrappers whose server sockets and serial port are already set up
+            camera_endpoint - pipe to the capture thread. receives robot status, replies once captured
+            recog_endpoint - pipe from the recognition thread carrying arrow reports for the PC
+    '''
+    def __init__(self, pc_wrapper, bt_wrapper, ar_wrapper, camera_endpoint=None, recog_endpoint=None):
+        self.pc_wrapper = pc_wrapper
+        self.bt_wrapper = bt_wrapper
+        self.ar_wrapper = ar_wrapper
+        self.camera_endpoint = camera_endpoint
+        self.recog_endpoint = recog_endpoint
+        self.exploration_mode = True
+        self.pc_link = AsyncLink("PC", "\n")
+        self.bt_link = AsyncLink("BT", "\n")
+        self.ar_link = AsyncCommandLink("Arduino", "\n")
+        self.router = None
+        self.tracer = Tracer()
+        #arrows already sent to the PC, so repeat sightings are held back
+        self.arrows = ArrowRegistry(ARROW_CONFIRMATIONS, FORWARD_ALL_ARROWS)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        #each destination gets a bounded queue and a writer task so a stalled sink never blocks a reader
+        self.router = build_router(AsyncDestination, self.pc_link.send, self.bt_link.send, self.ar_link.send, tracer=self.tracer)
+        self.router.start()
+        serve_control(self.tracer, self.router)
+        loop.add_signal_handler(signal.SIGUSR1, lambda: log.info("%s", self.tracer.report(self.router)))
+        pc_server = await asyncio.start_server(self.handle_pc, sock=self.pc_wrapper.get_socket())
+        #pybluez sockets are not socket.socket instances, duplicate the listening fd into one asyncio accepts.
+        #the original socket stays open so the SDP advertisement is kept
+        bt_socket = socket.socket(fileno=os.dup(self.bt_wrapper.server_socket.fileno()))
+        bt_server = await asyncio.start_server(self.handle_bluetooth, sock=bt_socket)
+        if self.recog_endpoint is not None:
+            loop.add_reader(self.recog_endpoint.fileno(), self.forward_arrows)
+        log.info("Async coordinator running...")
+        async with pc_server, bt_server:
+            await self.serve_arduino()
+
+    async def handle_pc(self, reader, writer):
+        log.info("Got a connection from %s", writer.get_extra_info("peername"))
+        self.pc_link.attach(writer)
+        try:
+            while 1:
+                line = await reader.readline()
+                received = self.tracer.now()
+                if not line.endswith(b"\n"):
+                    raise ConnectionResetError("Malformed string received:{}".format(line))
+                msg = line[:-1].decode('utf-8')
+                log.debug("RECEIVED FROM PC INTERFACE:%s.", msg)
+                route = self.router.match("pc", msg)
+                if(route is None):
+                    raise ConnectionResetError("Malformed string received: {}".format(msg))
+                if(route.destination == "camera"):
+                    if(self.exploration_mode):
+                        await self.capture(msg[3:], received)
+                else:
+                    self.router.forward(route, msg, received)
+                log.debug("Finished Processing PC:%s", msg)
+        except Exception as e:
+            log.warning("Unexpected Disconnect for PC occurred. The following error occurred: %s. Awaiting reconnection...", e)
+            log.info("Route stats:\n%s", self.router.report())
+        finally:
+            self.pc_link.detach()
+            writer.close()
+
+    async def handle_bluetooth(self, reader, writer):
+        log.info("Accepted BlueTooth Connection from %s", writer.get_extra_info("peername"))
+        self.bt_link.attach(writer)
+        try:
+            while 1:
+                #the tablet newline frames its messages
+                line = await reader.readline()
+                received = self.tracer.now()
+                if not line.endswith(b"\n"):
+                    raise ConnectionResetError("Bluetooth connection closed")
+                msg = line.decode('utf-8').strip()
+                if(not msg):
+                    continue
+                log.debug("RECEIVED FROM BT INTERFACE: %s.", msg)
+                if(msg=="al_starte"):
+                    self.exploration_mode = True
+                    log.info("Mode: Exploration")
+                    self.arrows.reset()
+                elif(msg=="al_startf"):
+                    self.exploration_mode = False
+                    log.info("Mode: Fastest")
+                    dump_arrows(self.arrows)
+                self.router.dispatch("bt", msg, received)
+                log.debug("Finished Processing BT: %s", msg)
+        except Exception as e:
+            log.warning("Unexpected Disconnect for Bluetooth occurred. The following error occurred: %s. Awaiting reconnection...", e)
+            log.info("Route stats:\n%s", self.router.report())
+        finally:
+            self.bt_link.detach()
+            writer.close()
+
+    #opens the serial port as a pair of non-blocking pipe transports on duplicated fds
+    async def open_arduino(self, ser):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        read_pipe = open(os.dup(ser.fileno()), 'rb', buffering=0)
+        write_pipe = open(os.dup(ser.fileno()), 'wb', buffering=0)
+        read_transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), read_pipe)
+        write_transport, write_protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, write_pipe)
+        writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+        return reader, read_transport, writer
+
+    async def serve_arduino(self):
+        loop = asyncio.get_running_loop()
+        ser = self.ar_wrapper.get_connection()
+        while 1:
+            reader, read_transport, writer = await self.open_arduino(ser)
+            self.ar_link.attach(writer)
+            try:
+                while 1:
+                    line = await reader.readline()
+                    received = self.tracer.now()
+                    if not line:
+                        raise ConnectionResetError("Arduino closed")
+                    msg = line.decode('ascii',errors='ignore').strip() #aruino using println to send so need remove \r\n
+                    log.debug("RECEIVED FROM ARDUINO INTERFACE: %s.", msg)
+                    self.ar_link.acknowledge(msg)
+                    self.router.dispatch("arduino", msg, received)
+                    log.debug("Finished Processing AR: %s", msg)
+            except Exception as e:
+                log.warning("Unexpected Disconnect occurred from arduino: %s, trying to reconnect...", e)
+            self.router.pause("arduino", REJECT_DURING_RECONNECT)
+            self.ar_link.detach()
+            read_transport.close()
+            writer.close()
+            ser.close()
+            #reconnect blocks on the device watcher, keep it off the loop
+            ser = await loop.run_in_executor(None, self.ar_wrapper.reconnect)
+            self.router.resume("arduino")
+
+    #sends robot status to the capture thread and waits at most 1 second for the capture acknowledgement.
+    #only the PC handler waits here, so the robot does not move before the frame is taken while the other links keep flowing
+    async def capture(self, robot_status, received=None):
+        loop = asyncio.get_running_loop()
+        captured = loop.create_future()
+        fd = self.camera_endpoint.fileno()
+        self.camera_endpoint.send(robot_status)
+        self.tracer.capture_requested(robot_status, received)
+        loop.add_reader(fd, lambda: captured.done() or captured.set_result(True))
+        try:
+            await asyncio.wait_for(captured, 1)
+            #clear the received message
+            self.camera_endpoint.recv()
+            self.tracer.capture_acknowledged(robot_status, received)
+        except asyncio.TimeoutError:
+            log.warning("Capture for %s not acknowledged within 1 second", robot_status)
+        finally:
+            loop.remove_reader(fd)
+
+    #called by the loop whenever the recognition pipe is readable
+    def forward_arrows(self):
+        while self.recog_endpoint.poll():
+            robot_status, msg = self.recog_endpoint.recv()
+            self.tracer.capture_result(robot_status, msg)
+            msg = self.arrows.report(msg)
+            if(msg is not None and not self.router.send("pc", msg)):
+                self.arrows.forget(msg)
+
+
+#the wrappers default to the robot's devices, the simulation harness passes in stand-ins
+def initialize_async_listeners(camera_endpoint=None, recog_endpoint=None, pc_wrapper=None, bt_wrapper=None, ar_wrapper=None):
+    setup_logging()
+    pc_wrapper = pc_wrapper or PcWrapper()
+    bt_wrapper = bt_wrapper or BluetoothWrapper()
+    #AsyncCommandLink writes the port, a pump thread would only hold a window nothing acknowledges
+    ar_wrapper = ar_wrapper or ArduinoWrapper(pump=False)
+    coordinator = AsyncCoordinator(pc_wrapper, bt_wrapper, ar_wrapper, camera_endpoint, recog_endpoint)
+    asyncio.run(coordinator.run())
+
+
+def main():
+
+    listener_endpoint_pc, camera_endpoint = Pipe()
+    listener_endpoint_rpi, recog_endpoint = Pipe()
+
+    listener_process = Process(target=initialize_async_listeners,args=(listener_endpoint_pc,listener_endpoint_rpi))
+    opencv_process = Process(target=initialize_opencv,args=(camera_endpoint,recog_endpoint))
+
+    #set daemon so that when main process ends the child processeswill die also
+    listener_process.daemon = True
+    #daemon processes cannot start the recognition workers, so this one is terminated on the way out instead
+    opencv_process.daemon = False
+
+    listener_process.start()
+    opencv_process.start()
+
+    try:
+        listener_process.join()
+        opencv_process.join()
+    finally:
+        opencv_process.terminate()
+
+#required
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import os
+import sys
+import numpy
+import cv2 as cv
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor, STREAM_TIMEOUT
+from frame_stream import FrameStream
+
+'''
+    Capture to result latency of the JPEG and in-memory capture paths
+
+    jpeg is the old path: the frame is written to capture/<status>.jpg and recognition reads it back and
+    decodes it. memory captures into a frame ring slot that recognition reads in place. luma is memory
+    with YUV captures, recognized on the Y plane alone. With --camera the frames come from the Pi camera,
+    otherwise the 1920x1080 captures in rpi/opencv/test are replayed and the camera's part is a JPEG
+    written to capture/ or a copy of the raw frame into the ring. With --camera, stream and stream-luma
+    also time the capture_stream path, answering each request from the video port kept recording
+
+    Written is the raw frame the camera puts in the ring, read what recognition takes out of it
+'''
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opencv", "test", "*.jpg")
+
+#captures frame index of the run for robot_status, returns its ring sequence or None if it went to a file
+def camera_capture(camera, processor, mode, robot_status, index):
+    if mode == "jpeg":
+        camera.capture("{}/capture/{}.jpg".format(sys.path[0], robot_status), use_video_port=True)
+        return None
+    sequence, frame = processor.ring.reserve()
+    camera.capture(frame, format='yuv' if processor.luma else 'bgr', use_video_port=True)
+    processor.ring.publish(sequence, robot_status, timer())
+    return sequence
+
+def replay_capture(frames, yuv_frames, processor, mode, robot_status, index):
+    image = frames[index % len(frames)]
+    if mode == "jpeg":
+        cv.imwrite("{}/capture/{}.jpg".format(sys.path[0], robot_status), image)
+        return None
+    sequence, frame = processor.ring.reserve()
+    if processor.luma:
+        #the whole YUV frame, as the camera would write it
+        numpy.copyto(frame, yuv_frames[index % len(frames)])
+    else:
+        numpy.copyto(frame[:image.shape[0], :image.shape[1]], image)
+    processor.ring.publish(sequence, robot_status, timer())
+    return sequence
+
+#a padded YUV420 frame of image, its Y plane and grey chroma
+def yuv_frame(image, shape):
+    frame = numpy.full(shape, 128, dtype=numpy.uint8)
+    frame[:image.shape[0], :image.shape[1]] = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    return frame
+
+def run(capture, processor, mode, count):
+    cnts = processor.load_reference_contours()
+    captures = []
+    results = []
+    found = 0
+    for index in range(count):
+        robot_status = "{},{},u".format(index % 15, index % 20)
+        start = timer()
+        sequence = capture(processor, mode, robot_status, index)
+        captured = timer()
+        arrows = processor.getImageLocation(cnts, processor.load_frame(robot_status, sequence))
+        end = timer()
+        captures.append(captured - start)
+        results.append(end - start)
+        found += len(arrows)
+    return sorted(captures), sorted(results), found
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture to result latency of the capture paths")
+    parser.add_argument("--count", type=int, default=50, help="captures per path")
+    parser.add_argument("--camera", action="store_true", help="capture from the Pi camera instead of replaying test images")
+    args = parser.parse_args()
+
+    os.makedirs("{}/capture".format(sys.path[0]), exist_ok=True)
+    processors = {"bgr": ImageProcessor(), "luma": ImageProcessor(luma=True)}
+    camera = None
+    if args.camera:
+        from picamera import PiCamera
+        from img_recognition import RESOLUTION
+        #the stream modes compare frame timestamps with camera.timestamp, see ImageProcessor.capture_stream
+        camera = PiCamera(resolution=RESOLUTION, clock_mode='raw')
+        capture = lambda *job: camera_capture(camera, *job)
+    else:
+        frames = [cv.imread(path, cv.IMREAD_UNCHANGED) for path in sorted(glob.glob(TEST_IMAGES))]
+        yuv_frames = [yuv_frame(image, processors["luma"].ring.images[0].shape) for image in frames]
+        capture = lambda *job: replay_capture(frames, yuv_frames, *job)
+
+    try:
+        print("{:<12} {:>16} {:>16} {:>16} {:>16} {:>8} {:>12} {:>9}".format(
+            "path", "capture p50 (ms)", "result p50 (ms)", "result p99 (ms)", "result max (ms)", "arrows", "written (MB)", "read (MB)"))
+        for mode in ("jpeg", "memory", "luma", "stream", "stream-luma") if args.camera else ("jpeg", "memory", "luma"):
+            processor = processors["luma" if mode.endswith("luma") else "bgr"]
+            if mode.startswith("stream"):
+                #the camera keeps recording from here on, so these paths go last
+                if camera.recording:
+                    camera.stop_recording()
+                stream = FrameStream(camera, processor.ring)
+                camera.start_recording(stream, format='yuv' if processor.luma else 'bgr')
+                capture = lambda processor, mode, robot_status, index: stream.capture(robot_status, STREAM_TIMEOUT)
+            captures, results, found = run(capture, processor, mode, args.count)
+            slot = processor.ring.images[0]
+            picture = processor.ring.read(processor.ring.latest()).image if mode != "jpeg" else None
+            print("{:<12} {:>16.1f} {:>16.1f} {:>16.1f} {:>16.1f} {:>8} {:>12} {:>9}".format(
+                mode, percentile(captures, 50) * 1e3,
+                percentile(results, 50) * 1e3, percentile(results, 99) * 1e3, results[-1] * 1e3, found,
+                "-" if picture is None else "{:.2f}".format(slot.nbytes / 1e6), "-" if picture is None else "{:.2f}".format(picture.nbytes / 1e6)))
+    finally:
+        if camera is not None:
+            camera.close()
+        for processor in processors.values():
+            processor.close()
+
+if __name__ == '__main__':
+    main()
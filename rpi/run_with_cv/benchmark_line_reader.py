@@ -0,0 +1,83 @@
+import argparse
+import socket
+import threading
+from timeit import default_timer as timer
+from line_reader import LineReader
+
+'''
+    Loopback benchmark of the PC link framing
+
+    A writer thread streams newline terminated commands shaped like the algorithm's traffic over a local
+    TCP connection with TCP_NODELAY, same as PcWrapper. Each message carries its send timestamp so the
+    reader can compute per message latency. Compares the old recv(1) loop against LineReader
+'''
+
+COMMANDS = ["arw;10", "ara;1", "ard;1", "rpi4,6,l", "anmdf{ffff,0000}"]
+
+def old_read_loop(conn, count):
+    latencies = []
+    for _ in range(count):
+        msg = ""
+        while(1):
+            char = conn.recv(1).decode('utf-8')
+            if(not char):
+                raise ConnectionResetError("Malformed string received:{}".format(msg))
+            if(char == "\n"):
+                break
+            msg += char
+        latencies.append(timer() - float(msg.rsplit("|", 1)[1]))
+    return latencies
+
+def line_reader_loop(conn, count):
+    latencies = []
+    reader = LineReader.from_socket(conn)
+    while len(latencies) < count:
+        for msg in reader.read_lines():
+            latencies.append(timer() - float(msg.rsplit("|", 1)[1]))
+    return latencies
+
+def write_messages(conn, count, burst):
+    for i in range(0, count, burst):
+        now = timer()
+        batch = "".join("{}|{!r}\n".format(COMMANDS[j % len(COMMANDS)], now) for j in range(i, min(count, i + burst)))
+        conn.sendall(batch.encode())
+
+def run(read_loop, count, burst):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen(1)
+    client = socket.create_connection(server_socket.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn, addr = server_socket.accept()
+    try:
+        writer = threading.Thread(target=write_messages, args=(client, count, burst))
+        start = timer()
+        writer.start()
+        latencies = read_loop(conn, count)
+        end = timer()
+        writer.join()
+    finally:
+        client.close()
+        conn.close()
+        server_socket.close()
+    return end - start, sorted(latencies)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark for PC link framing")
+    parser.add_argument("--count", type=int, default=20000, help="messages per run")
+    parser.add_argument("--burst", type=int, default=10, help="messages written per sendall")
+    args = parser.parse_args()
+
+    print("{:<12} {:>12} {:>12} {:>12} {:>12}".format("reader", "msgs/sec", "p50 (us)", "p99 (us)", "max (us)"))
+    for name, read_loop in (("recv(1)", old_read_loop), ("LineReader", line_reader_loop)):
+        elapsed, latencies = run(read_loop, args.count, args.burst)
+        print("{:<12} {:>12.0f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+            name, args.count / elapsed,
+            percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6, latencies[-1] * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import glob
+import cv2 as cv
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor
+from benchmark_capture import TEST_IMAGES
+from benchmark_recognition import ground_truth
+
+'''
+    Accuracy against speed of coarse to fine arrow detection
+
+    Runs getImageLocation over the captures in rpi/opencv/test at full resolution and with each pyramid
+    scale. The file names give the arrows in the picture, e.g. image10l20c30r.jpg has arrows 10cm to the
+    left, 20cm in the center and 30cm to the right. Reports time per frame, how many frames match the
+    file name and how many give the same arrows as the full resolution search
+'''
+
+def run(processor, cnts, frames, repeat):
+    times = []
+    found = []
+    for path, frame in frames:
+        for _ in range(repeat):
+            start = timer()
+            arrows = processor.getImageLocation(cnts, frame)
+            times.append(timer() - start)
+        found.append(set(arrows))
+    return sorted(times), found
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy against speed of coarse to fine arrow detection")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 0.25, 0.125], help="pyramid scales to compare with full resolution")
+    parser.add_argument("--margin", type=int, default=8, help="full resolution pixels around each candidate")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per image")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(TEST_IMAGES))
+    frames = [(path, cv.imread(path, cv.IMREAD_UNCHANGED)) for path in paths]
+    expected = [set(ground_truth(path) or ()) for path in paths]
+    processor = ImageProcessor(slots=1)
+    cnts = processor.load_reference_contours()
+    try:
+        baseline = None
+        print("{:<8} {:>10} {:>10} {:>10} {:>14} {:>14}".format("scale", "mean (ms)", "p99 (ms)", "speedup", "match name", "match full"))
+        for scale in [None] + args.scales:
+            processor.pyramid_scale = scale
+            processor.pyramid_margin = args.margin
+            times, found = run(processor, cnts, frames, args.repeat)
+            mean = sum(times) / len(times)
+            if baseline is None:
+                baseline = (mean, found)
+            print("{:<8} {:>10.1f} {:>10.1f} {:>9.1f}x {:>14} {:>14}".format(
+                scale or "full", mean * 1e3, percentile(times, 99) * 1e3, baseline[0] / mean,
+                "{}/{}".format(sum(1 for a, b in zip(found, expected) if a == b), len(frames)),
+                "{}/{}".format(sum(1 for a, b in zip(found, baseline[1]) if a == b), len(frames))))
+    finally:
+        processor.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import glob
+import json
+import os
+import re
+import resource
+import sys
+import tracemalloc
+import cv2 as cv
+from collections import Counter
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor
+from distance_bands import GRID_CM, camera_grid
+
+'''
+    Recognition benchmark and accuracy suite over the image corpora in rpi/opencv
+
+    File names carry the arrows in each picture:
+        test/image10l20c30r.jpg     arrows on grids 1 left, 2 center and 3 right
+        fixed_length/image40cm.jpg  one arrow 40cm from the camera, in the center
+        testbed/20cm.jpg            the same, with or without the image prefix
+    test names distances on the grid, in 10cm steps from grid 0. fixed_length and testbed name the
+    distance from the camera, which is turned into a grid with the offset calibrate_bands.py uses, see
+    distance_bands.camera_grid. Images whose names say nothing, e.g. testbed/main3.jpg, or whose arrow is
+    not on a grid, e.g. fixed_length/image10cm.jpg in front of grid 0, are left out. Arrows on grids past
+    the last distance band count against recall
+
+    Runs ImageProcessor.getImageLocation and arrow_contour.getImageLocation over every labelled image and
+    reports per stage timings, frames/sec, latency percentiles, peak memory and precision/recall. Located
+    is the share of arrows found at the right position whatever distance they were given, it tells a
+    detector that misses arrows from one that finds them outside the distance bands. --orb adds the
+    feature matching detector, e.g. against the contour one on the camera distance corpora
+
+        python3 benchmark_recognition.py --orb --corpora fixed_length
+
+    --output
+    writes everything, including the arrows found in each image, as JSON to diff against a later run,
+    e.g.
+
+        python3 benchmark_recognition.py --output before.json
+        python3 benchmark_recognition.py --output after.json --compare before.json
+'''
+
+OPENCV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opencv")
+CORPORA = ["test", "fixed_length", "testbed"]
+POSITIONS = {"l": "left", "c": "center", "r": "right"}
+
+sys.path.append(OPENCV_DIR)
+import arrow_contour
+
+
+#corpora whose names give the distance from the camera, the others give it on the grid
+CAMERA_DISTANCE_CORPORA = ("fixed_length", "testbed")
+
+#grid of a distance named on the grid, 10cm per grid from grid 0
+def named_grid(cm):
+    return cm // GRID_CM
+
+#expected (distance in grids, position) of each arrow in the image at path, None if the name does not say
+def ground_truth(path):
+    corpus = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith("image"):
+        name = name[len("image"):]
+    to_grid = camera_grid if corpus in CAMERA_DISTANCE_CORPORA else named_grid
+    single = re.match(r"^(\d+)cm$", name)
+    if single:
+        arrows = [(to_grid(int(single.group(1))), "center")]
+    elif re.match(r"^(\d+[lcr])+$", name):
+        arrows = sorted((to_grid(int(distance)), POSITIONS[position]) for distance, position in re.findall(r"(\d+)([lcr])", name))
+    else:
+        return None
+    if any(distance is None for distance, position in arrows):
+        return None
+    return arrows
+
+def labelled_images(corpora):
+    images = []
+    for corpus in corpora:
+        for path in sorted(glob.glob(os.path.join(OPENCV_DIR, corpus, "*.jpg"))):
+            expected = ground_truth(path)
+            if expected is not None:
+                images.append((os.path.join(corpus, os.path.basename(path)), path, expected))
+    return images
+
+
+'''
+    A detector runs stage by stage on a decoded frame, returning the arrows found and the seconds spent in
+    each stage
+'''
+class ImageProcessorDetector(object):
+
+    def __init__(self, pyramid_scale=None, detector="contour"):
+        self.processor = ImageProcessor(slots=1, pyramid_scale=pyramid_scale, detector=detector)
+        self.cnts = self.processor.load_reference_contours()
+        self.name = "img_recognition" if pyramid_scale is None else "img_recognition@{}".format(pyramid_scale)
+        if detector != "contour":
+            self.name = "img_recognition/{}".format(detector)
+
+    def detect(self, frame):
+        if self.processor.detector == "orb":
+            start = timer()
+            outlines = self.processor.matcher.locate(frame)
+            matched = timer()
+            arrows = self.processor.classifyOutlines(outlines, frame.shape[1], frame.shape[0])
+            end = timer()
+            return arrows, {"match": matched - start, "classify": end - matched}
+        if self.processor.pyramid_scale:
+            start = timer()
+            arrows = self.processor.getImageLocation(self.cnts, frame)
+            return arrows, {"pyramid": timer() - start}
+        start = timer()
+        thresholded_img = self.processor.threshold(frame)
+        thresholded = timer()
+        captured_cnts = cv.findContours(thresholded_img, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
+        found = timer()
+        arrows = self.processor.classifyContours(self.cnts, captured_cnts, frame.shape[1], frame.shape[0])
+        end = timer()
+        return arrows, {"threshold": thresholded - start, "contours": found - thresholded, "classify": end - found}
+
+    def close(self):
+        self.processor.close()
+
+
+#the preprocessing arrow_contour.main does before getImageLocation
+class ArrowContourDetector(object):
+
+    name = "arrow_contour"
+
+    def __init__(self):
+        self.sample = cv.imread(os.path.join(OPENCV_DIR, "testbed", "arrow_real.jpg"), cv.IMREAD_GRAYSCALE)
+
+    def detect(self, frame):
+        start = timer()
+        gray = cv.cvtColor(cv.GaussianBlur(frame, (5, 5), 2), cv.COLOR_BGR2GRAY)
+        preprocessed = timer()
+        arrows = arrow_contour.getImageLocation(self.sample, gray)
+        end = timer()
+        return arrows, {"preprocess": preprocessed - start, "detect": end - preprocessed}
+
+    def close(self):
+        pass
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+#true positives, false positives and false negatives of found against expected, as multisets
+def score(found, expected):
+    found, expected = Counter(found), Counter(expected)
+    true_positives = sum((found & expected).values())
+    return true_positives, sum(found.values()) - true_positives, sum(expected.values()) - true_positives
+
+#expected arrows with an arrow found at their position, at any distance
+def located(found, expected):
+    return sum((Counter(position for distance, position in found) & Counter(position for distance, position in expected)).values())
+
+def run(detector, images, repeat):
+    latencies = []
+    stages = Counter()
+    results = {}
+    totals = [0, 0, 0]
+    located_arrows = 0
+    decode = 0.0
+    tracemalloc.start()
+    for name, path, expected in images:
+        start = timer()
+        frame = cv.imread(path, cv.IMREAD_UNCHANGED)
+        decode += timer() - start
+        for _ in range(repeat):
+            start = timer()
+            arrows, timings = detector.detect(frame)
+            latencies.append(timer() - start)
+            stages.update(timings)
+        found = sorted(tuple(arrow) for arrow in arrows)
+        counts = score(found, expected)
+        totals = [total + count for total, count in zip(totals, counts)]
+        located_arrows += located(found, expected)
+        results[name] = {"expected": expected, "found": found}
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    true_positives, false_positives, false_negatives = totals
+    runs = len(latencies)
+    return {
+        "images": len(images),
+        "frames_per_sec": runs / sum(latencies),
+        "latency_ms": {"p50": percentile(latencies, 50) * 1e3, "p90": percentile(latencies, 90) * 1e3, "p99": percentile(latencies, 99) * 1e3, "max": latencies[-1] * 1e3},
+        "stage_ms": dict((stage, seconds / runs * 1e3) for stage, seconds in sorted(stages.items())),
+        "decode_ms": decode / len(images) * 1e3,
+        "traced_peak_mb": peak / 1e6,
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+        "precision": true_positives / float(true_positives + false_positives) if true_positives + false_positives else 1.0,
+        "recall": true_positives / float(true_positives + false_negatives) if true_positives + false_negatives else 1.0,
+        "located": located_arrows / float(true_positives + false_negatives) if true_positives + false_negatives else 1.0,
+        "results": results
+    }
+
+def print_report(report):
+    print("{:<22} {:>7} {:>10} {:>9} {:>9} {:>9} {:>10} {:>10} {:>8} {:>7}".format(
+        "detector", "images", "frames/s", "p50 (ms)", "p99 (ms)", "max (ms)", "precision", "recall", "located", "MB"))
+    for name, result in report["detectors"].items():
+        print("{:<22} {:>7} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.3f} {:>10.3f} {:>8.3f} {:>7.1f}".format(
+            name, result["images"], result["frames_per_sec"], result["latency_ms"]["p50"], result["latency_ms"]["p99"],
+            result["latency_ms"]["max"], result["precision"], result["recall"], result["located"], result["traced_peak_mb"]))
+    print("")
+    for name, result in report["detectors"].items():
+        print("{:<22} decode {:.1f}ms, {}".format(name, result["decode_ms"], ", ".join("{} {:.1f}ms".format(stage, ms) for stage, ms in result["stage_ms"].items())))
+    print("peak resident memory {:.1f} MB".format(report["max_rss_mb"]))
+
+#prints what changed since an earlier --output file
+def print_comparison(report, previous):
+    print("")
+    print("Compared with {}".format(previous["path"]))
+    for name, result in report["detectors"].items():
+        before = previous["detectors"].get(name)
+        if before is None:
+            print("{:<22} new detector".format(name))
+            continue
+        print("{:<22} frames/s {:+.1f}, p50 {:+.1f}ms, precision {:+.3f}, recall {:+.3f}".format(
+            name, result["frames_per_sec"] - before["frames_per_sec"], result["latency_ms"]["p50"] - before["latency_ms"]["p50"],
+            result["precision"] - before["precision"], result["recall"] - before["recall"]))
+        for image, outcome in sorted(result["results"].items()):
+            earlier = before["results"].get(image)
+            if earlier is not None and [list(arrow) for arrow in outcome["found"]] != earlier["found"]:
+                print("    {}: {} -> {}".format(image, earlier["found"], [list(arrow) for arrow in outcome["found"]]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition benchmark and accuracy suite over the rpi/opencv image corpora")
+    parser.add_argument("--corpora", nargs="+", default=CORPORA, help="directories under rpi/opencv to use")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per image")
+    parser.add_argument("--pyramid-scale", type=float, nargs="*", default=[], help="also run img_recognition with these pyramid scales")
+    parser.add_argument("--orb", action="store_true", help="also run img_recognition with the experimental feature matching detector")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    images = labelled_images(args.corpora)
+    detectors = [ImageProcessorDetector()] + [ImageProcessorDetector(scale) for scale in args.pyramid_scale] + \
+        ([ImageProcessorDetector(detector="orb")] if args.orb else []) + [ArrowContourDetector()]
+    report = {"corpora": args.corpora, "repeat": args.repeat, "detectors": {}}
+    try:
+        for detector in detectors:
+            report["detectors"][detector.name] = run(detector, images, args.repeat)
+    finally:
+        for detector in detectors:
+            detector.close()
+    #kilobytes on Linux
+    report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        previous["path"] = args.compare
+        print_comparison(report, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import glob
+import os
+import threading
+import numpy
+import cv2 as cv
+from queue import Queue
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor
+from recognition_pool import RecognitionPool
+from benchmark_capture import TEST_IMAGES
+
+'''
+    Recognition throughput on a burst of captures for a range of worker counts
+
+    The 1920x1080 captures in rpi/opencv/test are written into a frame ring all at once, as if the
+    robot had captured them back to back, and handed to a RecognitionPool. Reports frames per second and
+    capture to result latency for each worker count, with the single threaded identify loop as the baseline
+'''
+
+#stands in for the pipe to the listener, recording when the last result of each capture arrives
+class ResultRecorder(object):
+
+    def __init__(self):
+        self.expect(0)
+
+    #starts over, waiting for count captures
+    def expect(self, count):
+        self.count = count
+        self.finished = {}
+        self.order = []
+        self.all_done = threading.Event()
+
+    def send(self, result):
+        robot_status, msg = result
+        if robot_status not in self.finished:
+            self.order.append(robot_status)
+        self.finished[robot_status] = timer()
+        if len(self.finished) == self.count:
+            self.all_done.set()
+
+#writes a burst of count frames into the ring and returns their jobs and capture times
+def capture_burst(processor, frames, count, prefix):
+    jobs = []
+    for index in range(count):
+        image = frames[index % len(frames)]
+        robot_status = "{},{},u".format(prefix, index)
+        sequence, frame = processor.ring.reserve()
+        numpy.copyto(frame[:image.shape[0], :image.shape[1]], image)
+        processor.ring.publish(sequence, robot_status, timer())
+        jobs.append((robot_status, sequence, timer()))
+    return jobs
+
+def run(processor, frames, workers, count):
+    recorder = ResultRecorder()
+    jobs = Queue()
+    pool = None
+    if workers:
+        pool = RecognitionPool(processor.ring.name, workers)
+        pool.start(recorder)
+        dispatcher = threading.Thread(target=pool.dispatch, args=(jobs,))
+    else:
+        processor.jobs = jobs
+        dispatcher = threading.Thread(target=processor.identify, args=(recorder,))
+    dispatcher.daemon = True
+    dispatcher.start()
+    try:
+        #one frame per worker first, so worker start up is not measured
+        recorder.expect(workers or 1)
+        for robot_status, sequence, captured in capture_burst(processor, frames, workers or 1, "0"):
+            jobs.put((robot_status, sequence, None))
+        recorder.all_done.wait()
+        recorder.expect(count)
+        burst = capture_burst(processor, frames, count, "1")
+        start = timer()
+        for robot_status, sequence, captured in burst:
+            jobs.put((robot_status, sequence, None))
+        recorder.all_done.wait()
+        end = timer()
+    finally:
+        if pool is not None:
+            pool.close()
+    latencies = sorted(recorder.finished[robot_status] - captured for robot_status, sequence, captured in burst)
+    in_order = recorder.order == [robot_status for robot_status, sequence, captured in burst]
+    return count / (end - start), latencies, in_order
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition pool throughput on a burst of captures")
+    parser.add_argument("--burst", type=int, default=16, help="captures per burst, also the frame ring size")
+    parser.add_argument("--workers", type=int, nargs="+", default=list(range(1, (os.cpu_count() or 1) + 1)), help="worker counts to try")
+    args = parser.parse_args()
+
+    frames = [cv.imread(path, cv.IMREAD_UNCHANGED) for path in sorted(glob.glob(TEST_IMAGES))]
+    processor = ImageProcessor(slots=args.burst)
+    try:
+        print("{:<10} {:>12} {:>12} {:>12} {:>10}".format("workers", "frames/sec", "p50 (ms)", "max (ms)", "in order"))
+        for workers in [0] + args.workers:
+            rate, latencies, in_order = run(processor, frames, workers, args.burst)
+            print("{:<10} {:>12.1f} {:>12.1f} {:>12.1f} {:>10}".format(
+                workers or "identify", rate, percentile(latencies, 50) * 1e3, latencies[-1] * 1e3, "yes" if in_order else "no"))
+    finally:
+        processor.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import numpy
+import cv2 as cv
+from img_recognition import ImageProcessor, MIN_POINTS
+from distance_bands import BandTable, BANDS_FILE, GRID_CM, CAMERA_OFFSET_CM
+
+'''
+    Calibrates the area ratio to distance bands from captures of an arrow at known distances
+
+    Each image is named after how far the arrow is from the camera, e.g. fixed_length/image40cm.jpg.
+    The largest contour in it that passes the recognizer's shape checks is taken as the arrow, and the
+    fraction of the frame it covers is fitted to the pinhole camera model
+
+        ratio = 1 / (slope * cm + intercept) ** 2
+
+    as a straight line through 1 / sqrt(ratio), the way curve_fitting.py fits the Sharp IR sensors.
+    Grid g is offset + 10 * g cm from the camera, and its band is the ratios the model gives for
+    margin cm inside either of its edges, so an arrow near a grid line is left out rather than put on
+    the wrong grid. The bands go to distance_bands.json for the recognizer, e.g.
+
+        python3 calibrate_bands.py
+        python3 calibrate_bands.py ~/mount2/*cm.jpg --offset 15 --output mount2.json
+'''
+
+OPENCV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opencv")
+CALIBRATION_IMAGES = os.path.join(OPENCV_DIR, "fixed_length", "image*cm.jpg")
+DISTANCE = re.compile(r"(\d+)cm$")
+
+
+#fraction of the frame the arrow in frame covers, None if nothing passes the shape checks
+def measure(processor, reference_contours, frame):
+    imgArea = frame.shape[0] * frame.shape[1]
+    captured_cnts = cv.findContours(processor.threshold(frame), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
+    ratios = []
+    for c in captured_cnts:
+        if len(c) < MIN_POINTS:
+            continue
+        approx = cv.approxPolyDP(c, processor.approx_epsilon * cv.arcLength(c, True), True)
+        if 6 <= len(approx) <= 8 and cv.matchShapes(reference_contours[0], c, 1, 0.0) < processor.match_threshold:
+            ratios.append(cv.contourArea(c) / imgArea)
+    return max(ratios) if ratios else None
+
+#slope and intercept of 1 / sqrt(ratio) against distances in cm
+def fit(distances, ratios):
+    slope, intercept = numpy.polyfit(distances, 1 / numpy.sqrt(ratios), 1)
+    return slope, intercept
+
+def model(slope, intercept, cm):
+    return 1 / (slope * cm + intercept) ** 2
+
+def bands(slope, intercept, grids, offset, margin):
+    table = []
+    for grid in range(grids):
+        near = offset + GRID_CM * grid - GRID_CM / 2.0 + margin
+        far = offset + GRID_CM * grid + GRID_CM / 2.0 - margin
+        #further is smaller
+        table.append((model(slope, intercept, far), model(slope, intercept, near), grid))
+    return BandTable(table)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the area ratio to distance bands to captures at known distances")
+    parser.add_argument("inputs", nargs="*", default=[CALIBRATION_IMAGES], help="globs of images named <cm>cm.jpg")
+    parser.add_argument("--grids", type=int, default=4, help="distances to report, from 0 out")
+    parser.add_argument("--offset", type=float, default=CAMERA_OFFSET_CM, help="cm from the camera to an arrow on the grid right in front of the robot")
+    parser.add_argument("--margin", type=float, default=1, help="cm either side of a grid line left out of both bands")
+    parser.add_argument("--output", default=BANDS_FILE, help="bands file to write")
+    args = parser.parse_args()
+
+    processor = ImageProcessor(slots=0, area_bands=[(0, 1)])
+    reference_contours = processor.load_reference_contours()
+    measured = {}
+    for path in sorted(path for entry in args.inputs for path in glob.glob(entry)):
+        distance = DISTANCE.search(os.path.splitext(os.path.basename(path))[0])
+        frame = cv.imread(path, cv.IMREAD_COLOR)
+        if distance is None or frame is None:
+            continue
+        ratio = measure(processor, reference_contours, frame)
+        if ratio is None:
+            sys.stderr.write("No arrow in {}, leaving it out\n".format(path))
+            continue
+        measured[os.path.basename(path)] = (int(distance.group(1)), ratio)
+    if len(measured) < 2:
+        sys.exit("Need arrows at two distances at least, found {}".format(len(measured)))
+
+    distances = numpy.array([cm for cm, ratio in measured.values()], dtype=float)
+    ratios = numpy.array([ratio for cm, ratio in measured.values()])
+    slope, intercept = fit(distances, ratios)
+    print("ratio = 1 / ({:.6f} * cm + {:.6f}) ** 2".format(slope, intercept))
+    print("{:<22} {:>6} {:>10} {:>10} {:>8}".format("image", "cm", "measured", "model", "error"))
+    for name, (cm, ratio) in sorted(measured.items(), key=lambda item: item[1][0]):
+        predicted = model(slope, intercept, cm)
+        print("{:<22} {:>6} {:>10.4f} {:>10.4f} {:>7.1f}%".format(name, cm, ratio, predicted, (predicted - ratio) / ratio * 100))
+
+    table = bands(slope, intercept, args.grids, args.offset, args.margin)
+    print("")
+    for low, high, grid in sorted(table.bands, key=lambda band: band[2]):
+        print("{:>3}cm {:.4f} - {:.4f}".format(grid * GRID_CM, low, high))
+    with open(args.output, "w") as f:
+        json.dump({
+            "bands": table.to_list(),
+            "model": {"slope": slope, "intercept": intercept},
+            "offset_cm": args.offset,
+            "margin_cm": args.margin,
+            "measured": dict((name, {"cm": cm, "ratio": ratio}) for name, (cm, ratio) in measured.items())
+        }, f, indent=2, sort_keys=True)
+    print("Wrote {}".format(args.output))
+
+if __name__ == '__main__':
+    main()
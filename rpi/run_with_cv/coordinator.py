@@ -1,3 +1,5 @@
+import os
+import sys
 import threading
 from multiprocessing import Process,Pipe
 from pc_interface import PcWrapper
@@ -5,13 +7,54 @@ from bluetooth_interface import BluetoothWrapper
 from arduino_interface import ArduinoWrapper
 from socket import SHUT_RDWR,timeout
 from bluetooth.btcommon import BluetoothError
-from img_recognition import ImageProcessor
+from img_recognition import ImageProcessor, RING_SLOTS
+from recognition_pool import RecognitionPool, WORKERS
+from frame_cache import CACHE_SIZE
+from line_reader import LineReader
+from router import build_router, Destination
+from arrow_registry import ArrowRegistry, CONFIRMATIONS
+from tracing import Tracer, serve_control, install_signal_handler
+from rpi_log import get_logger, setup as setup_logging
+
+log = get_logger("coordinator")
 
 #The main method
 
 exploration_mode = True
 exploration_lock = threading.Lock()
 
+#while the Arduino reconnects its queue holds moves by default. RPI_ARDUINO_GAP=reject drops them
+#instead, so commands the algorithm sent for a robot that has since reset are not run late
+REJECT_DURING_RECONNECT = os.environ.get("RPI_ARDUINO_GAP", "hold") == "reject"
+
+#frames go straight from the camera to recognition in memory. RPI_CAPTURE=stream keeps the video port
+#recording and answers requests with the next frame, RPI_CAPTURE=jpeg goes back to writing each one to
+#capture/<status>.jpg and reading it back. RPI_SAVE_CAPTURES=1 keeps the files as a side output
+CAPTURE_MODE = os.environ.get("RPI_CAPTURE", "memory")
+#RPI_LUMA=1 has the memory and stream modes capture YUV and recognize the Y plane alone, half the bytes
+#of a BGR frame from the camera and a third of them read by recognition
+LUMA = os.environ.get("RPI_LUMA") == "1"
+SAVE_CAPTURES = os.environ.get("RPI_SAVE_CAPTURES") == "1"
+#RPI_PYRAMID_SCALE=0.25 finds arrow candidates on a quarter size frame before searching them at full resolution
+PYRAMID_SCALE = float(os.environ["RPI_PYRAMID_SCALE"]) if os.environ.get("RPI_PYRAMID_SCALE") else None
+#RPI_DETECTOR=orb finds arrow cards by feature matching instead of classifying contours, see feature_matcher.
+#experimental, its recall on the benchmark corpora is still 0
+DETECTOR = os.environ.get("RPI_DETECTOR", "contour")
+#RPI_PREPROCESS=<file> swaps the blur and threshold before contours are found for a tune_preprocess.py chain
+PREPROCESS = os.environ.get("RPI_PREPROCESS")
+#recognition worker processes, 0 recognizes in a thread of the capture process
+RECOGNITION_WORKERS = int(os.environ.get("RPI_RECOGNITION_WORKERS", WORKERS))
+#RPI_RECORD=<file> records every frame captured in memory with its robot status, for replay_run.py
+RECORD = os.environ.get("RPI_RECORD")
+#robot statuses whose last result is reused for a near duplicate frame, RPI_FRAME_CACHE=0 recognizes every frame
+FRAME_CACHE = int(os.environ.get("RPI_FRAME_CACHE", CACHE_SIZE))
+#only new and newly confirmed arrows go to the PC. RPI_ARROWS=all sends every report, NOT FOUND included
+FORWARD_ALL_ARROWS = os.environ.get("RPI_ARROWS", "new") == "all"
+#sightings of an arrow before it is sent again as confirmed
+ARROW_CONFIRMATIONS = int(os.environ.get("RPI_ARROW_CONFIRMATIONS", CONFIRMATIONS))
+#the arrow summary is written here when exploration ends
+ARROW_SUMMARY = "{}/capture/arrows.json".format(sys.path[0])
+
 
 def main():
 
@@ -23,36 +66,65 @@ def main():
     
     #set daemon so that when main process ends the child processeswill die also
     listener_process.daemon = True
-    opencv_process.daemon = True
+    #daemon processes cannot start the recognition workers, so this one is terminated on the way out instead
+    opencv_process.daemon = False
 
     listener_process.start()
     opencv_process.start()
 
-    listener_process.join()
-    opencv_process.join()
+    try:
+        listener_process.join()
+        opencv_process.join()
+    finally:
+        opencv_process.terminate()
     pass
 
 def initialize_opencv(camera_endpoint=None,recog_endpoint=None):
-    cv_process = ImageProcessor()
-    capture_thread = threading.Thread(target=cv_process.capture_old,args=(camera_endpoint,))
-    process_thread = threading.Thread(target=cv_process.identify,args=(recog_endpoint,))
+    setup_logging()
+    #jpeg captures go through capture/<status>.jpg and need no frame ring
+    slots = 0 if CAPTURE_MODE == "jpeg" else RING_SLOTS
+    cv_process = ImageProcessor(save_captures=SAVE_CAPTURES, slots=slots, pyramid_scale=PYRAMID_SCALE, cache_size=FRAME_CACHE, record=RECORD, detector=DETECTOR, preprocess=PREPROCESS, luma=LUMA)
+    capture = {"jpeg": cv_process.capture_old, "stream": cv_process.capture_stream}.get(CAPTURE_MODE, cv_process.capture_frames)
+    recognizer = cv_process
+    if RECOGNITION_WORKERS > 0:
+        pool = recognizer = RecognitionPool(cv_process.ring.name if cv_process.ring is not None else None, RECOGNITION_WORKERS, cv_process.cache, save_captures=SAVE_CAPTURES, pyramid_scale=PYRAMID_SCALE, detector=DETECTOR, preprocess=PREPROCESS)
+        process_thread = threading.Thread(target=pool.run,args=(cv_process.jobs,recog_endpoint))
+    else:
+        process_thread = threading.Thread(target=cv_process.identify,args=(recog_endpoint,))
+    capture_thread = threading.Thread(target=capture,args=(camera_endpoint,))
 
     capture_thread.start()
     process_thread.start()
 
-    capture_thread.join()
-    process_thread.join()
+    try:
+        capture_thread.join()
+        process_thread.join()
+    finally:
+        log.info("Recognition stats: %s", recognizer.stats())
+        cv_process.close()
 
-def initialize_listeners(camera_endpoint,recog_endpoint):
+#the wrappers default to the robot's devices, the simulation harness passes in stand-ins
+def initialize_listeners(camera_endpoint,recog_endpoint,pc_wrapper=None,bt_wrapper=None,ar_wrapper=None):
+    setup_logging()
         
-    pc_wrapper = PcWrapper()
-    bt_wrapper = BluetoothWrapper()
-    ar_wrapper = ArduinoWrapper()
+    pc_wrapper = pc_wrapper or PcWrapper()
+    bt_wrapper = bt_wrapper or BluetoothWrapper()
+    ar_wrapper = ar_wrapper or ArduinoWrapper()
+
+    #each destination gets a bounded queue and a writer thread so a stalled sink never blocks a listener
+    #RPI_TRACE=1 records per route latency histograms, readable over the control socket or with kill -USR1
+    tracer = Tracer()
+    router = build_router(Destination, pc_wrapper.write, bt_wrapper.write, ar_wrapper.write, tracer=tracer)
+    router.start()
+    serve_control(tracer, router)
+    install_signal_handler(tracer, router)
+    #arrows already sent to the PC, so repeat sightings are held back
+    arrows = ArrowRegistry(ARROW_CONFIRMATIONS, FORWARD_ALL_ARROWS)
     
-    pc_thread = threading.Thread(target=listen_to_pc,args=(pc_wrapper,ar_wrapper,bt_wrapper,camera_endpoint))
-    bt_thread = threading.Thread(target=listen_to_bluetooth,args=(bt_wrapper,pc_wrapper,ar_wrapper))
-    ar_thread = threading.Thread(target=listen_to_arduino,args=(ar_wrapper,pc_wrapper,bt_wrapper))
-    arrow_thread = threading.Thread(target=write_arrow_to_pc, args=(pc_wrapper,recog_endpoint))
+    pc_thread = threading.Thread(target=listen_to_pc,args=(pc_wrapper,router,camera_endpoint))
+    bt_thread = threading.Thread(target=listen_to_bluetooth,args=(bt_wrapper,router,arrows))
+    ar_thread = threading.Thread(target=listen_to_arduino,args=(ar_wrapper,router))
+    arrow_thread = threading.Thread(target=write_arrow_to_pc, args=(router,recog_endpoint,arrows))
 
     #we utilize 3~4 threads due to GIL contention. Any more than 3 will incur context and lock switch overheads
     pc_thread.start()
@@ -66,122 +138,135 @@ def initialize_listeners(camera_endpoint,recog_endpoint):
     arrow_thread.join()
 
 #will receive rpi_status
-def listen_to_pc(pc_wrapper,arduino_wrapper=None,bt_wrapper=None,opencv_pipe=None):
+def listen_to_pc(pc_wrapper,router,opencv_pipe=None):
 
     #gets the connection object, the client's ip address and outbound port
     conn = pc_wrapper.accept_connection_and_flush()
+    reader = LineReader.from_socket(conn)
     #do not capture unless told to do so
     while(1):
         msg = ""
         try:
             # encoding scheme is ASCII
-            #msg = conn.recv(1024).decode('utf-8')
-            while(1):
-                char = conn.recv(1).decode('utf-8')
-                if(char is None or char is ""):
-                    raise ConnectionResetError("Malformed string received:{}".format(msg))
-                if(char == "\n"):
-                    break
-                msg += char
-            print("RECEIVED FROM PC INTERFACE:{}.".format(msg))
-            if(msg.startswith("rpi")):
-                #signal new capture job
-                with exploration_lock:
-                    if(exploration_mode):
-                        #send robot status to image recognittion
-                        opencv_pipe.send(msg[3:])
-                        #poll for at most 1 second. image capturing should not take more 0.5 seconds or else there is a problem
-                        if(opencv_pipe.poll(1)):
-                            #clear the received message
-                            opencv_pipe.recv()
-            elif(msg.startswith("ar")):
-                #if(exploration_mode):
-                #   print("PC HOLDING ARDUINO: {}".format(msg))
-                    #reroute all messsages to the opencv thread. opencv thread now has command authority to release instructions by algorithm to arduino
-                #   arduino_wrapper.hold(msg[2:])
-                #else:
-                #print("PC WRITING TO ARDUINO: {}".format(msg))
-                arduino_wrapper.write(msg[2:])
-            elif(msg.startswith("an")):
-                #print("PC WRITING TO ANDROID: {}".format(msg))
-                bt_wrapper.write(msg[2:])
-            #raises a connectione error for the following situation
-            #1) RPI resets while PC is connected
-            #2) PC reconnects
-            #3) msg is sent to PC
-            else:
-                if(msg is False):
-                    raise ConnectionResetError("Null or empty string received arising from connection reset")
-                else:
+            #every complete line received in one read is processed as a batch
+            lines = reader.read_lines()
+            received = router.tracer.now()
+            for msg in lines:
+                log.debug("RECEIVED FROM PC INTERFACE:%s.", msg)
+                route = router.match("pc", msg)
+                #raises a connectione error for the following situation
+                #1) RPI resets while PC is connected
+                #2) PC reconnects
+                #3) msg is sent to PC
+                if(route is None):
                     raise ConnectionResetError("Malformed string received: {}".format(msg))
-            print("Finished Processing PC:{}".format(msg))
+                if(route.destination == "camera"):
+                    #signal new capture job
+                    with exploration_lock:
+                        if(exploration_mode):
+                            #send robot status to image recognittion
+                            opencv_pipe.send(msg[3:])
+                            router.tracer.capture_requested(msg[3:], received)
+                            #poll for at most 1 second. image capturing should not take more 0.5 seconds or else there is a problem
+                            if(opencv_pipe.poll(1)):
+                                #clear the received message
+                                opencv_pipe.recv()
+                                router.tracer.capture_acknowledged(msg[3:], received)
+                else:
+                    router.forward(route, msg, received)
+                log.debug("Finished Processing PC:%s", msg)
         except Exception as e:
-            print("Unexpected Disconnect for PC occurred. The following error occurred: {}. Awaiting reconnection...".format(e))
+            log.warning("Unexpected Disconnect for PC occurred. The following error occurred: %s. Awaiting reconnection...", e)
+            log.info("Route stats:\n%s", router.report())
             conn.close()
             conn = pc_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
 
     conn.close()
-    print("Closing PC Listener")
+    log.info("Closing PC Listener")
 
 
-def listen_to_bluetooth(bt_wrapper,pc_wrapper=None,arduino_wrapper=None,):
+def listen_to_bluetooth(bt_wrapper,router,arrows=None):
     conn = bt_wrapper.accept_connection_and_flush()
+    reader = LineReader.from_socket(conn)
     while(1):
         try:
             # encoding scheme is ASCII
-            msg = conn.recv(1024).decode('utf-8')
-            print("RECEIVED FROM BT INTERFACE: {}.".format(msg))
-            if(msg.startswith("al_")):
-                #print("BT writing to PC: {}".format(msg))
+            #the tablet newline frames its messages, every complete frame received in one read is dispatched as a batch
+            lines = reader.read_lines()
+            received = router.tracer.now()
+            for msg in lines:
+                msg = msg.strip()
+                if(not msg):
+                    continue
+                log.debug("RECEIVED FROM BT INTERFACE: %s.", msg)
                 if(msg=="al_starte"):
                     with exploration_lock:
                         exploration_mode = True
-                        print("Mode: Exploration")
+                        log.info("Mode: Exploration")
+                    if(arrows is not None):
+                        arrows.reset()
                 elif(msg=="al_startf"):
                     with exploration_lock:
-                        print("Mode: Fastest")
+                        log.info("Mode: Fastest")
                         exploration_mode = False                    
-                pc_wrapper.write(msg[3:])
-            elif(msg.startswith("ar_")):
-                #print("BT writing to ARDUINO: {}".format(msg))
-                arduino_wrapper.write(msg[3:])
-            print("Finished Processing BT: {}".format(msg))
+                    if(arrows is not None):
+                        dump_arrows(arrows)
+                router.dispatch("bt", msg, received)
+                log.debug("Finished Processing BT: %s", msg)
         except Exception as e:
-            print("Unexpected Disconnect for Bluetooth occurred. The following error occurred: {}. Awaiting reconnection...".format(e))
+            log.warning("Unexpected Disconnect for Bluetooth occurred. The following error occurred: %s. Awaiting reconnection...", e)
+            log.info("Route stats:\n%s", router.report())
             conn.shutdown(SHUT_RDWR)
             conn.close()
             conn = bt_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
 
     bt_wrapper.close_bt_socket()
-    print("Closing Bluetooth Listener")
+    log.info("Closing Bluetooth Listener")
 
-def listen_to_arduino(ar_wrapper,pc_wrapper=None,bt_wrapper=None):
+def listen_to_arduino(ar_wrapper,router):
     ser = ar_wrapper.get_connection()
+    reader = LineReader.from_serial(ser, encoding='ascii', errors='ignore')
     while(1):
         try:
-            msg = ser.readline().decode('ascii',errors='ignore').strip() #aruino using println to send so need remove \r\nreak
-            print("RECEIVED FROM ARDUINO INTERFACE: {}.".format(msg))
-            if(msg.startswith("al")):
-                #print("ARDUINO writing to PC: {}".format(msg))
-                pc_wrapper.write(msg[2:])
-            elif(msg.startswith("an")):
-                #print("ARDUINO writing to ANDROID: {}".format(msg))
-                bt_wrapper.write(msg[2:])
-            print("Finished Processing AR: {}".format(msg))
+            lines = reader.read_lines()
+            received = router.tracer.now()
+            for msg in lines:
+                msg = msg.strip() #aruino using println to send so need remove \r
+                log.debug("RECEIVED FROM ARDUINO INTERFACE: %s.", msg)
+                ar_wrapper.acknowledge(msg)
+                router.dispatch("arduino", msg, received)
+                log.debug("Finished Processing AR: %s", msg)
         except UnicodeDecodeError as ude:
-            print("Failed to decode: {}".format(ude))
+            log.warning("Failed to decode: %s", ude)
             continue
         except Exception as e:
-            print("Unexpected Disconnect occurred from arduino: {}, trying to reconnect...".format(e))
+            log.warning("Unexpected Disconnect occurred from arduino: %s, trying to reconnect...", e)
+            log.info("Route stats:\n%s", router.report())
+            router.pause("arduino", REJECT_DURING_RECONNECT)
             ser.close()
             ser = ar_wrapper.reconnect()
+            router.resume("arduino")
+            reader = LineReader.from_serial(ser, encoding='ascii', errors='ignore')
 
-    print("Closing Arduino Listener")
+    log.info("Closing Arduino Listener")
 
-def write_arrow_to_pc(pc_wrapper, listener_endpoint_rpi):
+def write_arrow_to_pc(router, listener_endpoint_rpi, arrows=None):
     while(1):
-        msg = listener_endpoint_rpi.recv()
-        pc_wrapper.write(msg)
+        robot_status, msg = listener_endpoint_rpi.recv()
+        router.tracer.capture_result(robot_status, msg)
+        if(arrows is not None):
+            msg = arrows.report(msg)
+        if(msg is not None and not router.send("pc", msg) and arrows is not None):
+            arrows.forget(msg)
+
+#end of exploration. the summary is a side output, failing to write it must not drop the link
+def dump_arrows(arrows):
+    try:
+        arrows.dump(ARROW_SUMMARY)
+    except OSError as e:
+        log.warning("Could not write the arrow summary to %s: %s", ARROW_SUMMARY, e)
         
     
 
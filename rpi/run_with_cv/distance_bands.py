@@ -0,0 +1,109 @@
+import bisect
+import json
+import os
+import numpy
+from rpi_log import get_logger
+
+log = get_logger("distance_bands")
+
+'''
+    Area ratio to distance lookup table
+
+    Maps the fraction of the frame an arrow covers to its distance in grids. The table is a list of
+    (low, high, distance) bands that do not overlap, both ends excluded, kept sorted by low so the band
+    of a ratio is found with a binary search. A ratio between two bands or outside all of them has no
+    distance, the arrow is too close to a grid line to tell which grid it is on
+
+    calibrate_bands.py fits the bands to captures taken at known distances and writes them to
+    distance_bands.json. The recognizer loads that file once, RPI_AREA_BANDS=<path> points it at
+    another one, e.g. for a different camera mount
+'''
+
+#where calibrate_bands.py writes the table by default
+BANDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "distance_bands.json")
+#grid size
+GRID_CM = 10
+#cm from the camera to an arrow on the grid right in front of the robot, grid g is CAMERA_OFFSET_CM + GRID_CM * g cm away
+CAMERA_OFFSET_CM = 17
+
+
+class BandTable(object):
+
+    '''
+        parameters
+            bands - (low, high, distance) area ratio bands, in any order
+    '''
+    def __init__(self, bands):
+        self.bands = sorted((float(low), float(high), int(distance)) for low, high, distance in bands)
+        if not self.bands:
+            raise ValueError("No area ratio bands")
+        for (low, high, distance), following in zip(self.bands, self.bands[1:]):
+            if not(low < high <= following[0]):
+                raise ValueError("Area ratio bands overlap or are empty: {} and {}".format((low, high, distance), following))
+        if not(self.bands[-1][0] < self.bands[-1][1]):
+            raise ValueError("Area ratio band is empty: {}".format(self.bands[-1]))
+        #lists for bisect, which is faster on them than on numpy arrays, and arrays for lookup_all
+        self.lows = [band[0] for band in self.bands]
+        self.highs = [band[1] for band in self.bands]
+        self.distances = [band[2] for band in self.bands]
+        self.arrays = numpy.array(self.lows), numpy.array(self.highs), numpy.array(self.distances)
+
+    #bands as [low, high] pairs from 0cm out, like AREA_BANDS, or as [low, high, distance]
+    @classmethod
+    def from_list(cls, bands):
+        return cls(band if len(band) == 3 else (band[0], band[1], distance) for distance, band in enumerate(bands))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)["bands"])
+
+    def to_list(self):
+        return [list(band) for band in self.bands]
+
+    #distance in grids of an arrow covering ratio of the frame, None outside every band
+    def lookup(self, ratio):
+        index = bisect.bisect_right(self.lows, ratio) - 1
+        if index >= 0 and self.lows[index] < ratio < self.highs[index]:
+            return self.distances[index]
+        return None
+
+    #lookup of a numpy array of ratios at once, -1 outside every band
+    def lookup_all(self, ratios):
+        lows, highs, distances = self.arrays
+        index = numpy.searchsorted(lows, ratios, side="right") - 1
+        clipped = numpy.maximum(index, 0)
+        inside = (index >= 0) & (lows[clipped] < ratios) & (ratios < highs[clipped])
+        return numpy.where(inside, distances[clipped], -1)
+
+    def min_ratio(self):
+        return self.bands[0][0]
+
+    def max_ratio(self):
+        return self.bands[-1][1]
+
+
+#grid of an arrow cm from the camera, None if it is closer to a grid line than to the middle of a grid
+#or in front of grid 0
+def camera_grid(cm, offset=CAMERA_OFFSET_CM):
+    grid = int(round((cm - offset) / float(GRID_CM)))
+    if grid < 0 or abs(cm - offset - GRID_CM * grid) >= GRID_CM / 2.0:
+        return None
+    return grid
+
+#a BandTable, a bands file path or a list for BandTable.from_list as a BandTable
+def band_table(bands):
+    if isinstance(bands, BandTable):
+        return bands
+    if isinstance(bands, str):
+        return BandTable.load(bands)
+    return BandTable.from_list(bands)
+
+#the table the recognizer uses unless it is given one, fallback when there is no bands file yet
+def default_band_table(fallback):
+    path = os.environ.get("RPI_AREA_BANDS", BANDS_FILE)
+    if os.path.exists(path):
+        return BandTable.load(path)
+    if "RPI_AREA_BANDS" in os.environ:
+        log.warning("No area ratio bands at %s, using the built in ones", path)
+    return BandTable.from_list(fallback)
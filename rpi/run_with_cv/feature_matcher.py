@@ -0,0 +1,150 @@
+import hashlib
+import os
+import zipfile
+import numpy
+import cv2 as cv
+from rpi_log import get_logger
+
+log = get_logger("feature_matcher")
+
+'''
+    Arrow detection by ORB feature matching, the experimental alternative to the contour classifier.
+    With the reference card taken from a capture the benchmarks do not score it finds no cards yet
+
+    The ORB keypoints and descriptors of a reference picture of an arrow card are computed once and kept
+    in an on-disk cache next to it, keyed by the picture and the ORB settings, so a recognizer starts
+    without recomputing them. Their FLANN LSH index is built once per recognizer. For each frame
+        1. ORB keypoints of the frame, scaled down by scale
+        2. the two nearest reference descriptors of each, kept if the nearest is clearly the better one
+           (Lowe's ratio test)
+        3. a RANSAC homography from the reference to the frame, kept with at least min_inliers inliers
+           and a convex outline
+        4. the frame warped back onto the reference has to correlate with it by min_correlation, the
+           flat arrow gives few distinctive keypoints and a homography from background matches is common
+    The inliers and every match inside the card found are dropped and the search repeats for the next card
+
+    Each card found is reported as the outline of the reference arrow projected into the frame, so the
+    area ratio bands and thirds of the frame apply to it as they do to a contour
+'''
+
+#the card in fixed_length/image36.jpg at half size. that capture names no distance, so no benchmark scores
+#it and the matcher is never measured on the picture its reference came from
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_card.jpg")
+#frame scale the keypoints are found at, the reference card is a half size capture
+FEATURE_SCALE = 0.5
+#keypoints per frame
+FEATURES = 3000
+#nearest over second nearest descriptor distance a match has to stay under
+RATIO = 0.8
+MIN_INLIERS = 10
+#reprojection error in pixels of the scaled frame for a RANSAC inlier
+RANSAC_THRESHOLD = 4.0
+MIN_CORRELATION = 0.7
+#cards searched for in one frame
+MAX_CARDS = 3
+#LSH index over the binary ORB descriptors
+FLANN_INDEX_LSH = 6
+INDEX_PARAMS = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+SEARCH_PARAMS = dict(checks=50)
+#ORB settings of the reference, part of the cache key
+REFERENCE_FEATURES = 2000
+FAST_THRESHOLD = 10
+#grey level the arrow outline is cut at, img_recognition.BINARY_THRESHOLD
+ARROW_THRESHOLD = 50
+#replicated border around the reference so keypoints near its edges are kept
+REFERENCE_BORDER = 32
+
+
+class FeatureMatcher(object):
+
+    '''
+        parameters
+            reference - grey picture of an arrow card, the white arrow on the black card
+            cache - file the reference descriptors are kept in, <reference>.orb.npz by default. False
+                    keeps them in memory only
+    '''
+    def __init__(self, reference=REFERENCE, scale=FEATURE_SCALE, features=FEATURES, ratio=RATIO, min_inliers=MIN_INLIERS,
+                 min_correlation=MIN_CORRELATION, cache=None):
+        self.scale = scale
+        self.ratio = ratio
+        self.min_inliers = min_inliers
+        self.min_correlation = min_correlation
+        self.reference = cv.imread(reference, cv.IMREAD_GRAYSCALE)
+        if self.reference is None:
+            raise ValueError("Cannot read the reference card {}".format(reference))
+        height, width = self.reference.shape
+        self.corners = numpy.float32([[0, 0], [0, height - 1], [width - 1, height - 1], [width - 1, 0]]).reshape(-1, 1, 2)
+        #outline of the white arrow on the card, as the contour classifier thresholds it
+        ret, th = cv.threshold(cv.GaussianBlur(self.reference, (5, 5), 2), ARROW_THRESHOLD, 255, cv.THRESH_BINARY)
+        self.arrow = max(cv.findContours(th, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1], key=cv.contourArea).astype(numpy.float32)
+        self.points, self.descriptors = self.reference_features(reference, reference + ".orb.npz" if cache is None else cache)
+        self.matcher = cv.FlannBasedMatcher(INDEX_PARAMS, SEARCH_PARAMS)
+        self.matcher.add([self.descriptors])
+        self.matcher.train()
+        self.orb = cv.ORB_create(nfeatures=features, fastThreshold=FAST_THRESHOLD)
+
+    #keypoint positions and descriptors of the reference, from the cache when it was made for this picture and these settings
+    def reference_features(self, reference, cache):
+        with open(reference, "rb") as f:
+            key = hashlib.sha1(f.read() + repr((REFERENCE_FEATURES, FAST_THRESHOLD, REFERENCE_BORDER, cv.__version__)).encode()).hexdigest()
+        if cache and os.path.exists(cache):
+            try:
+                with numpy.load(cache) as stored:
+                    if str(stored["key"]) == key:
+                        return stored["points"], stored["descriptors"]
+                log.info("Reference descriptors in %s are out of date, recomputing", cache)
+            #a truncated or corrupt archive is recomputed like a stale one
+            except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+                log.warning("Cannot read the reference descriptors in %s, recomputing: %s", cache, e)
+        orb = cv.ORB_create(nfeatures=REFERENCE_FEATURES, fastThreshold=FAST_THRESHOLD)
+        padded = cv.copyMakeBorder(self.reference, REFERENCE_BORDER, REFERENCE_BORDER, REFERENCE_BORDER, REFERENCE_BORDER, cv.BORDER_REPLICATE)
+        keypoints, descriptors = orb.detectAndCompute(padded, None)
+        points = numpy.float32([kp.pt for kp in keypoints]) - REFERENCE_BORDER
+        log.info("%d reference keypoints", len(keypoints))
+        if cache:
+            #written beside the cache and renamed over it, so a recognizer starting meanwhile never reads half a file
+            partial = "{}.{}.tmp".format(cache, os.getpid())
+            try:
+                with open(partial, "wb") as f:
+                    numpy.savez(f, key=key, points=points, descriptors=descriptors)
+                os.replace(partial, cache)
+            except IOError as e:
+                log.warning("Cannot keep the reference descriptors in %s: %s", cache, e)
+                if os.path.exists(partial):
+                    os.remove(partial)
+        return points, descriptors
+
+    #arrow outline in full frame coordinates, as a contour, of each card found in a BGR or grey frame
+    def locate(self, captured_image):
+        gray = captured_image if captured_image.ndim == 2 else cv.cvtColor(captured_image, cv.COLOR_BGR2GRAY)
+        small = cv.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv.INTER_AREA)
+        keypoints, descriptors = self.orb.detectAndCompute(small, None)
+        if descriptors is None:
+            return []
+        frame_points = numpy.float32([kp.pt for kp in keypoints])
+        matches = [pair[0] for pair in self.matcher.knnMatch(descriptors, k=2) if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance]
+        found = []
+        while len(found) < MAX_CARDS and len(matches) >= self.min_inliers:
+            reference = self.points[[m.trainIdx for m in matches]].reshape(-1, 1, 2)
+            frame = frame_points[[m.queryIdx for m in matches]].reshape(-1, 1, 2)
+            homography, inliers = cv.findHomography(reference, frame, cv.RANSAC, RANSAC_THRESHOLD)
+            if homography is None or inliers.sum() < self.min_inliers:
+                break
+            card = cv.perspectiveTransform(self.corners, homography)
+            if not self.verify(small, homography, card):
+                break
+            found.append(cv.perspectiveTransform(self.arrow, homography) / self.scale)
+            #the next card is searched for among the matches outside this one
+            matches = [m for m, inlier in zip(matches, inliers.ravel()) if not inlier and
+                       cv.pointPolygonTest(card, tuple(float(v) for v in frame_points[m.queryIdx]), False) < 0]
+        return found
+
+    #whether the card a homography puts in the scaled frame looks like the reference
+    def verify(self, small, homography, card):
+        if not cv.isContourConvex(card.astype(numpy.int32)) or cv.contourArea(card) < 1:
+            return False
+        height, width = self.reference.shape
+        warped = cv.warpPerspective(small, numpy.linalg.inv(homography), (width, height))
+        correlation = cv.matchTemplate(warped, self.reference, cv.TM_CCOEFF_NORMED)[0][0]
+        log.debug("Card correlation %.2f", correlation)
+        return correlation >= self.min_correlation
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+import numpy
+import cv2 as cv
+from rpi_log import get_logger
+
+log = get_logger("frame_cache")
+
+'''
+    Recognition results of recent frames, reused for near duplicates
+
+    When the robot turns in place or the algorithm asks for a capture at the same x,y,dir again, the new
+    frame is almost the same as the last one taken there. The capture thread computes a difference hash
+    of each frame, the brightness gradient between neighbouring cells of a 17x16 thumbnail as 256 bits,
+    which costs well under a millisecond. Before a frame is recognized its hash is looked up by robot
+    status, and if the last frame recognized at that status differs in no more than max_distance bits
+    its messages are reused instead of running the contour analysis again
+
+    Sensor noise flips a few bits of a still scene, different scenes in the corpora differ in about 20
+    bits or more
+'''
+
+#thumbnail rows, each compares HASH_SIZE + 1 columns
+HASH_SIZE = 16
+#every nth pixel is averaged into the thumbnail, the rest only add time
+HASH_STRIDE = 8
+#bits two frames at the same status can differ in and still share a result
+HASH_DISTANCE = 10
+#robot statuses remembered
+CACHE_SIZE = 16
+#lookups between two hit rate log lines
+REPORT_EVERY = 100
+
+
+#difference hash of a BGR or grey frame as an int
+def frame_hash(image):
+    small = cv.resize(image[::HASH_STRIDE, ::HASH_STRIDE], (HASH_SIZE + 1, HASH_SIZE), interpolation=cv.INTER_AREA)
+    gray = small if small.ndim == 2 else cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+    bits = gray[:, 1:] > gray[:, :-1]
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class RecognitionCache(object):
+
+    '''
+        parameters
+            size - robot statuses kept, least recently used first out
+            max_distance - hash bits a frame can differ in from the cached one to reuse its result
+    '''
+    def __init__(self, size=CACHE_SIZE, max_distance=HASH_DISTANCE):
+        self.size = size
+        self.max_distance = max_distance
+        #robot status -> (frame hash, messages, seconds recognition took)
+        self.entries = OrderedDict()
+        #the capture and recognition threads both use it
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        #recognition time of the misses, and what the hits would have cost
+        self.recognized_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    #messages of the last frame at robot_status if frame_hash is close enough to it, else None
+    def lookup(self, robot_status, frame_hash):
+        if frame_hash is None:
+            return None
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(robot_status)
+            messages = None
+            if entry is not None and hash_distance(entry[0], frame_hash) <= self.max_distance:
+                self.entries.move_to_end(robot_status)
+                self.hits += 1
+                self.saved_seconds += entry[2]
+                messages = entry[1]
+            if self.lookups % REPORT_EVERY == 0:
+                log.info("Frame cache: %s", self.stats_text())
+        return messages
+
+    #remembers the result of recognizing a frame. lost frames have no result and are not kept
+    def store(self, robot_status, frame_hash, messages, seconds):
+        if frame_hash is None:
+            return
+        with self.lock:
+            self.recognized_seconds += seconds
+            if messages is None:
+                return
+            self.entries[robot_status] = (frame_hash, list(messages), seconds)
+            self.entries.move_to_end(robot_status)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / float(self.lookups) if self.lookups else 0.0,
+                "recognized_s": self.recognized_seconds,
+                "saved_s": self.saved_seconds
+            }
+
+    #call with the lock held
+    def stats_text(self):
+        return "{} of {} frames reused ({:.0%}), {:.2f}s of recognition saved, {:.2f}s spent".format(
+            self.hits, self.lookups, self.hits / float(self.lookups) if self.lookups else 0.0, self.saved_seconds, self.recognized_seconds)
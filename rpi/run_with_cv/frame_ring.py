@@ -0,0 +1,149 @@
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy
+from rpi_log import get_logger
+
+log = get_logger("frame_ring")
+
+'''
+    Fixed size ring of frame slots in shared memory
+
+    The capture thread has the camera write each frame straight into a slot, and any number of
+    recognizer processes read it in place as a numpy view. A frame is never pickled or copied between
+    processes, only its sequence number has to be passed on, e.g. over a Queue
+
+    Overwrite and backpressure rules
+        capture never waits. reserve always takes the slot after the last one written and overwrites
+        the oldest frame whether or not it was recognized, so a slow recognizer cannot hold up the
+        capture acknowledgement to the PC
+        a frame survives until slots - 1 newer frames have been reserved. a recognizer further behind
+        loses frames: read returns None for a frame that is gone, and valid returns False once the frame
+        was overwritten, so a result computed from it must be thrown away
+        recognizers only read. a slot's sequence is cleared before the frame is written and set after
+        its status, so a half written frame is never taken for a whole one
+
+    A ring of raw YUV420 frames, see yuv_shape, hands out the Y plane alone: read crops the slot to the
+    picture, and the Y plane is its first rows, so recognizers get a grey frame without a conversion or a copy
+'''
+
+#last published sequence, slot count, allocated frame height, width and channels, picture height and width
+RING_HEADER = struct.Struct("<QIIIIII")
+#slot header, the sequence followed by capture time, robot x, y and direction
+SEQUENCE = struct.Struct("<Q")
+STATUS = struct.Struct("<dii1s")
+#headers and frames start on a cache line
+ALIGN = 64
+#sequence of a slot that is empty or being written, published sequences start at 1
+WRITING = 0
+
+Frame = namedtuple("Frame", ["sequence", "timestamp", "status", "image"])
+
+
+def aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+#the firmware pads raw captures to a width multiple of 32 and a height multiple of 16
+def padded_shape(resolution, channels=3):
+    width, height = resolution
+    return ((height + 15) // 16 * 16, (width + 31) // 32 * 32, channels)
+
+#a raw YUV420 capture is the padded Y plane followed by the U and V planes at half the width and height,
+#1.5 bytes a pixel, as rows of the padded width
+def yuv_shape(resolution):
+    height, width, channels = padded_shape(resolution, 1)
+    return (height * 3 // 2, width, 1)
+
+
+class FrameRing(object):
+
+    '''
+        Use FrameRing.create in the capturing process and FrameRing.attach(name) in recognizer processes.
+        Processes forked after create can use the same object
+    '''
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        written, self.slots, height, width, channels, self.height, self.width = RING_HEADER.unpack_from(shm.buf, 0)
+        #single channel frames are 2D, as OpenCV gives grey pictures
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.slot_size = aligned(SEQUENCE.size + STATUS.size) + aligned(height * width * channels)
+        #padded frame of each slot, what the camera writes into
+        self.images = [
+            numpy.ndarray(self.shape, dtype=numpy.uint8, buffer=shm.buf, offset=self.slot_offset(index) + aligned(SEQUENCE.size + STATUS.size))
+            for index in range(self.slots)
+        ]
+        self.written = written
+
+    '''
+        parameters
+            resolution - (width, height) of the pictures
+            slots - frames kept, the most a recognizer can fall behind before it loses frames
+            channels - bytes per pixel, 3 for bgr
+            yuv - slots for raw YUV420 frames instead, read gives their Y plane
+    '''
+    @classmethod
+    def create(cls, resolution, slots=4, channels=3, yuv=False):
+        height, width, channels = yuv_shape(resolution) if yuv else padded_shape(resolution, channels)
+        slot_size = aligned(SEQUENCE.size + STATUS.size) + aligned(height * width * channels)
+        shm = shared_memory.SharedMemory(create=True, size=aligned(RING_HEADER.size) + slots * slot_size)
+        #new shared memory is zeroed, so every slot starts out as WRITING
+        RING_HEADER.pack_into(shm.buf, 0, WRITING, slots, height, width, channels, resolution[1], resolution[0])
+        log.info("Frame ring %s: %d slots of %dx%dx%d", shm.name, slots, width, height, channels)
+        return cls(shm, owner=True)
+
+    #for processes started through multiprocessing, which share the creator's resource tracker. one
+    #started on its own would have its tracker free the ring when it exits
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def slot_offset(self, index):
+        return aligned(RING_HEADER.size) + index * self.slot_size
+
+    def sequence_at(self, sequence):
+        return SEQUENCE.unpack_from(self.shm.buf, self.slot_offset(sequence % self.slots))[0]
+
+    #takes the next slot and returns its sequence and padded frame to write into. never waits
+    def reserve(self):
+        sequence = self.written + 1
+        SEQUENCE.pack_into(self.shm.buf, self.slot_offset(sequence % self.slots), WRITING)
+        return sequence, self.images[sequence % self.slots]
+
+    #makes a reserved frame readable, status is the robot's "x,y,dir" when it was captured
+    def publish(self, sequence, status, timestamp):
+        x, y, direction = status.split(",")
+        offset = self.slot_offset(sequence % self.slots)
+        STATUS.pack_into(self.shm.buf, offset + SEQUENCE.size, timestamp, int(x), int(y), direction.encode())
+        SEQUENCE.pack_into(self.shm.buf, offset, sequence)
+        SEQUENCE.pack_into(self.shm.buf, 0, sequence)
+        self.written = sequence
+
+    #sequence of the newest published frame, 0 before the first
+    def latest(self):
+        return SEQUENCE.unpack_from(self.shm.buf, 0)[0]
+
+    #True while the slot still holds frame sequence
+    def valid(self, sequence):
+        return self.sequence_at(sequence) == sequence
+
+    #the frame with sequence as a view cropped to the picture, None if it was overwritten
+    def read(self, sequence):
+        offset = self.slot_offset(sequence % self.slots)
+        timestamp, x, y, direction = STATUS.unpack_from(self.shm.buf, offset + SEQUENCE.size)
+        #checked after the status, which the writer sets before the sequence
+        if not self.valid(sequence):
+            return None
+        image = self.images[sequence % self.slots][:self.height, :self.width]
+        return Frame(sequence, timestamp, "{},{},{}".format(x, y, direction.decode()), image)
+
+    #views handed out by read must be dropped first. the creating process also frees the memory
+    def close(self):
+        self.images = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
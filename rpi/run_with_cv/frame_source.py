@@ -0,0 +1,300 @@
+import json
+import os
+import random
+import re
+import struct
+import time
+import numpy
+import cv2 as cv
+from rpi_log import get_logger
+
+log = get_logger("frame_source")
+
+'''
+    Where captured frames come from
+
+    ImageProcessor.capture_frames asks its FrameSource for a frame whenever the PC asks for a capture,
+    and the source writes it straight into a frame ring slot
+        CameraSource     the Pi camera
+        ReplaySource     a recording or a directory of captures, as fast as they are asked for or with
+                         the gaps they were captured at
+        SyntheticSource  arrows drawn at known distances and positions, with the answer for each frame
+    so recognition can be run, profiled and tuned on any Linux machine, see replay_run.py
+
+    FrameRecorder keeps a whole run, every frame with its robot status and capture time, in one file
+        header    MAGIC, then HEADER: format version, picture width and height
+        records   RECORD: capture time, JPEG length and status length, then the status and the JPEG
+        index     JSON list of [record offset, capture time, status]
+        trailer   TRAILER: index offset and MAGIC
+    The index makes any frame one seek away. A run cut short has no index, the records are walked instead
+'''
+
+MAGIC = b"RPIFRAME"
+HEADER = struct.Struct("<HII")
+RECORD = struct.Struct("<dIH")
+TRAILER = struct.Struct("<Q8s")
+VERSION = 1
+#JPEG quality of recorded frames, a 1080p frame is a few hundred kilobytes
+RECORD_QUALITY = 90
+#capture/<x>,<y>,<dir>.jpg, as the JPEG capture mode names them
+STATUS = re.compile(r"^-?\d+,-?\d+,[udlr]$")
+
+
+#copies image into a padded ring slot, scaled if it is not the ring's picture size. a YUV ring's slot is 2D
+#and only its Y plane is written, with the grey picture
+def write_frame(frame, image, resolution):
+    width, height = resolution
+    if image.shape[1] != width or image.shape[0] != height:
+        image = cv.resize(image, (width, height), interpolation=cv.INTER_AREA)
+    if frame.ndim == 2 and image.ndim == 3:
+        image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    elif frame.ndim == 3 and image.ndim == 2:
+        image = cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+    numpy.copyto(frame[:height, :width], image)
+
+
+'''
+    A FrameSource has a resolution, the (width, height) of its pictures, and
+        capture(robot_status, frame) - writes the frame for robot_status into frame, a padded BGR ring
+                                       slot or a YUV one. False when the source has run out
+        close()
+'''
+class CameraSource(object):
+
+    '''
+        parameters
+            format - raw format the camera writes into the slot, bgr, or yuv for a YUV ring
+    '''
+    def __init__(self, resolution, format='bgr'):
+        #only on the Pi
+        from picamera import PiCamera
+        self.resolution = resolution
+        self.format = format
+        self.camera = PiCamera(resolution=resolution)
+
+    def capture(self, robot_status, frame):
+        self.camera.capture(frame, format=self.format, use_video_port=True)
+        return True
+
+    def close(self):
+        self.camera.close()
+
+
+class ReplaySource(object):
+
+    '''
+        parameters
+            path - a FrameRecorder file, or a directory of captures replayed in the order they were written
+            realtime - keep the gaps between captures as recorded, otherwise every frame is there at once
+    '''
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+        if os.path.isdir(path):
+            self.recording = None
+            names = [name for name in os.listdir(path) if name.lower().endswith((".jpg", ".jpeg", ".png"))]
+            paths = sorted((os.path.join(path, name) for name in names), key=os.path.getmtime)
+            #(status, capture time, file) of each capture. files not named after a status get a made up one
+            self.entries = []
+            for index, image_path in enumerate(paths):
+                name = os.path.splitext(os.path.basename(image_path))[0]
+                status = name if STATUS.match(name) else "0,{},u".format(index)
+                self.entries.append((status, os.path.getmtime(image_path), image_path))
+            first = cv.imread(paths[0], cv.IMREAD_COLOR) if paths else None
+            self.resolution = (first.shape[1], first.shape[0]) if first is not None else None
+        else:
+            self.recording = Recording(path)
+            self.entries = [(status, timestamp, index) for index, (offset, timestamp, status) in enumerate(self.recording.index)]
+            self.resolution = self.recording.resolution
+        self.position = 0
+        #(monotonic time, capture time) of the first frame replayed
+        self.started = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    #robot statuses in the order they were captured, the requests to replay the run with
+    def statuses(self):
+        return [status for status, timestamp, source in self.entries]
+
+    def load(self, index):
+        status, timestamp, source = self.entries[index]
+        if self.recording is not None:
+            return self.recording.image(source)
+        return cv.imread(source, cv.IMREAD_COLOR)
+
+    def capture(self, robot_status, frame):
+        if self.position >= len(self.entries):
+            return False
+        status, timestamp, source = self.entries[self.position]
+        image = self.load(self.position)
+        self.position += 1
+        if self.realtime:
+            if self.started is None:
+                self.started = (time.monotonic(), timestamp)
+            wait = (timestamp - self.started[1]) - (time.monotonic() - self.started[0])
+            if wait > 0:
+                time.sleep(wait)
+        if image is None:
+            log.warning("Cannot read frame %d of the replay, %s", self.position - 1, source)
+            return self.capture(robot_status, frame)
+        write_frame(frame, image, self.resolution)
+        return True
+
+    def close(self):
+        if self.recording is not None:
+            self.recording.close()
+
+
+class SyntheticSource(object):
+
+    '''
+        parameters
+            bands - BandTable the arrows are sized by, each drawn in the middle of its distance's band
+            count - frames before the source runs out
+            seed - picks the arrows in each frame, the same seed draws the same run
+            noise - standard deviation of the grey level noise added to every frame
+    '''
+    def __init__(self, bands, count=100, resolution=(1920, 1080), seed=0, noise=2.0, background=30):
+        self.bands = bands
+        self.count = count
+        self.resolution = resolution
+        self.seed = seed
+        self.noise = noise
+        self.background = background
+        self.position = 0
+        reference_img = cv.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_arrow.jpg"), cv.IMREAD_GRAYSCALE)
+        #the white arrow on the black background
+        ret, th = cv.threshold(reference_img, 127, 255, cv.THRESH_BINARY)
+        self.arrow = max(cv.findContours(th, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)[1], key=cv.contourArea).reshape(-1, 2).astype(numpy.float64)
+        self.arrow -= self.arrow.mean(axis=0)
+        self.arrow_area = cv.contourArea(self.arrow.astype(numpy.float32))
+
+    def __len__(self):
+        return self.count
+
+    def statuses(self):
+        return ["{},{},{}".format(index % 15, index // 15 % 20, "udlr"[index % 4]) for index in range(self.count)]
+
+    #(distance in grids, position) of the arrows drawn in frame index, as getImageLocation reports them
+    def arrows(self, index):
+        rng = random.Random(self.seed * 100003 + index)
+        if rng.random() < 0.2:
+            return []
+        #an arrow right in front fills the middle of the frame, nothing else fits
+        if rng.random() < 0.15:
+            return [(0, "center")]
+        further = sorted(set(band[2] for band in self.bands.bands if band[2] > 0))
+        return sorted((rng.choice(further), position) for position in rng.sample(["left", "center", "right"], rng.randint(1, 3)))
+
+    def render(self, index):
+        width, height = self.resolution
+        image = numpy.full((height, width), self.background, dtype=numpy.uint8)
+        for distance, position in self.arrows(index):
+            low, high = [band[:2] for band in self.bands.bands if band[2] == distance][0]
+            #the geometric middle of the band
+            scale = numpy.sqrt(numpy.sqrt(low * high) * width * height / self.arrow_area)
+            cx = width * {"left": 1, "center": 3, "right": 5}[position] / 6.0
+            points = numpy.round(self.arrow * scale + (cx, height / 2.0)).astype(numpy.int32)
+            cv.fillPoly(image, [points], 230)
+        if self.noise:
+            rng = numpy.random.default_rng(self.seed * 100003 + index)
+            image = numpy.clip(image + rng.normal(0, self.noise, image.shape), 0, 255).astype(numpy.uint8)
+        return cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+
+    def capture(self, robot_status, frame):
+        if self.position >= self.count:
+            return False
+        write_frame(frame, self.render(self.position), self.resolution)
+        self.position += 1
+        return True
+
+    def close(self):
+        pass
+
+
+class FrameRecorder(object):
+
+    '''
+        parameters
+            path - file the run is written to, replaced if it exists
+            resolution - (width, height) of the pictures
+    '''
+    def __init__(self, path, resolution, quality=RECORD_QUALITY):
+        self.path = path
+        self.quality = quality
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + HEADER.pack(VERSION, resolution[0], resolution[1]))
+        self.index = []
+
+    #appends a frame. the JPEG encode takes tens of milliseconds on the Pi, call it after the capture is acknowledged
+    def append(self, robot_status, timestamp, image):
+        ok, encoded = cv.imencode(".jpg", image, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            log.warning("Could not encode the frame for %s, not recorded", robot_status)
+            return
+        status = robot_status.encode()
+        self.index.append([self.file.tell(), timestamp, robot_status])
+        self.file.write(RECORD.pack(timestamp, len(encoded), len(status)) + status)
+        self.file.write(encoded.tobytes())
+        #a run cut short keeps every frame written so far
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        offset = self.file.tell()
+        self.file.write(json.dumps(self.index).encode())
+        self.file.write(TRAILER.pack(offset, MAGIC))
+        self.file.close()
+        log.info("Recorded %d frames to %s", len(self.index), self.path)
+
+
+#reads a FrameRecorder file
+class Recording(object):
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a frame recording".format(path))
+        version, width, height = HEADER.unpack(self.file.read(HEADER.size))
+        if version != VERSION:
+            raise ValueError("{} is a version {} frame recording, expected {}".format(path, version, VERSION))
+        self.resolution = (width, height)
+        self.index = self.read_index()
+
+    def read_index(self):
+        start = len(MAGIC) + HEADER.size
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell()
+        if end - start >= TRAILER.size:
+            self.file.seek(end - TRAILER.size)
+            offset, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+            if magic == MAGIC:
+                self.file.seek(offset)
+                return [tuple(entry) for entry in json.loads(self.file.read(end - TRAILER.size - offset).decode())]
+        #no index, the recording was not closed
+        index = []
+        offset = start
+        while offset + RECORD.size <= end:
+            self.file.seek(offset)
+            timestamp, length, status_length = RECORD.unpack(self.file.read(RECORD.size))
+            if offset + RECORD.size + status_length + length > end:
+                break
+            index.append((offset, timestamp, self.file.read(status_length).decode()))
+            offset += RECORD.size + status_length + length
+        log.warning("Frame recording has no index, found %d whole frames", len(index))
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    #the decoded BGR frame of entry index
+    def image(self, index):
+        offset, timestamp, status = self.index[index]
+        self.file.seek(offset)
+        timestamp, length, status_length = RECORD.unpack(self.file.read(RECORD.size))
+        self.file.seek(status_length, os.SEEK_CUR)
+        return cv.imdecode(numpy.frombuffer(self.file.read(length), dtype=numpy.uint8), cv.IMREAD_COLOR)
+
+    def close(self):
+        self.file.close()
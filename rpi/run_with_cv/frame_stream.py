@@ -0,0 +1,104 @@
+import threading
+import time
+import numpy
+from rpi_log import get_logger
+
+log = get_logger("frame_stream")
+
+'''
+    Continuous capture from the camera's video port
+
+    A single capture has to start the video port, let exposure and white balance settle and wait a
+    whole frame before it returns, so the PC's capture request waits a full shutter cycle. FrameStream is
+    the output of a recording that never stops instead: the sensor stays warm and every frame passes
+    through write as it arrives, whether or not anyone asked for it
+
+    A capture request records the camera's clock and the robot status it was made at. The first frame
+    whose exposure started after that is the best timed one already in flight, the robot had stopped
+    before it. That frame is copied into a frame ring slot tagged with the status and published, and the
+    request is answered as soon as its last byte is in. Every other frame is dropped without a copy, so
+    the ring only holds frames that were asked for
+
+    Raw frames come padded like the ones capture writes into the ring, see frame_ring.padded_shape
+'''
+
+
+class FrameStream(object):
+
+    '''
+        parameters
+            camera - the PiCamera recording into this stream, built with clock_mode='raw' so frame timestamps
+                     and camera.timestamp come from the same clock
+            ring - FrameRing the requested frames are published in
+    '''
+    def __init__(self, camera, ring):
+        self.camera = camera
+        self.ring = ring
+        self.lock = threading.Lock()
+        #(robot status, camera time of the request) of the capture being waited on, None when there is none
+        self.request = None
+        #set once the requested frame is published, with its sequence in self.captured
+        self.done = threading.Event()
+        self.captured = None
+        #(sequence, flat view of the slot, request) the frame being received is copied into, None while dropping
+        self.target = None
+        self.offset = 0
+        #the next write starts a frame
+        self.starting = True
+        self.frames = 0
+        self.published = 0
+
+    #waits for the first frame exposed after now and returns its ring sequence, None if none came within timeout
+    def capture(self, robot_status, timeout):
+        with self.lock:
+            self.done.clear()
+            self.captured = None
+            self.request = (robot_status, self.camera.timestamp)
+        if not self.done.wait(timeout):
+            with self.lock:
+                self.request = None
+            return None
+        return self.captured
+
+    #called by the camera with each piece of every frame
+    def write(self, buf):
+        frame = self.camera.frame
+        if self.starting:
+            self.frames += 1
+            self.offset = 0
+            with self.lock:
+                request = self.request
+            #a frame without a timestamp came right after a mode change, it cannot be older than the request
+            if request is not None and (frame.timestamp is None or frame.timestamp >= request[1]):
+                sequence, slot = self.ring.reserve()
+                self.target = (sequence, slot.reshape(-1), request)
+        if self.target is not None:
+            sequence, slot, request = self.target
+            data = numpy.frombuffer(buf, dtype=numpy.uint8)
+            slot[self.offset:self.offset + len(data)] = data
+            self.offset += len(data)
+        self.starting = frame.complete
+        if self.starting and self.target is not None:
+            self.publish()
+        return len(buf)
+
+    def publish(self):
+        sequence, slot, request = self.target
+        self.target = None
+        if self.offset != len(slot):
+            log.warning("Frame for %s was %d bytes, expected %d. Taking the next one", request[0], self.offset, len(slot))
+            return
+        self.ring.publish(sequence, request[0], time.monotonic())
+        self.published += 1
+        with self.lock:
+            #a request that timed out or was replaced while its frame came in gets nothing
+            if self.request is request:
+                self.request = None
+                self.captured = sequence
+                self.done.set()
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {"frames": self.frames, "published": self.published}
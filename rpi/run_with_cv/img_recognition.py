@@ -2,88 +2,321 @@ import cv2 as cv
 import numpy
 import time
 import sys
-from picamera import PiCamera
 from queue import Queue
 from timeit import default_timer as timer
+from frame_ring import FrameRing
+from distance_bands import band_table, default_band_table
+from frame_cache import RecognitionCache, frame_hash
+from frame_stream import FrameStream
+from frame_source import CameraSource, FrameRecorder
+from feature_matcher import FeatureMatcher
+from preprocess import default_pipeline, pipeline
+from rpi_log import get_logger
+
+log = get_logger("img_recognition")
 
 #for debugging only
 #import matplotlib
 
+RESOLUTION = (1920,1080)
+#frames kept in memory, recognition more than this many captures behind loses frames. leaves room for
+#a frame on every recognition worker plus a burst of captures
+RING_SLOTS = 8
+#frames per second the streaming capture mode records at, a request waits a frame period or two
+STREAM_FRAMERATE = 15
+#longest a streamed capture waits for its frame, the PC gives up after a second
+STREAM_TIMEOUT = 0.5
+
+#(low, high) arrow to frame area ratios classifyContours maps to 0, 10, 20 and 30cm, both ends excluded. used
+#until calibrate_bands.py has written distance_bands.json
+AREA_BANDS = ((0.105, 0.31), (0.048, 0.092), (0.026, 0.041), (0.015, 0.023))
+#largest matchShapes distance from the reference arrow that still counts as an arrow
+MATCH_THRESHOLD = 0.1
+#grey level above which a pixel is part of an object
+BINARY_THRESHOLD = 50
+#approxPolyDP tolerance as a fraction of the contour's perimeter
+APPROX_EPSILON = 0.01
+#approxPolyDP keeps a subset of a contour's points, fewer than this cannot make the 6 to 8 edges of an arrow
+MIN_POINTS = 6
+#coarse contours are candidates within this fraction of the accepted area ratios, small ones lose area when scaled down
+CANDIDATE_TOLERANCE = 0.5
+#full resolution pixels around a candidate, beyond the blur kernel so the arrow thresholds the same as in the full frame
+PYRAMID_MARGIN = 8
+#contour classifies thresholded contours against the reference arrow, orb matches features of a reference card, see feature_matcher.
+#orb is experimental, it finds no card in the benchmark corpora with the independent reference card
+DETECTORS = ("contour", "orb")
+EXPERIMENTAL_DETECTORS = ("orb",)
+
+#areas of all contours at once, the same values contourArea gives since the points are integers
+def contour_areas(contours):
+    lengths = numpy.array([len(c) for c in contours])
+    starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    points = numpy.concatenate(contours).reshape(-1, 2).astype(numpy.int64)
+    #index of the next point around each contour
+    following = numpy.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    return numpy.abs(numpy.add.reduceat(cross, starts)) / 2.0, lengths
+
+'''
+    Indices of the contours that can pass classifyContours
+
+    Rejects in one numpy pass every contour whose area ratio is outside all of the BandTable bands or
+    that has too few points to make an arrow, so arcLength, approxPolyDP and matchShapes only run on
+    the few left. Both tests are exact, the survivors give the same arrows as checking every contour
+'''
+def screen_contours(contours, imgArea, bands):
+    if len(contours) == 0:
+        return []
+    areas, lengths = contour_areas(contours)
+    in_band = bands.lookup_all(areas / imgArea) >= 0
+    return numpy.flatnonzero((lengths >= MIN_POINTS) & in_band)
+
+#merges overlapping (x0, y0, x1, y1) regions so no part of the frame is searched twice
+def merge_regions(regions):
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
 class ImageProcessor():
     
-    def __init__(self):
+    '''
+        parameters
+            save_captures - also write in-memory frames to capture/<status>.jpg once recognition is done
+                            with them, for debugging. the JPEG capture modes always write them
+            slots - frames in the shared memory ring, 0 for none when frames only come from files
+            ring - an existing ring to read frames from, for recognition workers
+            pyramid_scale - find candidates on the frame scaled by this first, e.g. 0.25. None
+                            thresholds and searches the whole frame at full resolution
+            pyramid_margin - full resolution pixels kept around each candidate
+            area_bands - area ratio to distance BandTable, a bands file or a list for BandTable.from_list.
+                            None loads distance_bands.json, see distance_bands
+            match_threshold, binary_threshold, approx_epsilon - classifier tuning, see the constants of
+                            the same names
+            cache_size - robot statuses whose last result is reused for a near duplicate frame, see
+                            frame_cache. 0 recognizes every frame
+            source - FrameSource capture_frames takes frames from, e.g. a ReplaySource off the Pi. None
+                            opens the camera when capture starts
+            record - file every frame captured is recorded to with its robot status, see frame_source
+            detector - how getImageLocation finds arrows, one of DETECTORS. orb is experimental
+            preprocess - stages that turn a frame into the binary image contours are found in, a Pipeline,
+                            a tune_preprocess.py file or a list of stages. None blurs and thresholds at
+                            binary_threshold, see preprocess
+            luma - the camera captures YUV into the ring and recognition gets the Y plane of each frame
+                            as a grey view, without a colour conversion. Frames from a source are turned
+                            grey as they are written
+    '''
+    def __init__(self, save_captures=False, slots=RING_SLOTS, ring=None, pyramid_scale=None, pyramid_margin=PYRAMID_MARGIN,
+                 area_bands=None, match_threshold=MATCH_THRESHOLD, binary_threshold=BINARY_THRESHOLD, approx_epsilon=APPROX_EPSILON, cache_size=0,
+                 source=None, record=None, detector="contour", preprocess=None, luma=False):
+        if detector not in DETECTORS:
+            raise ValueError("Unknown detector {}, expected one of {}".format(detector, ", ".join(DETECTORS)))
+        if detector in EXPERIMENTAL_DETECTORS:
+            log.warning("The %s detector is experimental and misses arrows the contour detector finds", detector)
+        #(robot status, ring sequence, frame hash). the sequence is None when the frame is in capture/<status>.jpg,
+        #the hash when it was not computed
         self.jobs = Queue()
+        self.source = source
+        self.resolution = source.resolution if source is not None else RESOLUTION
+        #the camera writes raw frames straight into the ring, recognizers read them in place
+        self.luma = luma
+        self.ring = ring or (FrameRing.create(self.resolution, slots, yuv=luma) if slots else None)
+        self.recorder = FrameRecorder(record, self.resolution) if record else None
+        self.save_captures = save_captures
+        self.pyramid_scale = pyramid_scale
+        self.pyramid_margin = pyramid_margin
+        self.bands = default_band_table(AREA_BANDS) if area_bands is None else band_table(area_bands)
+        self.match_threshold = match_threshold
+        self.binary_threshold = binary_threshold
+        self.approx_epsilon = approx_epsilon
+        self.pipeline = default_pipeline(binary_threshold) if preprocess is None else pipeline(preprocess)
+        #the same chain without its blur for the scaled down frame of a pyramid search
+        self.coarse_pipeline = self.pipeline.coarse()
+        self.cache = RecognitionCache(cache_size) if cache_size else None
+        self.detector = detector
+        #built by load_reference_contours, in the process that recognizes
+        self.matcher = None
+        #frames recognize could not report on, gone from the ring before or during recognition
+        self.lost = 0
 
-    #sequence as i verb sequence
-    def sequence_images(self,listener_endpoint_pc):
-        dir = sys.path[0]
-        while 1:
-            img_name = listener_endpoint_pc.recv()
-            start = timer()
-            time.sleep(0.05)
-            yield "{}/capture/{}.jpg".format(dir,img_name)
-            end = timer()
-            #if(end-start < 0.1):
-            #   time.sleep(0.1-(end-start))
-            #   print("Camera too fast: {}. Slept for: {}".format(end-start,0.1-(end-start)))
-            listener_endpoint_pc.send("Captured")
-            self.jobs.put(img_name)
-            print("Time taken for sequence capturing {} : {}.".format(img_name, end - start))
-
-    def capture(self,listener_endpoint_pc):
-        camera = PiCamera(resolution=(1920,1080))
+    #streams from the video port without stopping and answers each capture request with the first frame
+    #exposed after it, see frame_stream. the acknowledgement waits for at most two frames, not a capture
+    def capture_stream(self,listener_endpoint_pc):
+        from picamera import PiCamera
+        #raw clock mode stamps frames with the same clock as camera.timestamp, which FrameStream compares them with.
+        #the default, reset, counts frame timestamps from the start of the recording
+        camera = PiCamera(resolution=RESOLUTION, framerate=STREAM_FRAMERATE, clock_mode='raw')
+        stream = FrameStream(camera, self.ring)
         try:
-            dir = sys.path[0]
-            print("Starting Capture Thread...")
-            camera.capture_sequence(self.sequence_images(listener_endpoint_pc), use_video_port=True)
-            print("Terminating Capture...")
+            log.info("Starting Streaming Capture Thread...")
+            camera.start_recording(stream, format='yuv' if self.luma else 'bgr')
+            while 1:
+                img_name = listener_endpoint_pc.recv()
+                #raises if the recording failed
+                camera.wait_recording(0)
+                start = timer()
+                sequence = stream.capture(img_name, STREAM_TIMEOUT)
+                end = timer()
+                if sequence is None:
+                    #not acknowledged, the PC gives up waiting as it does for a stalled capture
+                    log.warning("No frame streamed for %s within %ss", img_name, STREAM_TIMEOUT)
+                    continue
+                listener_endpoint_pc.send("Captured")
+                log.debug("Time taken for streamed capturing %s as frame %d: %s", img_name, sequence, end - start)
+                self.queue_frame(img_name, sequence)
+            log.info("Terminating Capture...")
         finally:
+            log.info("Streamed %s", stream.stats())
             camera.close()
 
     def capture_old(self,listener_endpoint_pc):
+        from picamera import PiCamera
         camera = PiCamera(resolution=(1920,1080))
         try:
             dir = sys.path[0]
-            print("Starting Capture Thread...")
+            log.info("Starting Capture Thread...")
             while 1:
                 img_name = listener_endpoint_pc.recv()
                 start = timer()
                 camera.capture("{}/capture/{}.jpg".format(dir,img_name), use_video_port=True)
                 end = timer()
                 listener_endpoint_pc.send("Captured")
-                print("Time taken for single capturing {} : {}".format(img_name, end - start))
-                self.jobs.put(img_name)
-            print("Terminating Capture...")
+                log.debug("Time taken for single capturing %s : %s", img_name, end - start)
+                self.jobs.put((img_name, None, None))
+            log.info("Terminating Capture...")
         finally:
             camera.close()
 
+    #captures raw frames into the frame ring and hands them to recognition without going through a file.
+    #never waits for recognition, a frame it is too far behind on is overwritten
+    def capture_frames(self,listener_endpoint_pc):
+        source = self.source or CameraSource(self.resolution, 'yuv' if self.luma else 'bgr')
+        try:
+            log.info("Starting In-Memory Capture Thread...")
+            while 1:
+                try:
+                    img_name = listener_endpoint_pc.recv()
+                except EOFError:
+                    #the listener is gone
+                    break
+                start = timer()
+                sequence, frame = self.ring.reserve()
+                if not source.capture(img_name, frame):
+                    log.info("Frame source has no more frames")
+                    break
+                self.ring.publish(sequence, img_name, time.monotonic())
+                end = timer()
+                listener_endpoint_pc.send("Captured")
+                log.debug("Time taken for in-memory capturing %s as frame %d: %s", img_name, sequence, end - start)
+                self.queue_frame(img_name, sequence)
+            log.info("Terminating Capture...")
+        finally:
+            source.close()
+
+    #hands a captured frame to recognition. runs after the acknowledgement, the robot can already move on
+    def queue_frame(self, robot_status, sequence):
+        frame = self.ring.read(sequence) if self.cache is not None or self.recorder is not None else None
+        digest = frame_hash(frame.image) if self.cache is not None and frame is not None else None
+        self.jobs.put((robot_status, sequence, digest))
+        if self.recorder is not None and frame is not None:
+            self.recorder.append(robot_status, frame.timestamp, frame.image)
 
-    def identify(self, listener_endpoint_rpi):
-        print("Starting Arrow Recognition Thread...")
+    #the frame of a job as a BGR image, or grey in luma mode, read from capture/<status>.jpg if it was captured to a file.
+    #None if the frame is gone
+    def load_frame(self, robot_status, sequence):
+        if sequence is None:
+            return cv.imread("{}/capture/{}.jpg".format(sys.path[0],robot_status), cv.IMREAD_UNCHANGED)
+        frame = self.ring.read(sequence)
+        return None if frame is None else frame.image
+
+    #side output of in-memory frames, off the capture path
+    def save_frame(self, robot_status, sequence):
+        if self.save_captures and sequence is not None:
+            frame = self.ring.read(sequence)
+            if frame is not None:
+                cv.imwrite("{}/capture/{}.jpg".format(sys.path[0],robot_status), frame.image)
+
+    def stats(self):
+        stats = {"lost": self.lost}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.ring is not None:
+            self.ring.close()
+
+
+    def load_reference_contours(self):
+        if self.detector == "orb" and self.matcher is None:
+            self.matcher = FeatureMatcher()
         reference_img = cv.imread('{}/reference_arrow.jpg'.format(sys.path[0]), cv.IMREAD_GRAYSCALE)
         ret, th = cv.threshold(reference_img, 0, 255, cv.THRESH_BINARY)
-        cnts = cv.findContours(th, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
+        return cv.findContours(th, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
+
+    #recognizes the frame of a job and returns the messages for the PC, None if the frame was lost
+    def recognize(self, reference_contours, robot_status, sequence):
+        robot_x,robot_y,robot_dir = robot_status.split(",")
+        captured_image = self.load_frame(robot_status,sequence)
+        if captured_image is None:
+            self.lost += 1
+            log.warning("Frame for %s is no longer available, skipping it, %d frames lost", robot_status, self.lost)
+            return None
+        start = timer()
+        arrowsWithPartition = self.getImageLocation(reference_contours,captured_image)
+        end = timer()
+        if sequence is not None and not self.ring.valid(sequence):
+            self.lost += 1
+            log.warning("Frame for %s was overwritten during recognition, dropping the result, %d frames lost", robot_status, self.lost)
+            return None
+        log.debug("Time taken for arrow analysis of %s: %s. Arrows Found: %s", robot_status, end - start, len(arrowsWithPartition))
+        messages = []
+        if(arrowsWithPartition):
+            arrowLocAndFace = self.getArrowLocation(arrowsWithPartition,(int(robot_x),int(robot_y)),robot_dir)
+            for entry in arrowLocAndFace:
+                log.info("FOUND! For Status: %s, arrow location: %s", robot_status, entry)
+                messages.append("arrfound{}".format(entry))
+        else:
+            #test
+            messages.append("NOT FOUND")
+        self.save_frame(robot_status, sequence)
+        return messages
+
+    #recognizes jobs one at a time in this process, RecognitionPool spreads them over worker processes
+    def identify(self, listener_endpoint_rpi):
+        log.info("Starting Arrow Recognition Thread...")
+        cnts = self.load_reference_contours()
         while 1:
-            if(self.jobs.empty() is False):
-                robot_status = self.jobs.get()
-                robot_x,robot_y,robot_dir = robot_status.split(",")
+            robot_status, sequence, digest = self.jobs.get()
+            messages = self.cache.lookup(robot_status, digest) if self.cache is not None else None
+            if messages is None:
                 start = timer()
-                arrowsWithPartition = self.getImageLocation(cnts,robot_status)
-                end = timer()
-                print("Time taken for arrow analysis of {}: {}. Arrows Found: {}".format(robot_status,end - start, len(arrowsWithPartition)))
-                if(arrowsWithPartition):
-                    arrowLocAndFace = self.getArrowLocation(arrowsWithPartition,(int(robot_x),int(robot_y)),robot_dir)
-                    for entry in arrowLocAndFace:
-                        print("FOUND! For Status: {}, writing to endpoint arrow location: {}".format(robot_status,entry))
-                        listener_endpoint_rpi.send("arrfound{}".format(entry))
-                else:
-                    #test
-                    listener_endpoint_rpi.send("NOT FOUND")
-                    continue
+                messages = self.recognize(cnts, robot_status, sequence)
+                if self.cache is not None:
+                    self.cache.store(robot_status, digest, messages, timer() - start)
             else:
-                time.sleep(0.5)
+                log.debug("Reusing the result of the last frame at %s", robot_status)
+            #robot status travels with the report so the listener can close the capture's latency trace
+            for msg in messages or ():
+                listener_endpoint_rpi.send((robot_status, msg))
 
-        print("Terminating identification...")
+        log.info("Terminating identification...")
 
 
     def getArrowLocation(self,arrows, robotLocation, robotDir):
@@ -127,96 +360,106 @@ class ImageProcessor():
         #list of strings with x,y,face
         return arrowLocArray
 
-    def getImageLocation(self,reference_contours, captured_image_location):
-        arrows = []
-        dir = sys.path[0]
-        captured_image = cv.imread("{}/capture/{}.jpg".format(dir,captured_image_location), cv.IMREAD_UNCHANGED)
-        gray = cv.cvtColor(captured_image, cv.COLOR_RGB2GRAY)
-        blur = cv.GaussianBlur(gray, (5, 5), 2)
-        ret, thresholded_img = cv.threshold(blur, 50, 255, cv.THRESH_BINARY)
+    #captured_image is a BGR frame, in memory or read from a capture file, or the grey Y plane in luma mode
+    def getImageLocation(self,reference_contours, captured_image):
+        if self.detector == "orb":
+            return self.getImageLocationFeatures(captured_image)
+        if self.pyramid_scale:
+            return self.getImageLocationPyramid(reference_contours, captured_image)
+        thresholded_img = self.threshold(captured_image)
         #cv.imwrite("capture/{}_th.jpg".format(captured_image_location),thresholded_img)
         captured_cnts = cv.findContours(thresholded_img, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
-        # get image size
-        imgX = captured_image.shape[1]
-        imgY = captured_image.shape[0]
+        return self.classifyContours(reference_contours, captured_cnts, captured_image.shape[1], captured_image.shape[0])
+
+    #binary image of a BGR or grey frame, or of its region (x0, y0, x1, y1), bright areas white, in the pipeline's
+    #buffer until the next call
+    def threshold(self, captured_image, region=None):
+        return self.pipeline.run(captured_image, region)
+
+    #finds candidate contours on the frame scaled down by pyramid_scale and only thresholds and classifies
+    #the regions around them at full resolution
+    def getImageLocationPyramid(self, reference_contours, captured_image):
+        imgY, imgX = captured_image.shape[:2]
+        small = cv.resize(captured_image, None, fx=self.pyramid_scale, fy=self.pyramid_scale, interpolation=cv.INTER_AREA)
+        #area averaging in the resize smooths at least as much as the blur does at full resolution
+        thresholded_img = self.coarse_pipeline.run(small)
+        coarse_cnts = cv.findContours(thresholded_img, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)[1]
+        smallArea = small.shape[0] * small.shape[1]
+        margin = int(numpy.ceil(1 / self.pyramid_scale)) + self.pyramid_margin
+        minRatio = self.bands.min_ratio()
+        maxRatio = self.bands.max_ratio()
+        regions = []
+        for c in coarse_cnts:
+            objectAreaRatio = cv.contourArea(c) / smallArea
+            if not(minRatio * (1 - CANDIDATE_TOLERANCE) < objectAreaRatio < maxRatio * (1 + CANDIDATE_TOLERANCE)):
+                continue
+            x, y, w, h = cv.boundingRect(c)
+            regions.append((
+                max(0, int(x / self.pyramid_scale) - margin), max(0, int(y / self.pyramid_scale) - margin),
+                min(imgX, int((x + w) / self.pyramid_scale) + margin), min(imgY, int((y + h) / self.pyramid_scale) + margin)))
+        captured_cnts = []
+        for x0, y0, x1, y1 in merge_regions(regions):
+            thresholded_img = self.threshold(captured_image, (x0, y0, x1, y1))
+            captured_cnts.extend(cv.findContours(thresholded_img, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE, offset=(x0, y0))[1])
+        return self.classifyContours(reference_contours, captured_cnts, imgX, imgY)
+
+    #arrows on the cards the feature matcher finds
+    def getImageLocationFeatures(self, captured_image):
+        return self.classifyOutlines(self.matcher.locate(captured_image), captured_image.shape[1], captured_image.shape[0])
+
+    #(distance in grids, left/center/right) of each arrow outline, the projected reference arrow stands in for the contour
+    def classifyOutlines(self, outlines, imgX, imgY):
+        arrows = []
+        for outline in outlines:
+            objectAreaRatio = float(cv.contourArea(outline)) / (imgX * imgY)
+            distance = self.getDistance(objectAreaRatio)
+            if distance is None:
+                log.debug("No Match: %s", objectAreaRatio)
+                continue
+            arrows.append((distance, "center" if distance == 0 else self.getPosition(outline, imgX)))
+        return arrows
+
+    #(distance in grids, left/center/right) for each contour in captured_cnts that looks like an arrow
+    def classifyContours(self, reference_contours, captured_cnts, imgX, imgY):
+        arrows = []
         imgArea = imgX * imgY
-        # for each contour found
-        for (i, c) in enumerate(captured_cnts):
+        # for each contour that passes screening
+        for i in screen_contours(captured_cnts, imgArea, self.bands):
+            c = captured_cnts[i]
             # find number of edges the object has
             peri = cv.arcLength(c, True)
-            approx = cv.approxPolyDP(c, 0.01 * peri, True)
+            approx = cv.approxPolyDP(c, self.approx_epsilon * peri, True)
             if(not(6 <= len(approx) <= 8 )):
                 continue
 
             # conditional check
             # if contour matches any of the conditions we are looking for, we append the distance and location
-            # condition: 6-8 edges; matches given shape up to 0.25 likeliness; object to image area ratio
-            if (cv.matchShapes(reference_contours[0], c, 1, 0.0) < 0.1):
-                #cv.drawContours(captured_image, [c], -1, (0,255,0), 3)
-                #cv.imwrite("{}/capture/{}_cnt.jpg".format(dir,captured_image_location),captured_image)
-                # find area of the object
-                objectArea = float(cv.contourArea(c))
+            # condition: 6-8 edges; matches given shape; object to image area ratio within a distance band
+            if (cv.matchShapes(reference_contours[0], c, 1, 0.0) < self.match_threshold):
                 # find ratio of the area of object to the area of whole image
-                objectAreaRatio = objectArea / imgArea
-                
-                #appends (distance in grid, image)
-                
-                if 0.105 < objectAreaRatio < 0.31:
-                    # find X-axis of contour
-                    #M = cv.moments(c)
-                    #cx = int(M["m10"] / M["m00"])
-                    # find which part of the image the contour is on
-                    #if imgX / 3 < cx < 2 * (imgX / 3):
-                    #    a = "center"
-                    #elif cx < imgX / 3:
-                    #    a = "left"
-                    #else:
-                    #    a = "right"
-                    print("0cm: {}".format(objectAreaRatio))
-                    a = "center"
-                    arrows.append((0, a))
-                elif 0.048 < objectAreaRatio < 0.092:
-                    # find X-axis of contour
-                    M = cv.moments(c)
-                    cx = int(M["m10"] / M["m00"])
-                    # find which part of the image the contour is on
-                    if imgX / 3 < cx < 2 * (imgX / 3):
-                        a = "center"
-                    elif cx < imgX / 3:
-                        a = "left"
-                    else:
-                        a = "right"
-                    print("10cm: {}".format(objectAreaRatio))                        
-                    arrows.append((1, a))
-                elif 0.026 < objectAreaRatio < 0.041:
-                    # find X-axis of contour
-                    M = cv.moments(c)
-                    cx = int(M["m10"] / M["m00"])
-                    # find which part of the image the contour is on
-                    if imgX / 3 < cx < 2 * (imgX / 3):
-                        a = "center"
-                    elif cx < imgX / 3:
-                        a = "left"
-                    else:
-                        a = "right"
-                    print("20cm: {}".format(objectAreaRatio)) 
-                    arrows.append((2, a))
-                elif 0.015 < objectAreaRatio < 0.023:
-                    # find X-axis of contour
-                    M = cv.moments(c)
-                    cx = int(M["m10"] / M["m00"])
-                    # find which part of the image the contour is on
-                    if imgX / 3 < cx < 2 * (imgX / 3):
-                        a = "center"
-                    elif cx < imgX / 3:
-                        a = "left"
-                    else:
-                        a = "right"
-                    arrows.append((3, a))
-                    print("30cm: {}".format(objectAreaRatio))
-                else:
-                    print("No Match: {}".format(objectAreaRatio))
-
+                objectAreaRatio = float(cv.contourArea(c)) / imgArea
+                distance = self.getDistance(objectAreaRatio)
+                if distance is None:
+                    log.debug("No Match: %s", objectAreaRatio)
+                    continue
+                log.debug("%dcm: %s", distance * 10, objectAreaRatio)
+                #appends (distance in grid, image). an arrow right in front fills the frame, it is always center
+                arrows.append((distance, "center" if distance == 0 else self.getPosition(c, imgX)))
         return arrows
 
+    #distance in grids of an arrow covering objectAreaRatio of the frame, None outside every band
+    def getDistance(self, objectAreaRatio):
+        return self.bands.lookup(objectAreaRatio)
+
+    #which third of the frame the contour is in
+    def getPosition(self, c, imgX):
+        # find X-axis of contour
+        M = cv.moments(c)
+        cx = int(M["m10"] / M["m00"])
+        if imgX / 3 < cx < 2 * (imgX / 3):
+            return "center"
+        elif cx < imgX / 3:
+            return "left"
+        return "right"
+
 
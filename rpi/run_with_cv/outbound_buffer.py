@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+
+'''
+    Class OutboundBuffer holds messages written while a link is disconnected
+
+    Replaces the unbounded queue.Queue in PcWrapper and BluetoothWrapper. The buffer is bounded, and
+    state updates such as center{...} and mdf{...} are coalesced by key so only the latest one is kept,
+    since the receiver only cares about the current robot position and map. On reconnect all pending
+    frames go out in one vectored sendmsg instead of one sendall per message
+
+    A message can carry a sent callback, called once the message has gone out in a flush. It is never
+    called for messages that are dropped or replaced by a newer update
+'''
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+class OutboundBuffer(object):
+
+    '''
+        parameters
+            maxlen - maximum number of pending messages
+            overflow - DROP_OLDEST evicts the oldest pending message, DROP_NEWEST rejects the new one
+            coalesce - message keys (text before '{') where only the latest message is kept
+            terminator - appended to every message when flushing
+    '''
+    def __init__(self, maxlen=256, overflow=DROP_OLDEST, coalesce=("center", "mdf"), terminator="\n"):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.coalesce = frozenset(coalesce)
+        self.terminator = terminator
+        self.lock = threading.Lock()
+        #key -> (sequence, msg, sent). coalesced messages share their key, everything else gets a unique sequence key
+        self.entries = OrderedDict()
+        self.sequence = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, msg):
+        brace = msg.find("{")
+        if brace > 0 and msg[:brace] in self.coalesce:
+            return msg[:brace]
+        return None
+
+    #must be called with the lock held
+    def add(self, msg, sent=None):
+        self.sequence += 1
+        key = self.key(msg)
+        if key is not None and key in self.entries:
+            #replace the stale update and move it to the back so ordering follows the latest write
+            del self.entries[key]
+            self.coalesced += 1
+        elif len(self.entries) >= self.maxlen:
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                return False
+            self.entries.popitem(last=False)
+        self.entries[key if key is not None else self.sequence] = (self.sequence, msg, sent)
+        return True
+
+    #buffers msg, returns False if it was dropped
+    def put(self, msg, sent=None):
+        with self.lock:
+            return self.add(msg, sent)
+
+    #buffers msg only if there are already pending messages, so it is not sent ahead of them.
+    #returns False if the buffer is empty and the caller can write directly
+    def put_if_pending(self, msg, sent=None):
+        with self.lock:
+            if not self.entries:
+                return False
+            self.add(msg, sent)
+            return True
+
+    #removes and returns all pending messages in order, as (msg, sent) pairs. the caller calls sent once
+    #the message is written
+    def take(self):
+        with self.lock:
+            msgs = [(msg, sent) for sequence, msg, sent in self.entries.values()]
+            self.entries.clear()
+            return msgs
+
+    #sends every pending message over conn until the buffer is empty. messages written while a flush is
+    #in flight are picked up by the next round. on error the messages sent in full are removed, the rest
+    #stay buffered and the error is raised. a frame cut off by the error is sent again whole, the
+    #receiver drops the partial line with the connection that carried it
+    def flush(self, conn):
+        while 1:
+            with self.lock:
+                if not self.entries:
+                    return
+                snapshot = list(self.entries.items())
+            try:
+                send_frames(conn, ["{}{}".format(msg, self.terminator).encode() for key, (sequence, msg, sent) in snapshot])
+            except Exception as e:
+                self.remove(snapshot[:getattr(e, "frames_sent", 0)])
+                raise
+            self.remove(snapshot)
+
+    #drops sent entries and calls their sent callbacks
+    def remove(self, done):
+        with self.lock:
+            for key, (sequence, msg, sent) in done:
+                #a coalesced key may have been replaced by a newer update while sending, keep that one
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == sequence:
+                    del self.entries[key]
+        for key, (sequence, msg, sent) in done:
+            if sent is not None:
+                sent()
+
+    def stats(self):
+        return {"pending": len(self.entries), "dropped": self.dropped, "coalesced": self.coalesced}
+
+
+#linux limit on buffers per sendmsg call
+IOV_MAX = 1024
+
+#writes all frames with one vectored sendmsg where the socket supports it, else one sendall of the joined frames.
+#an error raised part way carries frames_sent, the number of leading frames that went out in full
+def send_frames(conn, frames):
+    if not hasattr(conn, "sendmsg"):
+        conn.sendall(b"".join(frames))
+        return
+    done = 0
+    for i in range(0, len(frames), IOV_MAX):
+        chunk = frames[i:i + IOV_MAX]
+        total = sum(len(frame) for frame in chunk)
+        sent = 0
+        try:
+            sent = conn.sendmsg(chunk)
+            if sent < total:
+                data = b"".join(chunk)
+                while sent < total:
+                    sent += conn.send(data[sent:])
+        except Exception as e:
+            #the frames of this chunk that went out before the error
+            for frame in chunk:
+                if sent < len(frame):
+                    break
+                sent -= len(frame)
+                done += 1
+            e.frames_sent = done
+            raise
+        done += len(chunk)
@@ -0,0 +1,201 @@
+import json
+from collections import OrderedDict
+from timeit import default_timer as timer
+import numpy
+import cv2 as cv
+from rpi_log import get_logger
+
+log = get_logger("preprocess")
+
+'''
+    Preprocessing of a frame before its contours are found, as a chain of OpenCV stages
+
+    A pipeline is described by a list of stages, each a dict naming the stage and its parameters, e.g.
+
+        [{"stage": "gray"}, {"stage": "gaussian", "ksize": 5, "sigma": 2}, {"stage": "threshold", "thresh": 50}]
+
+    so a chain can be kept in a JSON file, swept by tune_preprocess.py and handed to the recognizer
+    without code changes. Every stage writes into its own destination buffer. The buffers are allocated
+    by the first frame of a size and reused by every frame after it, a frame of another size allocates
+    them again. A region of a frame, e.g. a pyramid candidate, runs on views of the same frame sized
+    buffers, so regions of any size allocate nothing once the frame size is known. The last stage's
+    buffer is returned, so the result of run is only good until the next run. Each pipeline is used by
+    one thread
+
+    The coarse pass of a pyramid search runs the same chain on the scaled down frame without its
+    smoothing stages, see Pipeline.coarse
+
+    The time of each stage is kept, see timings
+'''
+
+
+def odd(value):
+    return int(value) | 1
+
+#each stage is function(src, dst, params, constant) returning its output, dst is None on the first frame of
+#a size and the function allocates it then. constant is built once from the params by the stage's setup
+
+#a single channel frame is already grey and goes through untouched
+def gray(src, dst, params, code):
+    return src if src.ndim == 2 else cv.cvtColor(src, code, dst=dst)
+
+def gaussian(src, dst, params, constant):
+    size = odd(params.get("ksize", 5))
+    return cv.GaussianBlur(src, (size, size), params.get("sigma", 0), dst=dst)
+
+def blur(src, dst, params, constant):
+    size = int(params.get("ksize", 5))
+    return cv.blur(src, (size, size), dst=dst)
+
+def median(src, dst, params, constant):
+    return cv.medianBlur(src, odd(params.get("ksize", 5)), dst=dst)
+
+def bilateral(src, dst, params, constant):
+    return cv.bilateralFilter(src, int(params.get("d", 9)), params.get("sigma_color", 75), params.get("sigma_space", 75), dst=dst)
+
+def threshold(src, dst, params, kind):
+    return cv.threshold(src, params.get("thresh", 50), 255, kind, dst=dst)[1]
+
+def adaptive(src, dst, params, method):
+    return cv.adaptiveThreshold(src, 255, method, cv.THRESH_BINARY, odd(params.get("block", 11)), params.get("c", 2), dst=dst)
+
+def laplacian(src, dst, params, constant):
+    return cv.Laplacian(src, cv.CV_8U, dst=dst, ksize=odd(params.get("ksize", 1)))
+
+def dilate(src, dst, params, kernel):
+    return cv.dilate(src, kernel, dst=dst, iterations=int(params.get("iterations", 1)))
+
+def erode(src, dst, params, kernel):
+    return cv.erode(src, kernel, dst=dst, iterations=int(params.get("iterations", 1)))
+
+def color_code(params):
+    return getattr(cv, "COLOR_" + params.get("code", "BGR2GRAY"))
+
+def threshold_kind(params):
+    return {"binary": cv.THRESH_BINARY, "binary_inv": cv.THRESH_BINARY_INV, "otsu": cv.THRESH_BINARY | cv.THRESH_OTSU}[params.get("type", "binary")]
+
+def adaptive_method(params):
+    return {"gaussian": cv.ADAPTIVE_THRESH_GAUSSIAN_C, "mean": cv.ADAPTIVE_THRESH_MEAN_C}[params.get("method", "gaussian")]
+
+def structuring_element(params):
+    size = int(params.get("ksize", 3))
+    return cv.getStructuringElement(cv.MORPH_RECT, (size, size))
+
+#stage name -> (function, setup or None)
+STAGES = {
+    "gray": (gray, color_code),
+    "gaussian": (gaussian, None),
+    "blur": (blur, None),
+    "median": (median, None),
+    "bilateral": (bilateral, None),
+    "threshold": (threshold, threshold_kind),
+    "adaptive": (adaptive, adaptive_method),
+    "laplacian": (laplacian, None),
+    "dilate": (dilate, structuring_element),
+    "erode": (erode, structuring_element),
+}
+#stages left out of the coarse chain, the area averaging of the resize smooths at least as much as they do
+SMOOTHING = ("gaussian", "blur", "median", "bilateral")
+
+
+class Pipeline(object):
+
+    '''
+        parameters
+            stages - list of {"stage": name, parameter: value, ...}, name one of STAGES
+    '''
+    def __init__(self, stages):
+        self.stages = [dict(stage) for stage in stages]
+        if not self.stages:
+            raise ValueError("No preprocessing stages")
+        self.steps = []
+        for stage in self.stages:
+            if stage.get("stage") not in STAGES:
+                raise ValueError("Unknown preprocessing stage {}, expected one of {}".format(stage.get("stage"), ", ".join(sorted(STAGES))))
+            function, build = STAGES[stage["stage"]]
+            params = dict((name, value) for name, value in stage.items() if name != "stage")
+            try:
+                constant = build(params) if build is not None else None
+            except (AttributeError, KeyError) as e:
+                raise ValueError("Bad parameter of preprocessing stage {}: {}".format(stage, e))
+            self.steps.append((function, params, constant))
+        #label of each stage in timings, numbered when a stage appears twice
+        names = [stage["stage"] for stage in self.stages]
+        self.names = [name if names.count(name) == 1 else "{}{}".format(name, names[:index + 1].count(name)) for index, name in enumerate(names)]
+        #(shape, dtype) of the frames the buffers were allocated for
+        self.input = None
+        self.buffers = [None] * len(self.steps)
+        #arrays allocated by run, buffers and any output OpenCV could not write into its buffer
+        self.allocations = 0
+        self.frames = 0
+        self.seconds = [0.0] * len(self.steps)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)["stages"])
+
+    def to_list(self):
+        return [dict(stage) for stage in self.stages]
+
+    #the chain for frames scaled down to find pyramid candidates, with its own buffers. a chain of
+    #smoothing stages only is kept whole
+    def coarse(self):
+        return Pipeline([stage for stage in self.stages if stage["stage"] not in SMOOTHING] or self.stages)
+
+    #the chain applied to image, or to its region (x0, y0, x1, y1), in a buffer that the next run overwrites
+    def run(self, image, region=None):
+        if self.input != (image.shape, image.dtype):
+            if self.input is not None:
+                log.debug("Frames went from %s to %s, allocating new buffers", self.input[0], image.shape)
+            self.input = (image.shape, image.dtype)
+            self.buffers = [None] * len(self.steps)
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = region if region is not None else (0, 0, width, height)
+        data = image[y0:y1, x0:x1]
+        for index, (function, params, constant) in enumerate(self.steps):
+            buffer = self.buffers[index]
+            dst = buffer[y0:y1, x0:x1] if buffer is not None else None
+            start = timer()
+            output = function(data, dst, params, constant)
+            self.seconds[index] += timer() - start
+            #a stage that passes its input through keeps no buffer, its input may be the caller's frame
+            if output is not data and output is not dst:
+                self.allocations += 1
+                if dst is not None:
+                    log.debug("%s did not write into its buffer", self.names[index])
+                elif output.shape[:2] == (height, width):
+                    self.buffers[index] = output
+                else:
+                    #first run on a region, its output gives the channels and type of the frame sized buffer
+                    buffer = numpy.empty((height, width) + output.shape[2:], output.dtype)
+                    buffer[y0:y1, x0:x1] = output
+                    self.buffers[index] = buffer
+                    self.allocations += 1
+            data = output
+        self.frames += 1
+        return data
+
+    #milliseconds per frame spent in each stage
+    def timings(self):
+        return OrderedDict((name, seconds / self.frames * 1e3 if self.frames else 0.0) for name, seconds in zip(self.names, self.seconds))
+
+    def reset_timings(self):
+        self.frames = 0
+        self.seconds = [0.0] * len(self.steps)
+
+    def __repr__(self):
+        return " -> ".join(" ".join([stage["stage"]] + ["{}={}".format(name, value) for name, value in sorted(stage.items()) if name != "stage"]) for stage in self.stages)
+
+
+#what ImageProcessor.threshold has always done. RGB2GRAY is the channel order it has always used on BGR frames
+def default_pipeline(binary_threshold):
+    return Pipeline([{"stage": "gray", "code": "RGB2GRAY"}, {"stage": "gaussian", "ksize": 5, "sigma": 2}, {"stage": "threshold", "thresh": binary_threshold}])
+
+#a Pipeline from a Pipeline, a file written by tune_preprocess.py or a list of stages
+def pipeline(stages):
+    if isinstance(stages, Pipeline):
+        return stages
+    if isinstance(stages, str):
+        return Pipeline.load(stages)
+    return Pipeline(stages)
@@ -0,0 +1,201 @@
+import os
+import threading
+import cv2 as cv
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from queue import Queue
+from timeit import default_timer as timer
+from frame_ring import FrameRing
+from img_recognition import ImageProcessor
+from rpi_log import get_logger
+
+log = get_logger("recognition_pool")
+
+'''
+    Pool of recognition worker processes
+
+    Replaces the identify thread, which recognized one frame at a time on a single core. The dispatcher
+    blocks on the capture jobs and on a free worker, and sends each job's robot status and frame ring
+    sequence down that worker's pipe. Workers attach to the frame ring and read the frame in place, each
+    with its own copy of the reference contours. The collector delivers results to the listener in
+    capture order, whichever worker finishes first. A worker that dies is started again and the job it
+    held is dropped, the same as a frame lost in the ring. With a RecognitionCache, a job whose frame is a
+    near duplicate of the last one at its robot status is answered by the dispatcher without a worker
+'''
+
+#one core is left for the capture thread and the listener process
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+#worker processes are spawned rather than forked, so they do not inherit the camera from the capture thread
+context = get_context("spawn")
+
+
+#worker process entry point. recognizes jobs from conn and sends back (job number, messages)
+def recognize_frames(ring_name, conn, options):
+    #the pool spreads work over the cores, OpenCV's own threads would only compete with the other workers
+    cv.setNumThreads(1)
+    processor = ImageProcessor(ring=FrameRing.attach(ring_name) if ring_name else None, slots=0, **options)
+    cnts = processor.load_reference_contours()
+    while 1:
+        try:
+            number, robot_status, sequence = conn.recv()
+        except EOFError:
+            break
+        conn.send((number, processor.recognize(cnts, robot_status, sequence)))
+
+
+class RecognitionPool(object):
+
+    '''
+        parameters
+            ring_name - shared memory name of the capture process's frame ring, None when frames are
+                        captured to files
+            workers - worker processes, e.g. one per core not needed for capture
+            cache - RecognitionCache of recent results to reuse, None recognizes every frame
+            options - ImageProcessor keyword arguments for the workers, e.g. save_captures or pyramid_scale
+    '''
+    def __init__(self, ring_name, workers=WORKERS, cache=None, **options):
+        self.ring_name = ring_name
+        self.cache = cache
+        self.options = options
+        #(process, pipe) of each worker
+        self.workers = [None] * workers
+        #(job number, robot status, frame hash, dispatch time) of what each worker is recognizing, None while it is idle
+        self.in_flight = [None] * workers
+        #indices of workers waiting for a job
+        self.idle = Queue()
+        #guards workers and in_flight between the dispatcher and the collector
+        self.lock = threading.Lock()
+        #cache hits are delivered by the dispatcher, everything else by the collector
+        self.delivery_lock = threading.Lock()
+        self.listener_endpoint_rpi = None
+        #results not yet delivered because an earlier job is still running, by job number
+        self.done = {}
+        self.submitted = 0
+        self.delivered = 0
+        self.restarts = 0
+        #jobs whose frame was lost or overwritten in the ring before the worker was done with it
+        self.lost = 0
+        self.closing = False
+        with self.lock:
+            for index in range(workers):
+                self.start_worker(index)
+                self.idle.put(index)
+        log.info("Started %d recognition workers", workers)
+
+    #call with the lock held
+    def start_worker(self, index):
+        conn, worker_conn = context.Pipe()
+        process = context.Process(target=recognize_frames, args=(self.ring_name, worker_conn, self.options), name="recognizer-{}".format(index))
+        process.daemon = True
+        process.start()
+        worker_conn.close()
+        self.workers[index] = (process, conn)
+
+    #sends each job from jobs to the next free worker, blocking while there is neither
+    def dispatch(self, jobs):
+        while 1:
+            robot_status, sequence, digest = jobs.get()
+            cached = self.cache.lookup(robot_status, digest) if self.cache is not None else None
+            if cached is not None:
+                with self.lock:
+                    number = self.submitted
+                    self.submitted += 1
+                log.debug("Reusing the result of the last frame at %s", robot_status)
+                self.finish(number, robot_status, cached, self.listener_endpoint_rpi)
+                continue
+            index = self.idle.get()
+            with self.lock:
+                number = self.submitted
+                self.submitted += 1
+                self.in_flight[index] = (number, robot_status, digest, timer())
+                try:
+                    self.workers[index][1].send((number, robot_status, sequence))
+                except (OSError, ValueError) as e:
+                    #the worker died, the collector restarts it and drops the job
+                    log.warning("Recognition worker %d unreachable: %s", index, e)
+
+    #delivers the results of every job up to the first one still running
+    def finish(self, number, robot_status, messages, listener_endpoint_rpi):
+        with self.delivery_lock:
+            self.done[number] = (robot_status, messages)
+            while self.delivered in self.done:
+                robot_status, messages = self.done.pop(self.delivered)
+                self.delivered += 1
+                #robot status travels with the report so the listener can close the capture's latency trace
+                for msg in messages or ():
+                    listener_endpoint_rpi.send((robot_status, msg))
+
+    #waits on every worker's pipe and process, delivering results and restarting workers that died
+    def collect(self, listener_endpoint_rpi):
+        while not self.closing:
+            with self.lock:
+                conns = dict((conn, index) for index, (process, conn) in enumerate(self.workers))
+                sentinels = dict((process.sentinel, index) for index, (process, conn) in enumerate(self.workers))
+            ready = wait(list(conns) + list(sentinels))
+            #results first, a worker may have finished its job before dying
+            for conn in [obj for obj in ready if obj in conns]:
+                index = conns[conn]
+                try:
+                    number, messages = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                with self.lock:
+                    if self.workers[index][1] is not conn:
+                        continue
+                    number, robot_status, digest, dispatched = self.in_flight[index]
+                    self.in_flight[index] = None
+                self.idle.put(index)
+                if messages is None:
+                    self.lost += 1
+                if self.cache is not None:
+                    self.cache.store(robot_status, digest, messages, timer() - dispatched)
+                self.finish(number, robot_status, messages, listener_endpoint_rpi)
+            for sentinel in [obj for obj in ready if obj in sentinels]:
+                if not self.closing:
+                    self.restart(sentinels[sentinel], listener_endpoint_rpi)
+
+    def restart(self, index, listener_endpoint_rpi):
+        with self.lock:
+            process, conn = self.workers[index]
+            job = self.in_flight[index]
+            self.in_flight[index] = None
+            conn.close()
+            #the sentinel is ready, so this only reaps it
+            process.join()
+            self.restarts += 1
+            log.warning("Recognition worker %d exited with %s, restarting it", index, process.exitcode)
+            self.start_worker(index)
+        #an idle worker's index is already waiting in idle or held by the dispatcher
+        if job is not None:
+            number, robot_status = job[:2]
+            log.warning("Dropping recognition of %s", robot_status)
+            self.idle.put(index)
+            self.finish(number, robot_status, None, listener_endpoint_rpi)
+
+    #starts the collector, results go to listener_endpoint_rpi as (robot status, message)
+    def start(self, listener_endpoint_rpi):
+        self.listener_endpoint_rpi = listener_endpoint_rpi
+        collector = threading.Thread(target=self.collect, args=(listener_endpoint_rpi,), name="recognition-collector")
+        collector.daemon = True
+        collector.start()
+
+    def run(self, jobs, listener_endpoint_rpi):
+        log.info("Starting Arrow Recognition Pool...")
+        self.start(listener_endpoint_rpi)
+        self.dispatch(jobs)
+
+    def close(self):
+        self.closing = True
+        with self.lock:
+            for process, conn in self.workers:
+                process.terminate()
+            for process, conn in self.workers:
+                process.join()
+                conn.close()
+
+    def stats(self):
+        stats = {"workers": len(self.workers), "submitted": self.submitted, "delivered": self.delivered, "restarts": self.restarts, "lost": self.lost}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
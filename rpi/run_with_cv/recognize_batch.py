@@ -0,0 +1,153 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import re
+import sys
+import cv2 as cv
+from multiprocessing import Pool
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor, AREA_BANDS, MATCH_THRESHOLD, BINARY_THRESHOLD, APPROX_EPSILON
+from distance_bands import band_table, default_band_table
+from preprocess import pipeline
+from benchmark_recognition import ground_truth, score
+
+'''
+    Offline batch recognition of captured frames
+
+    Re-scores a session's captures without the robot. Frames named after the robot status they were
+    captured at, <x>,<y>,<dir>.jpg as the capture thread writes them, also get the arrows' grid positions
+    from getArrowLocation. Each frame is recognized with every combination of the parameter values given,
+    decoded once for all of them, and frames are spread over a process pool. Results stream out as one
+    JSON object per frame and parameter set as they finish, e.g.
+
+        python3 recognize_batch.py capture/ > session.jsonl
+        python3 recognize_batch.py "../opencv/test/*.jpg" --match-threshold 0.05 0.1 0.2 --binary-threshold 40 50 60 --summary
+
+    --summary adds a table per parameter set on stderr, with precision and recall for frames whose names
+    give the expected arrows, see benchmark_recognition
+'''
+
+STATUS = re.compile(r"^(-?\d+),(-?\d+),([udlr])$")
+EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULTS = {"area_bands": default_band_table(AREA_BANDS).to_list(), "match_threshold": MATCH_THRESHOLD, "binary_threshold": BINARY_THRESHOLD, "approx_epsilon": APPROX_EPSILON, "pyramid_scale": None, "preprocess": None}
+
+#set in each pool worker by start_worker
+processors = None
+reference_contours = None
+
+
+def expand(inputs):
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            paths.extend(sorted(os.path.join(entry, name) for name in os.listdir(entry) if name.lower().endswith(EXTENSIONS)))
+        else:
+            paths.extend(sorted(glob.glob(entry)))
+    return paths
+
+#every combination of the values given for each parameter, as ImageProcessor keyword arguments
+def parameter_grid(args):
+    names = ["area_bands", "match_threshold", "binary_threshold", "approx_epsilon", "pyramid_scale", "preprocess"]
+    #tables and chains given as files are written out in full, so every set line says which it used
+    values = [[band_table(bands if os.path.exists(bands) else json.loads(bands)).to_list() for bands in args.bands], args.match_threshold, args.binary_threshold, args.approx_epsilon, args.pyramid_scale,
+              [pipeline(stages).to_list() if stages is not None else None for stages in args.preprocess]]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def start_worker(grid):
+    global processors, reference_contours
+    #one process per core already, OpenCV's threads would only compete
+    cv.setNumThreads(1)
+    processors = [ImageProcessor(slots=0, **params) for params in grid]
+    reference_contours = processors[0].load_reference_contours()
+
+#recognizes one frame with every parameter set, returns a result per set
+def recognize_file(path):
+    start = timer()
+    #frames from the camera are BGR, a grey or transparent picture is converted the same way
+    frame = cv.imread(path, cv.IMREAD_COLOR)
+    decode = timer() - start
+    name = os.path.splitext(os.path.basename(path))[0]
+    status = STATUS.match(name)
+    results = []
+    for index, processor in enumerate(processors):
+        result = {"image": path, "params": index, "status": name if status else None, "decode_ms": decode * 1e3}
+        if frame is None:
+            result["error"] = "cannot read image"
+            results.append(result)
+            continue
+        start = timer()
+        try:
+            arrows = processor.getImageLocation(reference_contours, frame)
+        except cv.error as e:
+            result["error"] = str(e)
+            results.append(result)
+            continue
+        result["recognize_ms"] = (timer() - start) * 1e3
+        result["arrows"] = sorted(arrows)
+        if status and arrows:
+            result["locations"] = processor.getArrowLocation(arrows, (int(status.group(1)), int(status.group(2))), status.group(3))
+        results.append(result)
+    return results
+
+def print_summary(grid, totals):
+    sys.stderr.write("{:<6} {:<52} {:>7} {:>8} {:>10} {:>8} {:>8}\n".format("set", "parameters", "frames", "arrows", "mean (ms)", "precision", "recall"))
+    for index, params in enumerate(grid):
+        total = totals[index]
+        changed = dict((name, value) for name, value in params.items() if value != DEFAULTS[name])
+        true_positives, false_positives, false_negatives = total["score"]
+        precision = "{:.3f}".format(true_positives / float(true_positives + false_positives)) if true_positives + false_positives else "-"
+        recall = "{:.3f}".format(true_positives / float(true_positives + false_negatives)) if true_positives + false_negatives else "-"
+        sys.stderr.write("{:<6} {:<52} {:>7} {:>8} {:>10.1f} {:>8} {:>8}\n".format(
+            index, json.dumps(changed) if changed else "defaults", total["frames"], total["arrows"],
+            total["ms"] / max(1, total["frames"]), precision, recall))
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch arrow recognition over captured frames with parameter sweeps")
+    parser.add_argument("inputs", nargs="+", help="directories or globs of frames")
+    parser.add_argument("--bands", nargs="+", default=[json.dumps(DEFAULTS["area_bands"])], help="area ratio band tables, calibrate_bands.py files or JSON [[low, high], ...] from 0cm out")
+    parser.add_argument("--match-threshold", type=float, nargs="+", default=[MATCH_THRESHOLD], help="matchShapes thresholds")
+    parser.add_argument("--binary-threshold", type=int, nargs="+", default=[BINARY_THRESHOLD], help="grey level thresholds")
+    parser.add_argument("--approx-epsilon", type=float, nargs="+", default=[APPROX_EPSILON], help="approxPolyDP tolerances as a fraction of the perimeter")
+    parser.add_argument("--pyramid-scale", type=float, nargs="+", default=[None], help="coarse to fine scales")
+    parser.add_argument("--preprocess", nargs="+", default=[None], help="tune_preprocess.py chain files, in place of the blur and binary threshold")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="recognition processes")
+    parser.add_argument("--output", help="write the JSON lines here instead of stdout")
+    parser.add_argument("--summary", action="store_true", help="print a table per parameter set on stderr at the end")
+    args = parser.parse_args()
+
+    paths = expand(args.inputs)
+    grid = parameter_grid(args)
+    out = open(args.output, "w") if args.output else sys.stdout
+    #every line names its parameter set by index, the sets come first
+    for index, params in enumerate(grid):
+        out.write(json.dumps({"params": index, "set": params}, sort_keys=True) + "\n")
+    totals = [{"frames": 0, "arrows": 0, "ms": 0.0, "score": [0, 0, 0]} for _ in grid]
+    start = timer()
+    pool = Pool(args.workers, initializer=start_worker, initargs=(grid,))
+    try:
+        for results in pool.imap_unordered(recognize_file, paths):
+            for result in results:
+                out.write(json.dumps(result, sort_keys=True) + "\n")
+                if "arrows" not in result:
+                    continue
+                total = totals[result["params"]]
+                total["frames"] += 1
+                total["arrows"] += len(result["arrows"])
+                total["ms"] += result["recognize_ms"]
+                expected = ground_truth(result["image"])
+                if expected is not None:
+                    counts = score([tuple(arrow) for arrow in result["arrows"]], expected)
+                    total["score"] = [sum(pair) for pair in zip(total["score"], counts)]
+            out.flush()
+    finally:
+        pool.terminate()
+        if out is not sys.stdout:
+            out.close()
+    sys.stderr.write("{} frames x {} parameter sets in {:.1f}s\n".format(len(paths), len(grid), timer() - start))
+    if args.summary:
+        print_summary(grid, totals)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import sys
+import threading
+from collections import Counter
+from multiprocessing import Pipe
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor, AREA_BANDS, DETECTORS
+from recognition_pool import RecognitionPool
+from distance_bands import band_table, default_band_table
+from frame_source import ReplaySource, SyntheticSource
+
+'''
+    Runs recognition over a recorded run, a directory of captures or synthetic frames as the robot does
+
+    Stands in for the PC: each robot status of the run is sent to capture_frames in turn, the next once
+    the capture is acknowledged, and results are collected from the identify thread or a
+    RecognitionPool the way the listener gets them. Reports capture acknowledgement and capture to
+    result latencies, frames per second and the arrows reported. For synthetic frames it also gives
+    precision and recall against the arrows drawn, e.g.
+
+        RPI_RECORD=run1.frames python3 coordinator.py       records a run on the robot
+        python3 replay_run.py run1.frames --realtime --workers 3
+        python3 replay_run.py capture/ --record run2.frames
+        python3 replay_run.py --synthetic 200 --pyramid-scale 0.25
+
+    Results come back in capture order, so each message is put down to the capture its status was sent
+    for. Two captures in a row at the same status are counted as one
+'''
+
+#longest wait for a capture acknowledgement, as the listener polls
+ACK_TIMEOUT = 1
+#longest wait for the last results once every capture is acknowledged
+DRAIN_TIMEOUT = 10
+
+
+#stands in for the pipe to the listener, matching results to captures
+class ResultCollector(object):
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requested = [None] * len(statuses)
+        #time of the first result of each capture, and its messages
+        self.answered = [None] * len(statuses)
+        self.messages = [[] for _ in statuses]
+        self.current = 0
+        self.lock = threading.Lock()
+        self.progress = threading.Condition(self.lock)
+
+    def request(self, index):
+        self.requested[index] = timer()
+
+    def send(self, result):
+        robot_status, msg = result
+        with self.lock:
+            if not(self.answered[self.current] is not None and self.statuses[self.current] == robot_status):
+                #captures skipped on the way lost their frames
+                while self.current < len(self.statuses) and not(self.statuses[self.current] == robot_status and self.answered[self.current] is None):
+                    self.current += 1
+                if self.current == len(self.statuses):
+                    self.current -= 1
+                    return
+                self.answered[self.current] = timer()
+            self.messages[self.current].append(msg)
+            self.progress.notify_all()
+
+    #waits until the last capture sent has results or nothing arrives for timeout seconds
+    def wait(self, last, timeout):
+        with self.lock:
+            while self.answered[last] is None:
+                if not self.progress.wait(timeout):
+                    return
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognition over a recorded, replayed or synthetic run")
+    parser.add_argument("input", nargs="?", help="FrameRecorder file or directory of captures")
+    parser.add_argument("--synthetic", type=int, help="draw this many frames of arrows instead")
+    parser.add_argument("--seed", type=int, default=0, help="arrows of the synthetic frames")
+    parser.add_argument("--realtime", action="store_true", help="replay with the gaps the frames were captured at")
+    parser.add_argument("--workers", type=int, default=0, help="recognition worker processes, 0 for the identify thread")
+    parser.add_argument("--pyramid-scale", type=float, help="coarse to fine scale")
+    parser.add_argument("--bands", help="area ratio bands file, the recognizer's by default")
+    parser.add_argument("--detector", default="contour", choices=DETECTORS, help="how arrows are found, orb is experimental")
+    parser.add_argument("--luma", action="store_true", help="recognize grey frames from a YUV ring, as RPI_LUMA=1 does")
+    parser.add_argument("--cache", type=int, default=0, help="frame cache size")
+    parser.add_argument("--record", help="record the frames captured to this file, e.g. to turn a directory of captures into a recording")
+    parser.add_argument("--output", help="write one JSON line per capture here")
+    args = parser.parse_args()
+    if args.input is None and not args.synthetic:
+        parser.error("give a recording or directory, or --synthetic")
+
+    bands = band_table(args.bands) if args.bands else default_band_table(AREA_BANDS)
+    source = SyntheticSource(bands, args.synthetic, seed=args.seed) if args.synthetic else ReplaySource(args.input, args.realtime)
+    statuses = source.statuses()
+    if not statuses:
+        sys.exit("No frames in {}".format(args.input))
+    processor = ImageProcessor(source=source, pyramid_scale=args.pyramid_scale, area_bands=bands, cache_size=args.cache, record=args.record, detector=args.detector, luma=args.luma)
+    collector = ResultCollector(statuses)
+    pc_endpoint, camera_endpoint = Pipe()
+    pool = None
+    if args.workers:
+        pool = RecognitionPool(processor.ring.name, args.workers, processor.cache, pyramid_scale=args.pyramid_scale, area_bands=bands.to_list(), detector=args.detector)
+        pool.start(collector)
+        recognizer = threading.Thread(target=pool.dispatch, args=(processor.jobs,))
+    else:
+        recognizer = threading.Thread(target=processor.identify, args=(collector,))
+    capture = threading.Thread(target=processor.capture_frames, args=(camera_endpoint,))
+    for thread in (recognizer, capture):
+        thread.daemon = True
+        thread.start()
+
+    acks = []
+    sent = 0
+    try:
+        if pool is not None:
+            #workers load their reference contours before the first frame, do not time that
+            pool.idle.put(pool.idle.get())
+        start = timer()
+        for index, status in enumerate(statuses):
+            collector.request(index)
+            pc_endpoint.send(status)
+            if not pc_endpoint.poll(ACK_TIMEOUT):
+                sys.stderr.write("Capture {} for {} not acknowledged, stopping\n".format(index, status))
+                break
+            pc_endpoint.recv()
+            acks.append(timer() - collector.requested[index])
+            sent += 1
+        collector.wait(sent - 1, DRAIN_TIMEOUT)
+        elapsed = timer() - start
+    finally:
+        #ends the capture thread, which may still be recording the last frame
+        pc_endpoint.close()
+        capture.join()
+        if pool is not None:
+            pool.close()
+
+    latencies = sorted(collector.answered[index] - collector.requested[index] for index in range(sent) if collector.answered[index] is not None)
+    acks.sort()
+    totals = [0, 0, 0]
+    out = open(args.output, "w") if args.output else None
+    for index in range(sent):
+        record = {"status": statuses[index], "messages": collector.messages[index]}
+        if collector.answered[index] is not None:
+            record["result_ms"] = (collector.answered[index] - collector.requested[index]) * 1e3
+        if args.synthetic:
+            arrows = source.arrows(index)
+            expected = ["arrfound" + entry for entry in processor.getArrowLocation(arrows, tuple(int(v) for v in statuses[index].split(",")[:2]), statuses[index][-1])] if arrows else []
+            found = Counter(msg for msg in collector.messages[index] if msg.startswith("arrfound"))
+            true_positives = sum((found & Counter(expected)).values())
+            totals = [totals[0] + true_positives, totals[1] + sum(found.values()) - true_positives, totals[2] + len(expected) - true_positives]
+            record["expected"] = expected
+        if out is not None:
+            out.write(json.dumps(record, sort_keys=True) + "\n")
+    if out is not None:
+        out.close()
+
+    print("{} frames, {} acknowledged, {} with results in {:.1f}s, {:.1f} frames/s".format(len(statuses), sent, len(latencies), elapsed, len(latencies) / elapsed))
+    print("acknowledgement p50 {:.1f}ms p99 {:.1f}ms, result p50 {:.1f}ms p99 {:.1f}ms max {:.1f}ms".format(
+        percentile(acks, 50) * 1e3, percentile(acks, 99) * 1e3, percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3,
+        (latencies[-1] if latencies else 0.0) * 1e3))
+    print("{} arrows reported".format(sum(1 for messages in collector.messages for msg in messages if msg.startswith("arrfound"))))
+    if args.synthetic:
+        true_positives, false_positives, false_negatives = totals
+        print("precision {:.3f}, recall {:.3f} against the arrows drawn".format(
+            true_positives / float(true_positives + false_positives) if true_positives + false_positives else 1.0,
+            true_positives / float(true_positives + false_negatives) if true_positives + false_negatives else 1.0))
+    print("{} frames lost before recognition finished with them".format(pool.lost if pool is not None else processor.lost))
+    if processor.cache is not None:
+        print("frame cache: {}".format(processor.cache.stats()))
+    processor.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+import asyncio
+import functools
+import queue
+import threading
+import time
+from rpi_log import get_logger
+
+log = get_logger("router")
+
+'''
+    Prefix router shared by the coordinators
+
+    Each source link (pc, bt, arduino) has a table of message prefixes pointing at a destination. The
+    tables are compiled once into dicts keyed by prefix, grouped by prefix length longest first, so a
+    lookup is a few dict hits instead of a startswith chain. Every destination owns a bounded queue
+    drained by its own writer, so a stalled sink only fills its own queue and never blocks the reader
+    that produced the message
+
+    A destination can be paused while its device is away, e.g. the Arduino re-enumerating after a
+    brownout. Paused destinations either hold messages in their queue until resumed or reject them
+
+    When a Tracer is attached and the caller passes the receive timestamp, queued messages carry their
+    route and timestamps so the writer can record the enqueue to write latency. Destinations call
+    write(msg, sent). A write that only buffers or queues the message returns False and calls sent
+    once the message actually goes out, e.g. from an OutboundBuffer flush or the SerialPump
+'''
+
+class Route(object):
+
+    def __init__(self, source, prefix, destination):
+        self.source = source
+        self.prefix = prefix
+        self.destination = destination
+        self.forwarded = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return "{}:{}->{}".format(self.source, self.prefix, self.destination)
+
+
+'''
+    Class Destination drains a bounded queue into a blocking write on its own thread
+'''
+class Destination(object):
+
+    def __init__(self, name, write, maxsize=256):
+        self.name = name
+        self.write = write
+        self.queue = queue.Queue(maxsize)
+        self.tracer = None
+        #cleared while paused, the writer waits on it before every write
+        self.available = threading.Event()
+        self.available.set()
+        self.rejecting = False
+        self.thread = threading.Thread(target=self.run, name="{}-writer".format(name))
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    #stops writing until resume. with reject, messages offered in the meantime are dropped instead of queued
+    def pause(self, reject=False):
+        self.rejecting = reject
+        self.available.clear()
+
+    def resume(self):
+        self.rejecting = False
+        self.available.set()
+
+    #returns False if the queue is full or the destination is rejecting, and the message was dropped
+    def offer(self, msg):
+        if self.rejecting:
+            return False
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while 1:
+            msg = self.queue.get()
+            self.available.wait()
+            sent = None
+            if type(msg) is list:
+                msg, sent = msg[0], functools.partial(self.tracer.written, *msg[1:])
+            try:
+                #a write that only buffered or queued the message returns False and calls sent when it goes out
+                if self.write(msg, sent) is not False and sent is not None:
+                    sent()
+            except Exception as e:
+                log.warning("%s writer encountering the following error: %s", self.name, e)
+
+
+'''
+    Class AsyncDestination is the event loop version, write is a coroutine function awaited by a writer task
+'''
+class AsyncDestination(object):
+
+    def __init__(self, name, write, maxsize=256):
+        self.name = name
+        self.write = write
+        self.queue = asyncio.Queue(maxsize)
+        self.tracer = None
+        self.available = asyncio.Event()
+        self.available.set()
+        self.rejecting = False
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def pause(self, reject=False):
+        self.rejecting = reject
+        self.available.clear()
+
+    def resume(self):
+        self.rejecting = False
+        self.available.set()
+
+    def offer(self, msg):
+        if self.rejecting:
+            return False
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def run(self):
+        while 1:
+            msg = await self.queue.get()
+            await self.available.wait()
+            sent = None
+            if type(msg) is list:
+                msg, sent = msg[0], functools.partial(self.tracer.written, *msg[1:])
+            try:
+                if await self.write(msg, sent) is not False and sent is not None:
+                    sent()
+            except Exception as e:
+                log.warning("%s writer encountering the following error: %s", self.name, e)
+
+
+class Router(object):
+
+    def __init__(self, tracer=None):
+        self.routes = {}
+        self.destinations = {}
+        self.tables = {}
+        self.tracer = tracer
+        #destination -> [messages queued, messages dropped] by send
+        self.sends = {}
+
+    def add_destination(self, destination):
+        destination.tracer = self.tracer
+        self.destinations[destination.name] = destination
+        return destination
+
+    #destinations that are not registered are handled inline by the caller, e.g. the camera capture
+    def add_route(self, source, prefix, destination):
+        self.routes.setdefault(source, []).append(Route(source, prefix, destination))
+        return self
+
+    #builds the per source lookup tables. must be called after all routes are added
+    def compile(self):
+        self.tables = {}
+        for source, routes in self.routes.items():
+            by_length = {}
+            for route in routes:
+                by_length.setdefault(len(route.prefix), {})[route.prefix] = route
+            self.tables[source] = sorted(by_length.items(), reverse=True)
+        return self
+
+    def start(self):
+        for destination in self.destinations.values():
+            destination.start()
+
+    #returns the route for msg from source, or None if no prefix matches
+    def match(self, source, msg):
+        for length, table in self.tables.get(source, ()):
+            route = table.get(msg[:length])
+            if route is not None:
+                return route
+        return None
+
+    #queues the message with its prefix stripped to the route's destination, returns False if dropped.
+    #received is the tracer timestamp taken when the message was read, None when tracing is off
+    def forward(self, route, msg, received=None):
+        routed = time.monotonic() if received is not None else None
+        payload = msg[len(route.prefix):]
+        trace = None
+        if routed is not None and self.tracer is not None:
+            #[message, route, received, enqueued], enqueued is stamped once the queue has taken it
+            payload = trace = [payload, repr(route), received, None]
+        destination = self.destinations[route.destination]
+        if destination.offer(payload):
+            route.forwarded += 1
+            if trace is not None:
+                trace[3] = time.monotonic()
+                self.tracer.routed(trace[1], received, routed, trace[3])
+            return True
+        route.dropped += 1
+        log.warning("Dropped %s for %s, %s", msg, route, "destination paused" if destination.rejecting else "queue full")
+        return False
+
+    #holds or rejects traffic for a destination whose device is gone
+    def pause(self, destination, reject=False):
+        self.destinations[destination].pause(reject)
+        log.info("Paused %s, %s new messages", destination, "rejecting" if reject else "holding")
+
+    def resume(self, destination):
+        self.destinations[destination].resume()
+        log.info("Resumed %s with %d messages queued", destination, self.destinations[destination].depth())
+
+    #matches and forwards in one call. returns the route taken, or None if no prefix matches
+    def dispatch(self, source, msg, received=None):
+        route = self.match(source, msg)
+        if route is not None and route.destination in self.destinations:
+            self.forward(route, msg, received)
+        return route
+
+    #queues a message that did not come from a routed source, e.g. arrow reports. returns False if dropped
+    def send(self, destination, msg):
+        target = self.destinations[destination]
+        counts = self.sends.setdefault(destination, [0, 0])
+        if target.offer(msg):
+            counts[0] += 1
+            return True
+        counts[1] += 1
+        log.warning("Dropped %s for %s, %s", msg, destination, "destination paused" if target.rejecting else "queue full")
+        return False
+
+    #queue depth of the destination and counters for every route
+    def stats(self):
+        stats = []
+        for routes in self.routes.values():
+            for route in routes:
+                destination = self.destinations.get(route.destination)
+                stats.append({
+                    "route": repr(route),
+                    "depth": destination.depth() if destination else 0,
+                    "forwarded": route.forwarded,
+                    "dropped": route.dropped
+                })
+        for destination, (sent, dropped) in list(self.sends.items()):
+            stats.append({
+                "route": "send->{}".format(destination),
+                "depth": self.destinations[destination].depth(),
+                "forwarded": sent,
+                "dropped": dropped
+            })
+        return stats
+
+    def report(self):
+        return "\n".join("{route}: depth={depth} forwarded={forwarded} dropped={dropped}".format(**entry) for entry in self.stats())
+
+
+#the routing used by both coordinators. rpi from the PC goes to the camera, which the PC listener handles inline
+def build_router(destination_class, pc_write, bt_write, ar_write, maxsize=256, tracer=None):
+    router = Router(tracer)
+    router.add_destination(destination_class("pc", pc_write, maxsize))
+    router.add_destination(destination_class("bt", bt_write, maxsize))
+    router.add_destination(destination_class("arduino", ar_write, maxsize))
+    router.add_route("pc", "rpi", "camera")
+    router.add_route("pc", "ar", "arduino")
+    router.add_route("pc", "an", "bt")
+    router.add_route("bt", "al_", "pc")
+    router.add_route("bt", "ar_", "arduino")
+    router.add_route("arduino", "al", "pc")
+    router.add_route("arduino", "an", "bt")
+    return router.compile()
@@ -0,0 +1,205 @@
+import threading
+import time
+from collections import deque
+from rpi_log import get_logger
+
+log = get_logger("serial_pump")
+
+'''
+    Pipelined command channel to the Arduino
+
+    The Arduino reads one newline terminated command per loop and acknowledges moves with alok and
+    sensor requests with alsensor. Commands sent while it is busy wait in its 64 byte serial receive
+    buffer, so the next move starts as soon as the previous one ends instead of after a round trip to
+    the PC. CommandWindow tracks the commands in flight and only lets more out while they fit in the
+    window and in the receive buffer, SerialPump writes everything that fits in one serial write
+'''
+
+#Arduino Uno hardware serial receive buffer
+RX_BUFFER = 64
+
+#command letter -> (acknowledgement line prefix, lines of it the sketch sends). commands not listed get no
+#reply and are never in flight. z prints the raw and the grid sensor readings, x turns fastest path on
+ACKS = {
+    "w": ("alok", 1),
+    "a": ("alok", 1),
+    "s": ("alok", 1),
+    "d": ("alok", 1),
+    "c": ("alok", 1),
+    "g": ("alsensor", 1),
+    "z": ("alsensor", 2),
+    "x": ("alok", 1)
+}
+MOVES = "wasd"
+#after x the sketch acknowledges every move twice, back to back
+FASTEST_PATH = "x"
+
+'''
+    Class CommandWindow matches the Arduino's acknowledgements to commands in flight, oldest first
+'''
+class CommandWindow(object):
+
+    '''
+        parameters
+            window - maximum commands in flight
+            max_bytes - maximum bytes in flight, at most the Arduino's receive buffer
+            ack_timeout - seconds the oldest command may wait for its acknowledgement before it is
+                          given up on, so a lost reply cannot stall the link
+            fastest_acks - acknowledgements per move once fastest path mode is on
+    '''
+    def __init__(self, window=4, max_bytes=RX_BUFFER, ack_timeout=10.0, fastest_acks=2):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.ack_timeout = ack_timeout
+        self.fastest_acks = fastest_acks
+        #[command, frame size, acknowledgements still expected]
+        self.in_flight = deque()
+        self.bytes = 0
+        self.fastest_path = False
+        #time the oldest command started waiting, its own send or the previous acknowledgement
+        self.head_since = None
+        self.acknowledged = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.in_flight)
+
+    #True if a frame of size bytes can be sent now. an empty window always takes one command
+    def fits(self, size):
+        if not self.in_flight:
+            return True
+        return len(self.in_flight) < self.window and self.bytes + size <= self.max_bytes
+
+    #records a command written to the port. returns False for commands that are not acknowledged
+    def sent(self, command, size, now=None):
+        action = command[:1].lower()
+        if action == FASTEST_PATH:
+            self.fastest_path = True
+        if action not in ACKS:
+            return False
+        prefix, acks = ACKS[action]
+        if self.fastest_path and action in MOVES:
+            acks = self.fastest_acks
+        if not self.in_flight:
+            self.head_since = now or time.monotonic()
+        self.in_flight.append([command, size, acks])
+        self.bytes += size
+        return True
+
+    #matches line against the oldest command in flight. returns True if a slot was freed
+    def acknowledge(self, line, now=None):
+        if not self.in_flight:
+            return False
+        head = self.in_flight[0]
+        if not line.startswith(ACKS[head[0][:1].lower()][0]):
+            return False
+        head[2] -= 1
+        if head[2] > 0:
+            return False
+        self.pop(now)
+        self.acknowledged += 1
+        return True
+
+    def pop(self, now=None):
+        command, size, acks = self.in_flight.popleft()
+        self.bytes -= size
+        self.head_since = (now or time.monotonic()) if self.in_flight else None
+        return command
+
+    #seconds until the oldest command times out, None if nothing is in flight
+    def next_deadline(self, now=None):
+        if self.head_since is None:
+            return None
+        return max(0.0, self.head_since + self.ack_timeout - (now or time.monotonic()))
+
+    #gives up on the oldest command if it has waited too long, returns it or None
+    def expire(self, now=None):
+        if self.next_deadline(now) == 0.0:
+            self.expired += 1
+            return self.pop(now)
+        return None
+
+    #forgets everything in flight, e.g. after the Arduino resets on reconnect
+    def reset(self):
+        self.in_flight.clear()
+        self.bytes = 0
+        self.fastest_path = False
+        self.head_since = None
+
+    def stats(self):
+        return {"in_flight": len(self.in_flight), "bytes": self.bytes, "acknowledged": self.acknowledged, "expired": self.expired}
+
+
+'''
+    Class SerialPump writes commands to the serial port from its own thread, keeping the window full
+    and coalescing every command that fits into a single write
+'''
+class SerialPump(object):
+
+    def __init__(self, ser, window=None):
+        self.ser = ser
+        self.window = window or CommandWindow()
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="serial-pump")
+        self.thread.daemon = True
+        self.thread.start()
+
+    #queues a command for the Arduino, returns straight away. sent is called once the command is written to the port
+    def submit(self, msg, sent=None):
+        with self.condition:
+            self.pending.append((msg, sent))
+            self.condition.notify()
+
+    #called by the reader for every line from the Arduino
+    def acknowledge(self, line):
+        with self.condition:
+            if self.window.acknowledge(line):
+                self.condition.notify()
+
+    #holds queued commands until reset is called with the reopened port
+    def disconnect(self):
+        with self.condition:
+            self.ser = None
+
+    #switches to a reopened port. commands in flight are lost with the old connection, queued ones are kept
+    def reset(self, ser):
+        with self.condition:
+            self.ser = ser
+            self.window.reset()
+            self.condition.notify()
+
+    #waits until at least one command can go out and takes every command that fits, with their sent callbacks
+    def take(self):
+        with self.condition:
+            while 1:
+                expired = self.window.expire()
+                if expired is not None:
+                    log.warning("No acknowledgement for %s, releasing its slot", expired)
+                frames = []
+                callbacks = []
+                while self.ser is not None and self.pending:
+                    msg, sent = self.pending[0]
+                    frame = "{}\n".format(msg).encode('UTF-8')
+                    if not self.window.fits(len(frame)):
+                        break
+                    self.pending.popleft()
+                    self.window.sent(msg, len(frame))
+                    frames.append(frame)
+                    if sent is not None:
+                        callbacks.append(sent)
+                if frames:
+                    return self.ser, frames, callbacks
+                self.condition.wait(self.window.next_deadline())
+
+    def run(self):
+        while 1:
+            ser, frames, callbacks = self.take()
+            try:
+                ser.write(b"".join(frames))
+                log.debug("Wrote %d commands to Arduino: %s", len(frames), self.window.stats())
+                for sent in callbacks:
+                    sent()
+            except Exception as e:
+                #the reader notices the disconnect and reconnects, which resets the window
+                log.warning("Arduino write encountering the following error: %s", e)
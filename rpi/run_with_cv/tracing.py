@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import signal
+import socket
+import threading
+import time
+from collections import OrderedDict
+from rpi_log import get_logger
+
+log = get_logger("tracing")
+
+'''
+    End to end latency tracing for the coordinator
+
+    Messages are stamped with time.monotonic() when received, routed, enqueued and written. The gaps
+    are aggregated per route and stage into log scale histograms, e.g. how long pc:ar->arduino waits in
+    the arduino queue, or how long an rpi capture request takes to produce its arrfound reply. Histograms
+    can be queried over a local unix socket or written to the log on SIGUSR1
+
+    Tracing is off unless RPI_TRACE=1 or the control socket turns it on. When off, Tracer.now returns
+    None and every recording call returns straight away, so the forwarding path pays one attribute check
+'''
+
+CONTROL_PATH = "/tmp/rpi_trace.sock"
+
+#stages recorded for every forwarded message
+RECEIVE_TO_ROUTE = "receive->route"
+ROUTE_TO_ENQUEUE = "route->enqueue"
+ENQUEUE_TO_WRITE = "enqueue->write"
+TOTAL = "total"
+
+'''
+    Class Histogram counts samples in log scale buckets, 4 per doubling from 1us, so percentiles are
+    within ~19% of the true value while recording stays constant time and memory
+'''
+class Histogram(object):
+
+    BUCKETS_PER_DOUBLING = 4
+    #1us up to ~2 minutes
+    BUCKETS = 27 * BUCKETS_PER_DOUBLING
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        if micros <= 1:
+            index = 0
+        else:
+            index = min(self.BUCKETS - 1, int(math.log2(micros) * self.BUCKETS_PER_DOUBLING))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    #upper bound of the bucket holding the pth percentile, in seconds
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        target = self.count * p / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.max, 2 ** ((index + 1) / float(self.BUCKETS_PER_DOUBLING)) / 1e6)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1e3, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1e3, 3),
+            "p95_ms": round(self.percentile(95) * 1e3, 3),
+            "p99_ms": round(self.percentile(99) * 1e3, 3),
+            "max_ms": round(self.max * 1e3, 3)
+        }
+
+
+class Tracer(object):
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get("RPI_TRACE") == "1"
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = OrderedDict()
+        #robot status -> receive time of the capture request, oldest first
+        self.captures = OrderedDict()
+
+    #timestamp for a message just received, None when tracing is off
+    def now(self):
+        if self.enabled:
+            return time.monotonic()
+        return None
+
+    def record(self, route, stage, seconds):
+        key = (route, stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    #called by the router once the message is routed and queued
+    def routed(self, route, received, routed, enqueued):
+        self.record(route, RECEIVE_TO_ROUTE, routed - received)
+        self.record(route, ROUTE_TO_ENQUEUE, enqueued - routed)
+
+    #called by the destination writer after the wrapper's write sent the message. enqueued is None if the
+    #writer got to the message before the router stamped it
+    def written(self, route, received, enqueued):
+        written = time.monotonic()
+        if enqueued is not None:
+            self.record(route, ENQUEUE_TO_WRITE, written - enqueued)
+        self.record(route, TOTAL, written - received)
+
+    #the PC asked for a capture at robot status. inline handling means route and write are the same step
+    def capture_requested(self, status, received):
+        if received is None:
+            return
+        with self.lock:
+            self.captures[status] = received
+            #recognition can skip a status, do not let stale requests pile up
+            while len(self.captures) > 64:
+                self.captures.popitem(last=False)
+
+    def capture_acknowledged(self, status, received):
+        if received is not None:
+            self.record("pc:rpi->camera", "capture ack", time.monotonic() - received)
+
+    #first recognition result for a status closes its capture request
+    def capture_result(self, status, msg):
+        if not self.enabled:
+            return
+        with self.lock:
+            received = self.captures.pop(status, None)
+        if received is not None:
+            route = "rpi->arrfound" if msg.startswith("arrfound") else "rpi->notfound"
+            self.record(route, TOTAL, time.monotonic() - received)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.captures.clear()
+
+    def stats(self, router=None):
+        with self.lock:
+            histograms = [(route, stage, histogram.summary()) for (route, stage), histogram in self.histograms.items()]
+        stats = {"enabled": self.enabled, "routes": {}}
+        for route, stage, summary in histograms:
+            stats["routes"].setdefault(str(route), {})[stage] = summary
+        if router is not None:
+            stats["queues"] = router.stats()
+        return stats
+
+    def report(self, router=None):
+        stats = self.stats(router)
+        lines = ["Latency trace (enabled={})".format(stats["enabled"])]
+        for route, stages in stats["routes"].items():
+            for stage, summary in stages.items():
+                lines.append("{:<22} {:<16} n={count} p50={p50_ms}ms p95={p95_ms}ms p99={p99_ms}ms max={max_ms}ms".format(route, stage, **summary))
+        if router is not None:
+            lines.append(router.report())
+        return "\n".join(lines)
+
+
+'''
+    Serves tracer stats on a unix socket. Send one command per connection:
+        stats - json of histograms and router queues (default)
+        report - the same as text
+        on / off / reset - toggle tracing or clear histograms
+    e.g. echo report | nc -U /tmp/rpi_trace.sock
+'''
+def serve_control(tracer, router=None, path=CONTROL_PATH):
+    if os.path.exists(path):
+        os.unlink(path)
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(path)
+    server_socket.listen(1)
+    #PcWrapper sets a 60s default timeout on new sockets, the control socket waits for commands indefinitely
+    server_socket.settimeout(None)
+
+    def serve():
+        while 1:
+            conn, addr = server_socket.accept()
+            try:
+                command = conn.recv(64).decode('utf-8').strip() or "stats"
+                if command == "on":
+                    tracer.enabled = True
+                elif command == "off":
+                    tracer.enabled = False
+                elif command == "reset":
+                    tracer.reset()
+                if command == "report":
+                    reply = tracer.report(router)
+                else:
+                    reply = json.dumps(tracer.stats(router), indent=1)
+                conn.sendall("{}\n".format(reply).encode())
+            except Exception as e:
+                log.warning("Trace control request failed: %s", e)
+            finally:
+                conn.close()
+
+    thread = threading.Thread(target=serve, name="trace-control")
+    thread.daemon = True
+    thread.start()
+    log.info("Trace control listening on %s", path)
+    return server_socket
+
+#writes the report to the log on SIGUSR1. must be called from the main thread of the process
+def install_signal_handler(tracer, router=None):
+    signal.signal(signal.SIGUSR1, lambda signum, frame: log.info("%s", tracer.report(router)))
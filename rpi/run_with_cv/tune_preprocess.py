@@ -0,0 +1,170 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import cv2 as cv
+from multiprocessing import Pool
+from timeit import default_timer as timer
+from img_recognition import ImageProcessor
+from preprocess import Pipeline
+from benchmark_recognition import labelled_images, score
+
+'''
+    Searches preprocessing chains for the one that recognizes a labelled corpus best for its cost
+
+    The candidates are every combination of
+        a blur, or none, before or after the grey conversion (arrow_contour blurs the colour frame)
+        a fixed, Otsu or adaptive threshold
+        no morphology, an opening or a closing
+    the trials feature_detection.py kept in its comments. Each chain runs in ImageProcessor in place of its
+    default preprocessing over every image whose name gives the arrows in it, see benchmark_recognition,
+    once to allocate its buffers and then repeat times timed. A chain scores
+
+        F1 of the arrows found - ms_weight * milliseconds per frame
+
+    The best chains and the fastest chain at each F1 are printed, and --output writes the best as a
+    preprocess file for ImageProcessor(preprocess=...) or RPI_PREPROCESS, e.g.
+
+        python3 tune_preprocess.py
+        python3 tune_preprocess.py --corpora test testbed --ms-weight 0.01 --output preprocess.json
+'''
+
+BLURS = [
+    None,
+    {"stage": "gaussian", "ksize": 5, "sigma": 2},
+    {"stage": "gaussian", "ksize": 3, "sigma": 0},
+    {"stage": "blur", "ksize": 5},
+    {"stage": "median", "ksize": 5},
+    {"stage": "bilateral", "d": 9, "sigma_color": 75, "sigma_space": 75}
+]
+THRESHOLDS = [{"stage": "threshold", "thresh": thresh} for thresh in (40, 50, 60, 80)] + [
+    {"stage": "threshold", "type": "otsu"},
+    {"stage": "adaptive", "block": 11, "c": 2}
+]
+MORPHOLOGY = [
+    [],
+    [{"stage": "erode", "ksize": 3}, {"stage": "dilate", "ksize": 3}],
+    [{"stage": "dilate", "ksize": 3}, {"stage": "erode", "ksize": 3}]
+]
+#the recognizer's grey conversion, see preprocess.default_pipeline
+GRAY = {"stage": "gray", "code": "RGB2GRAY"}
+#F1 given up for a millisecond per frame
+MS_WEIGHT = 0.005
+
+#set in each pool worker by start_worker
+images = None
+reference_contours = None
+repeat = None
+
+
+def candidates():
+    chains = []
+    for blur, thresh, morphology in itertools.product(BLURS, THRESHOLDS, MORPHOLOGY):
+        orders = [[GRAY, blur], [blur, GRAY]] if blur is not None else [[GRAY]]
+        for order in orders:
+            chains.append(order + [thresh] + morphology)
+    return chains
+
+def start_worker(labelled, runs):
+    global images, reference_contours, repeat
+    #one process per core already, OpenCV's threads would only compete
+    cv.setNumThreads(1)
+    images = [(name, cv.imread(path, cv.IMREAD_COLOR), expected) for name, path, expected in labelled]
+    reference_contours = ImageProcessor(slots=0).load_reference_contours()
+    repeat = runs
+
+def evaluate(indexed):
+    index, stages = indexed
+    processor = ImageProcessor(slots=0, preprocess=stages)
+    #allocates the pipeline's buffers
+    for name, frame, expected in images:
+        processor.getImageLocation(reference_contours, frame)
+    processor.pipeline.reset_timings()
+    totals = [0, 0, 0]
+    seconds = 0.0
+    for run in range(repeat):
+        for name, frame, expected in images:
+            start = timer()
+            arrows = processor.getImageLocation(reference_contours, frame)
+            seconds += timer() - start
+            if run == 0:
+                totals = [total + count for total, count in zip(totals, score(sorted(arrows), expected))]
+    true_positives, false_positives, false_negatives = totals
+    precision = true_positives / float(true_positives + false_positives) if true_positives + false_positives else 1.0
+    recall = true_positives / float(true_positives + false_negatives) if true_positives + false_negatives else 1.0
+    return {
+        "index": index,
+        "stages": stages,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "ms": seconds / (repeat * len(images)) * 1e3,
+        "stage_ms": processor.pipeline.timings(),
+        "allocations": processor.pipeline.allocations
+    }
+
+#chains no other chain beats on both F1 and time, fastest first
+def pareto(results):
+    front = []
+    for result in sorted(results, key=lambda result: (result["ms"], -result["f1"])):
+        if not front or result["f1"] > front[-1]["f1"]:
+            front.append(result)
+    return front
+
+def print_table(title, results):
+    print(title)
+    print("{:>9} {:>7} {:>10} {:>8} {:>6}  {}".format("score", "ms", "precision", "recall", "f1", "chain"))
+    for result in results:
+        print("{:>9.3f} {:>7.1f} {:>10.3f} {:>8.3f} {:>6.3f}  {}".format(
+            result["score"], result["ms"], result["precision"], result["recall"], result["f1"], Pipeline(result["stages"])))
+    print("")
+
+def main():
+    parser = argparse.ArgumentParser(description="Search preprocessing chains for recognition accuracy and speed")
+    parser.add_argument("--corpora", nargs="+", default=["test"], help="directories under rpi/opencv to score against")
+    parser.add_argument("--repeat", type=int, default=2, help="timed runs over the corpus per chain")
+    parser.add_argument("--ms-weight", type=float, default=MS_WEIGHT, help="F1 a chain gives up per millisecond per frame")
+    parser.add_argument("--sample", type=int, help="score this many chains picked at random instead of all of them")
+    parser.add_argument("--seed", type=int, default=0, help="picks the sampled chains")
+    parser.add_argument("--top", type=int, default=10, help="best chains printed")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes scoring chains")
+    parser.add_argument("--output", help="write the best chain here as a preprocess file")
+    args = parser.parse_args()
+
+    labelled = labelled_images(args.corpora)
+    if not labelled:
+        sys.exit("No labelled images in {}".format(", ".join(args.corpora)))
+    chains = candidates()
+    if args.sample:
+        chains = random.Random(args.seed).sample(chains, min(args.sample, len(chains)))
+    sys.stderr.write("Scoring {} chains on {} images\n".format(len(chains), len(labelled)))
+    start = timer()
+    pool = Pool(args.workers, initializer=start_worker, initargs=(labelled, args.repeat))
+    try:
+        results = pool.map(evaluate, list(enumerate(chains)))
+    finally:
+        pool.terminate()
+    sys.stderr.write("Done in {:.1f}s\n".format(timer() - start))
+    for result in results:
+        result["score"] = result["f1"] - args.ms_weight * result["ms"]
+    results.sort(key=lambda result: -result["score"])
+
+    print_table("Best {} of {} chains".format(min(args.top, len(results)), len(results)), results[:args.top])
+    print_table("Fastest chain at each F1", pareto(results))
+    best = results[0]
+    print("Best: {}".format(Pipeline(best["stages"])))
+    print("      " + ", ".join("{} {:.1f}ms".format(name, ms) for name, ms in best["stage_ms"].items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "stages": best["stages"],
+                "corpora": args.corpora,
+                "precision": best["precision"],
+                "recall": best["recall"],
+                "ms": best["ms"]
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
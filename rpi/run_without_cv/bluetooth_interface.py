@@ -1,12 +1,16 @@
 from bluetooth import *
 from socket import timeout
-import queue
+from outbound_buffer import OutboundBuffer, DROP_OLDEST
+from rpi_log import get_logger
+
+log = get_logger("bluetooth_interface")
 
 class BluetoothWrapper(object):
-    def __init__(self,btport=4):
+    def __init__(self,btport=4,buffer_size=256,overflow=DROP_OLDEST):
         self.server_socket = None
         self.client_socket = None
-        self.queue = queue.Queue()
+        #bounded buffer for messages written while disconnected, center/mdf updates are coalesced to the latest
+        self.buffer = OutboundBuffer(buffer_size, overflow)
         try:
             self.server_socket = BluetoothSocket(RFCOMM)
             self.server_socket.bind(("", btport))
@@ -22,20 +26,20 @@ class BluetoothWrapper(object):
                 service_classes=[uuid, SERIAL_PORT_CLASS],
                 profiles=[SERIAL_PORT_PROFILE]
                 )
-            print("Listening for BT connections on RFCOMM channel %d..." % self.port)
+            log.info("Listening for BT connections on RFCOMM channel %d...", self.port)
         except Exception as e:
-            print("\nError: %s" % str(e))
+            log.error("Error: %s", e)
 
     def close_bt_socket(self):
 
         if self.client_socket:
             self.client_socket.close()
             # self.client_socket.shutdown(socket.SHUT_RDWR)
-            print("Closing client socket")
+            log.info("Closing client socket")
         if self.server_socket:
             self.server_socket.close()
             # self.client_socket.shutdown(socket.SHUT_RDWR)
-            print("Closing server socket")
+            log.info("Closing server socket")
         self.bt_is_connected = False
 
     def is_connected(self):
@@ -47,22 +51,18 @@ class BluetoothWrapper(object):
         try:
             self.client_socket = None
             self.client_socket, client_address = self.server_socket.accept()
-            print("Accepted BlueTooth Connection from ", client_address)
+            log.info("Accepted BlueTooth Connection from %s", client_address)
             return self.client_socket
         except Exception as e:
-            print("\nError: %s" % str(e))
+            log.error("Error: %s", e)
 
     def accept_connection_and_flush(self):
         conn = self.accept_connection()
-        #no peek method makes this unnecessarily harder
-        next_msg = None
-        while(self.queue.empty() is False):
+        while(len(self.buffer) > 0):
             try:
-                if(next_msg is None):
-                    next_msg = self.queue.get()
-                print("Flushing BT Interface...")
-                conn.sendall(next_msg.encode())
-                next_msg = None
+                log.info("Flushing BT Interface: %s", self.buffer.stats())
+                #all pending messages go out in one write
+                self.buffer.flush(conn)
             except(timeout,BluetoothError):
                 conn = self.accept_connection()
         self.client_socket = conn
@@ -73,14 +73,13 @@ class BluetoothWrapper(object):
     #we also delegate flushing of the queue to the reader thread
     def write(self,msg):
         try:
-            #if the queue is not empty there was a disconnect and the reader thread is flushing, enqueue this msg
-            if(self.queue.empty() is False):
-                self.queue.put(msg)
-            else:
-                self.client_socket.send(str(msg))
+            #if the buffer is not empty there was a disconnect and the reader thread is flushing, buffer this msg
+            if(self.buffer.put_if_pending(msg) is False):
+                #messages are newline framed so the tablet can split messages sent back to back
+                self.client_socket.sendall("{}\n".format(msg).encode())
             return True
         except Exception:
-            self.queue.put(msg)
+            self.buffer.put(msg)
             return False
 
 
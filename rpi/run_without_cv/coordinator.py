@@ -5,11 +5,17 @@ from bluetooth_interface import BluetoothWrapper
 from arduino_interface import ArduinoWrapper
 from socket import SHUT_RDWR,timeout
 from bluetooth.btcommon import BluetoothError
+from line_reader import LineReader
+from rpi_log import get_logger, setup as setup_logging
 
-def initialize_listeners():
-    pc_wrapper = PcWrapper()
-    bt_wrapper = BluetoothWrapper()
-    ar_wrapper = ArduinoWrapper()
+log = get_logger("coordinator")
+
+#the wrappers default to the robot's devices, the simulation harness passes in stand-ins
+def initialize_listeners(pc_wrapper=None,bt_wrapper=None,ar_wrapper=None):
+    setup_logging()
+    pc_wrapper = pc_wrapper or PcWrapper()
+    bt_wrapper = bt_wrapper or BluetoothWrapper()
+    ar_wrapper = ar_wrapper or ArduinoWrapper()
     
     pc_thread = threading.Thread(target=listen_to_pc,args=(pc_wrapper,ar_wrapper,bt_wrapper))
     bt_thread = threading.Thread(target=listen_to_bluetooth,args=(bt_wrapper,pc_wrapper,ar_wrapper))
@@ -32,123 +38,118 @@ def listen_to_pc(pc_wrapper,arduino_wrapper=None,bt_wrapper=None,opencv_pipe=Non
 
     #gets the connection object, the client's ip address and outbound port
     conn = pc_wrapper.accept_connection_and_flush()
+    reader = LineReader.from_socket(conn)
     #do not capture unless told to do so
     exploration_mode = False
     while(1):
         try:
             # encoding scheme is ASCII
-            #msg = conn.recv(1024).decode('utf-8')
-            msg = ""
-            while(1):
-                char = conn.recv(1).decode('utf-8')
-                if(char is None or char is ""):
-                    raise ConnectionResetError("Malformed string received: {}".format(msg))
-                if(char == "\n"):
-                    break
-                msg += char
-            print("RECEIVED FROM PC INTERFACE: {}.".format(msg))
-            if(msg.startswith("rpi")):
-                #signal new capture job
-                #opencv_pipe.send(msg[3:])
-                #block thread until received job finished from camera
-                #opencv_pipe.recv()
-                continue
-            elif(msg.startswith("ar")):
-                #if(exploration_mode):
-                #   print("PC HOLDING ARDUINO: {}".format(msg))
-                    #reroute all messsages to the opencv thread. opencv thread now has command authority to release instructions by algorithm to arduino
-                #   arduino_wrapper.hold(msg[2:])
-                #else:
-                #print("PC WRITING TO ARDUINO: {}".format(msg))
-                arduino_wrapper.write(msg[2:])
-            elif(msg.startswith("an")):
-                #print("PC WRITING TO ANDROID: {}".format(msg))
-                bt_wrapper.write(msg[2:])
-            #raises a connectione error for the following situation
-            #1) RPI resets while PC is connected
-            #2) PC reconnects
-            #3) msg is sent to PC
-            else:
-                if(msg is False):
-                    raise ConnectionResetError("Null or empty string received arising from connection reset")
+            #every complete line received in one read is processed as a batch
+            for msg in reader.read_lines():
+                log.debug("RECEIVED FROM PC INTERFACE: %s.", msg)
+                if(msg.startswith("rpi")):
+                    #signal new capture job
+                    #opencv_pipe.send(msg[3:])
+                    #block thread until received job finished from camera
+                    #opencv_pipe.recv()
+                    continue
+                elif(msg.startswith("ar")):
+                    #if(exploration_mode):
+                    #   print("PC HOLDING ARDUINO: {}".format(msg))
+                        #reroute all messsages to the opencv thread. opencv thread now has command authority to release instructions by algorithm to arduino
+                    #   arduino_wrapper.hold(msg[2:])
+                    #else:
+                    #print("PC WRITING TO ARDUINO: {}".format(msg))
+                    arduino_wrapper.write(msg[2:])
+                elif(msg.startswith("an")):
+                    #print("PC WRITING TO ANDROID: {}".format(msg))
+                    bt_wrapper.write(msg[2:])
+                #raises a connectione error for the following situation
+                #1) RPI resets while PC is connected
+                #2) PC reconnects
+                #3) msg is sent to PC
                 else:
-                    raise ConnectionResetError("Malformed string received: {}".format(msg))
+                    if(msg is False):
+                        raise ConnectionResetError("Null or empty string received arising from connection reset")
+                    else:
+                        raise ConnectionResetError("Malformed string received: {}".format(msg))
         except (timeout,ConnectionResetError) as e:
-            print(e)
-            print("Unexpected Disconnect for PC occurred. Awaiting reconnection...")
+            log.warning("Unexpected Disconnect for PC occurred: %s. Awaiting reconnection...", e)
             conn.close()
             conn = pc_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
         except Exception as e:
-            print("Unexpected Disconnect for Bluetooth occurred. The following error occurred: {}. Awaiting reconnection...".format(e))
+            log.warning("Unexpected Disconnect for Bluetooth occurred. The following error occurred: %s. Awaiting reconnection...", e)
             conn.shutdown(SHUT_RDWR)
             conn.close()
             conn = pc_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
 
     conn.shutdown(SHUT_RDWR)
     conn.close()
-    print("Closing PC Listener")
+    log.info("Closing PC Listener")
 
 
 def listen_to_bluetooth(bt_wrapper,pc_wrapper=None,arduino_wrapper=None,):
     conn = bt_wrapper.accept_connection_and_flush()
+    reader = LineReader.from_socket(conn)
     while(1):
         try:
             # encoding scheme is ASCII
-            msg = conn.recv(1024).decode('utf-8')
-            print("RECEIVED FROM BT INTERFACE: {}.".format(msg))
-            if(msg.startswith("al_")):
-                #print("BT writing to PC: {}".format(msg))
-                pc_wrapper.write(msg[3:])
-            elif(msg.startswith("ar_")):
-                #print("BT writing to ARDUINO: {}".format(msg))
-                arduino_wrapper.write(msg[3:])
+            #the tablet newline frames its messages, every complete frame received in one read is dispatched as a batch
+            for msg in reader.read_lines():
+                msg = msg.strip()
+                if(not msg):
+                    continue
+                log.debug("RECEIVED FROM BT INTERFACE: %s.", msg)
+                if(msg.startswith("al_")):
+                    #print("BT writing to PC: {}".format(msg))
+                    pc_wrapper.write(msg[3:])
+                elif(msg.startswith("ar_")):
+                    #print("BT writing to ARDUINO: {}".format(msg))
+                    arduino_wrapper.write(msg[3:])
         except (timeout,BluetoothError):
-            print("Unexpected Disconnect for Bluetooth occurred. Awaiting reconnection...")
+            log.warning("Unexpected Disconnect for Bluetooth occurred. Awaiting reconnection...")
             conn.shutdown(SHUT_RDWR)
             conn.close()
             conn = bt_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
         except Exception as e:
-            print("Unexpected Disconnect for Bluetooth occurred. The following error occurred: {}. Awaiting reconnection...".format(e))
+            log.warning("Unexpected Disconnect for Bluetooth occurred. The following error occurred: %s. Awaiting reconnection...", e)
             conn.shutdown(SHUT_RDWR)
             conn.close()
             conn = bt_wrapper.accept_connection_and_flush()
+            reader = LineReader.from_socket(conn)
             
 
     bt_wrapper.close_bt_socket()
-    print("Closing Bluetooth Listener")
+    log.info("Closing Bluetooth Listener")
 
 def listen_to_arduino(ar_wrapper,pc_wrapper=None,bt_wrapper=None):
     ser = ar_wrapper.get_connection()
+    reader = LineReader.from_serial(ser, encoding='ascii', errors='ignore')
     while(1):
         try:
-            msg = ser.readline().decode('ascii',errors='ignore').strip() #aruino using println to send so need remove \r\n
-            #msg = ""
-            #while(1):
-            #   char = ser.read(1).decode('utf-8')
-            #   print("{}".format(char))
-            #   if(char is None or char is ""):
-            #       continue
-            #   msg += char
-            #  if(msg.endswith("\n")):
-            #       print("\n")
-            #       break
-            print("RECEIVED FROM ARDUINO INTERFACE: {}.".format(msg))
-            if(msg.startswith("al")):
-                pc_wrapper.write(msg[2:])
-                print("ARDUINO wrote to PC: {}".format(msg))
-            elif(msg.startswith("an")):
-                bt_wrapper.write(msg[2:])
-                print("ARDUINO wrote to ANDROID: {}".format(msg))
+            for msg in reader.read_lines():
+                msg = msg.strip() #aruino using println to send so need remove \r
+                log.debug("RECEIVED FROM ARDUINO INTERFACE: %s.", msg)
+                ar_wrapper.acknowledge(msg)
+                if(msg.startswith("al")):
+                    pc_wrapper.write(msg[2:])
+                    log.debug("ARDUINO wrote to PC: %s", msg)
+                elif(msg.startswith("an")):
+                    bt_wrapper.write(msg[2:])
+                    log.debug("ARDUINO wrote to ANDROID: %s", msg)
         except UnicodeDecodeError as ude:
-            print(ude)
+            log.warning("Failed to decode: %s", ude)
             continue
         except Exception as e:
-            print(e)
-            print("Unexpected Disconnect occurred from arduino, trying to reconnect...")
+            log.warning("Unexpected Disconnect occurred from arduino: %s, trying to reconnect...", e)
             ser.close()
             ser = ar_wrapper.reconnect()
+            reader = LineReader.from_serial(ser, encoding='ascii', errors='ignore')
 
-    print("Closing Arduino Listener")
+    log.info("Closing Arduino Listener")
 
 def write_arrow_to_pc(pc_wrapper, listener_endpoint_rpi):
     while(1):
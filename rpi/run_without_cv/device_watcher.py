@@ -0,0 +1,105 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from rpi_log import get_logger
+
+log = get_logger("device_watcher")
+
+'''
+    Class DeviceWatcher waits for device nodes to appear
+
+    Replaces polling os.path.exists once a second in ArduinoWrapper.reconnect. The directories holding
+    the ports (/dev for ttyACM0) are watched with inotify, so a reconnect wakes up as soon as udev
+    creates the node or changes its permissions after a USB brownout. Falls back to polling every
+    POLL_INTERVAL where inotify is not available
+
+    To try it without an Arduino, point the wrapper at a symlink to a pty in a scratch directory and
+    create or remove the link, e.g. ArduinoWrapper(ports=("/tmp/fake/ttyACM0",))
+'''
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+#a new node, a node renamed into place, or udev fixing up its owner and mode
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_ATTRIB
+
+POLL_INTERVAL = 0.05
+
+
+def load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DeviceWatcher(object):
+
+    '''
+        parameters
+            paths - device nodes of interest, their directories are watched
+    '''
+    def __init__(self, paths):
+        self.paths = tuple(paths)
+        self.fd = None
+        libc = load_inotify()
+        if libc is None:
+            log.info("inotify not available, polling for %s", self.paths)
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            log.info("inotify_init1 failed: %s, polling for %s", os.strerror(ctypes.get_errno()), self.paths)
+            return
+        for directory in set(os.path.dirname(path) or "." for path in self.paths):
+            if libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK) < 0:
+                log.info("Cannot watch %s: %s, polling for %s", directory, os.strerror(ctypes.get_errno()), self.paths)
+                os.close(fd)
+                return
+        self.fd = fd
+
+    #returns the first path that exists
+    def find(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                return path
+        return None
+
+    #blocks until something changes in a watched directory or timeout seconds pass. returns True on a change
+    def wait(self, timeout=None):
+        if self.fd is None:
+            time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+            return False
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return False
+        #the events themselves do not matter, the caller checks the paths again
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    #blocks until one of the paths exists and returns it, None if timeout seconds pass first
+    def wait_for(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while 1:
+            path = self.find()
+            if path is not None:
+                return path
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.wait(remaining)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,112 @@
+'''
+    Class LineReader frames a byte stream into newline terminated messages
+
+    Shared by the PC, Bluetooth and Arduino links. Instead of calling recv(1) for every byte and
+    growing a string, it reads as much as the device has into a preallocated buffer and splits on
+    the delimiter with bytearray.find, so a burst of commands costs one syscall instead of one per byte
+'''
+
+class LineReader(object):
+
+    '''
+        parameters
+            recv_into - callable taking a writable memoryview, fills it and returns the number of bytes read.
+                        returning 0 means the other end has closed the connection
+            bufsize - initial size of the receive buffer. grows if a single line does not fit
+            delimiter - frame delimiter
+            encoding, errors - used to decode each line
+    '''
+    def __init__(self, recv_into, bufsize=4096, delimiter=b'\n', encoding='utf-8', errors='strict'):
+        self.recv_into = recv_into
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.errors = errors
+        self.buffer = bytearray(bufsize)
+        self.view = memoryview(self.buffer)
+        #[start,end) is the unconsumed part of the buffer
+        self.start = 0
+        self.end = 0
+        #lines already split but not yet handed out by read_line
+        self.pending = []
+
+    #wraps a socket. uses recv_into when available, else falls back to recv and copies into the buffer
+    @classmethod
+    def from_socket(cls, conn, **kwargs):
+        if hasattr(conn, "recv_into"):
+            return cls(conn.recv_into, **kwargs)
+        def recv_into(view):
+            data = conn.recv(len(view))
+            view[:len(data)] = data
+            return len(data)
+        return cls(recv_into, **kwargs)
+
+    #wraps a pyserial port. only asks for what is already waiting so the read never blocks for a full buffer
+    @classmethod
+    def from_serial(cls, ser, **kwargs):
+        def recv_into(view):
+            size = max(1, min(len(view), ser.in_waiting))
+            return ser.readinto(view[:size])
+        return cls(recv_into, **kwargs)
+
+    #returns every complete line currently buffered, reading from the device until there is at least one
+    def read_lines(self):
+        if self.pending:
+            lines = self.pending
+            self.pending = []
+            return lines
+        while 1:
+            lines = self.split_lines()
+            if lines:
+                return lines
+            self.fill()
+
+    #returns a single line, keeping the rest of the batch for the next call
+    def read_line(self):
+        if not self.pending:
+            self.pending = self.read_lines()
+        return self.pending.pop(0)
+
+    #splits all complete lines out of the buffer without reading from the device
+    def split_lines(self):
+        lines = []
+        buffer = self.buffer
+        delimiter = self.delimiter
+        start = self.start
+        while 1:
+            index = buffer.find(delimiter, start, self.end)
+            if index < 0:
+                break
+            lines.append(str(self.view[start:index], self.encoding, self.errors))
+            start = index + len(delimiter)
+        self.start = start
+        if self.start == self.end:
+            self.start = self.end = 0
+        return lines
+
+    #reads once from the device into the free tail of the buffer
+    def fill(self):
+        if self.end == len(self.buffer):
+            self.make_room()
+        received = self.recv_into(self.view[self.end:])
+        if not received:
+            raise ConnectionResetError("Connection closed with {} unterminated bytes".format(self.end - self.start))
+        self.end += received
+        return received
+
+    #moves the partial line to the front of the buffer, doubling the buffer if the line fills all of it
+    def make_room(self):
+        remaining = self.end - self.start
+        if self.start == 0:
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+            return
+        #memoryview assignment handles the overlapping copy
+        self.view[:remaining] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = remaining
+
+    #discards any partial data, used after a reconnect
+    def reset(self):
+        self.start = self.end = 0
+        self.pending = []
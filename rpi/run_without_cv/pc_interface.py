@@ -1,5 +1,9 @@
 import socket
-import queue
+from outbound_buffer import OutboundBuffer, DROP_OLDEST
+from rpi_log import get_logger
+
+log = get_logger("pc_interface")
+
 '''
     Class PCWrapper wraps the PC connection interface
 '''
@@ -12,14 +16,16 @@ class PcWrapper:
             host - a ip address/interface on the local machine to bind to
             port - port to bind
             timeout - timeout in seconds
+            buffer_size - maximum number of messages held while the PC is disconnected
+            overflow - OutboundBuffer overflow policy once buffer_size is reached
     '''
-    def __init__(self,host='',port=45000):
+    def __init__(self,host='',port=45000,buffer_size=256,overflow=DROP_OLDEST):
         #create the socket object as AF_INET, which defines the address family as internet addresses and
         #sets the socket as streaming
         self.server_socket = None
         self.conn = None
-        #used deque as Queue.queue did not provide easy way to peek the head of queue
-        self.queue = queue.Queue()
+        #bounded buffer for messages written while disconnected, center/mdf updates are coalesced to the latest
+        self.buffer = OutboundBuffer(buffer_size, overflow)
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             #set the socket to reuse IP addresses to prevent "Address in use error"
@@ -30,11 +36,11 @@ class PcWrapper:
             socket.setdefaulttimeout(60)
             #bind accepts a tuple containing the host interface to bind to, as well as port
             self.server_socket.bind((host,port))
-            print("Listening for connections for PC interface...")
+            log.info("Listening for connections for PC interface...")
             # set socket to listen to interface
             self.server_socket.listen(0)
-        except socket.error:
-            print("Failed to create socket: " + str(socket.error))
+        except socket.error as e:
+            log.error("Failed to create socket: %s", e)
 
     #accept_connection returns the connection or client socket
     def accept_connection(self):
@@ -43,20 +49,16 @@ class PcWrapper:
         conn, addr = self.server_socket.accept()
         # output to console
         self.conn = conn
-        print("Got a connection from %s" % str(addr))
+        log.info("Got a connection from %s", addr)
         return conn
 
     def accept_connection_and_flush(self):
         conn = self.accept_connection()
-        #no peek method makes this unnecessarily harder
-        next_msg = None
-        while(self.queue.empty() is False):
+        while(len(self.buffer) > 0):
             try:
-                if(next_msg is None):
-                    next_msg = self.queue.get()
-                print("Flushing PC interface...")
-                conn.sendall("{}\n".format(next_msg).encode())
-                next_msg = None
+                log.info("Flushing PC interface: %s", self.buffer.stats())
+                #all pending messages go out in one vectored write
+                self.buffer.flush(conn)
             except(socket.timeout,socket.error,ConnectionResetError):
                 conn = self.accept_connection()
         self.conn = conn
@@ -67,15 +69,15 @@ class PcWrapper:
     def write(self,msg):
         #print("Writing to PC: {}. Connection: {}".format(msg, self.conn))
         try:
-            #if the queue is not empty there was a disconnect and the reader thread is flushing, enqueue this msg
-            if(self.queue.empty() is False):
-                self.queue.put(msg)
+            #if the buffer is not empty there was a disconnect and the reader thread is flushing, buffer this msg
+            if(self.buffer.put_if_pending(msg)):
+                log.debug("Placed %s in PC queue", msg)
             else:
                 self.conn.sendall("{}\n".format(msg).encode())
             return True
         except Exception as e:
             #print(e)
-            self.queue.put(msg)
+            self.buffer.put(msg)
             return False
 
     #returns the socket for external handling
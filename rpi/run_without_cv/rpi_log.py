@@ -0,0 +1,188 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+'''
+    Logging for the rpi modules
+
+    Console output used to be a print on every message forwarded, which on a slow TTY or ssh session
+    was a large share of per message latency. Modules now get a logger from get_logger and log with
+    %-style arguments. The calling thread only checks the level and hands the unformatted record to a
+    queue; formatting and console writes happen on a background thread. Every record that passes its
+    module's level is also packed into a fixed size binary ring of recent events, dumped to a file on an
+    uncaught exception, a CRITICAL record, or when dump() is called
+
+    Levels are set per module with RPI_LOG_LEVELS, e.g. RPI_LOG_LEVELS="coordinator=DEBUG,img_recognition=WARNING"
+    RPI_LOG_LEVEL sets the default for every other module, INFO unless given
+'''
+
+DEFAULT_LEVEL = "INFO"
+RING_SLOTS = 2048
+DUMP_PATH = "{}/events.log".format(sys.path[0])
+
+#time, level, logger id, message length, then the message truncated to fill the slot
+SLOT_HEADER = struct.Struct("<dBBH")
+SLOT_SIZE = 160
+MAX_MESSAGE = SLOT_SIZE - SLOT_HEADER.size
+
+_listener = None
+_ring = None
+_pid = None
+_lock = threading.Lock()
+
+
+'''
+    Class EventRing keeps the last N records as fixed size binary slots in one preallocated bytearray
+'''
+class EventRing(object):
+
+    def __init__(self, slots=RING_SLOTS):
+        self.slots = slots
+        self.buffer = bytearray(slots * SLOT_SIZE)
+        self.next = 0
+        self.count = 0
+        self.names = []
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def name_id(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            #ids are a byte, any loggers past 255 share the last id
+            name_id = min(len(self.names), 255)
+            self.ids[name] = name_id
+            if name_id < 255:
+                self.names.append(name)
+            else:
+                self.names[255:] = ["other"]
+        return name_id
+
+    def record(self, created, levelno, name, message):
+        data = message.encode('utf-8', errors='replace')[:MAX_MESSAGE]
+        with self.lock:
+            offset = self.next * SLOT_SIZE
+            SLOT_HEADER.pack_into(self.buffer, offset, created, levelno, self.name_id(name), len(data))
+            self.buffer[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+            self.next = (self.next + 1) % self.slots
+            self.count = min(self.count + 1, self.slots)
+
+    #returns the recorded events oldest first as (time, level name, logger name, message)
+    def events(self):
+        with self.lock:
+            start = (self.next - self.count) % self.slots
+            events = []
+            for i in range(self.count):
+                offset = ((start + i) % self.slots) * SLOT_SIZE
+                created, levelno, name_id, length = SLOT_HEADER.unpack_from(self.buffer, offset)
+                message = bytes(self.buffer[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+                events.append((created, logging.getLevelName(levelno), self.names[name_id], message.decode('utf-8', errors='replace')))
+            return events
+
+    def dump(self, path=DUMP_PATH):
+        with open(path, "a") as f:
+            f.write("=== event dump pid {} at {} ===\n".format(os.getpid(), time.strftime("%H:%M:%S")))
+            for created, level, name, message in self.events():
+                f.write("{}.{:03d} {} {}: {}\n".format(time.strftime("%H:%M:%S", time.localtime(created)), int(created * 1000) % 1000, level, name, message))
+        return path
+
+
+class RingHandler(logging.Handler):
+
+    def __init__(self, ring):
+        logging.Handler.__init__(self)
+        self.ring = ring
+
+    def emit(self, record):
+        try:
+            self.ring.record(record.created, record.levelno, record.name, record.getMessage())
+            if record.levelno >= logging.CRITICAL:
+                self.ring.dump()
+        except Exception:
+            self.handleError(record)
+
+
+'''
+    Class LazyQueueHandler hands records to the background listener without formatting them.
+    logging.handlers.QueueHandler merges the arguments into the message on the calling thread, which is
+    only needed when the queue crosses a process boundary
+'''
+class LazyQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        return record
+
+
+def parse_levels(spec):
+    levels = {}
+    for entry in (spec or "").split(","):
+        if "=" in entry:
+            name, level = entry.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+'''
+    Starts the background writer for this process. Safe to call more than once, and called again in a
+    child process it starts a fresh writer since threads do not survive the fork
+        parameters
+            levels - dict of module name to level name, merged over RPI_LOG_LEVELS
+            default - level for modules not in levels, RPI_LOG_LEVEL or INFO if not given
+            console_level - minimum level written to the console
+'''
+def setup(levels=None, default=None, console_level=logging.DEBUG):
+    global _listener, _ring, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return _ring
+        _pid = os.getpid()
+        _ring = EventRing()
+        record_queue = queue.Queue()
+
+        console = logging.StreamHandler(sys.stdout)
+        console.setLevel(console_level)
+        console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        _listener = logging.handlers.QueueListener(record_queue, console, RingHandler(_ring), respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(LazyQueueHandler(record_queue))
+        root.setLevel(default or os.environ.get("RPI_LOG_LEVEL", DEFAULT_LEVEL).upper())
+
+        module_levels = parse_levels(os.environ.get("RPI_LOG_LEVELS"))
+        module_levels.update(levels or {})
+        for name, level in module_levels.items():
+            logging.getLogger(name).setLevel(level)
+
+        install_excepthooks()
+        atexit.register(stop)
+        return _ring
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+def dump(path=DUMP_PATH):
+    if _ring is None:
+        return None
+    return _ring.dump(path)
+
+#flushes pending records, used at exit
+def stop():
+    global _listener
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+#uncaught exceptions on any thread are logged and dump the ring before the thread dies
+def install_excepthooks():
+    def excepthook(exc_type, exc_value, exc_traceback):
+        logging.getLogger("rpi").critical("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
+    sys.excepthook = excepthook
+    if hasattr(threading, "excepthook"):
+        threading.excepthook = lambda args: excepthook(args.exc_type, args.exc_value, args.exc_traceback)
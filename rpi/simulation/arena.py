@@ -0,0 +1,205 @@
+import glob
+import os
+from collections import deque
+
+'''
+    Arena model for the simulation harness
+
+    Loads the algorithm's map descriptor files (algorithms/mazes/*.txt), moves a 3x3 robot over the
+    arena the same way the Arduino does, and produces the sensor readings the Arduino would send for a
+    pose. Sensor positions and ranges follow SENSOR_INFO and the sensor setup in the algorithm, so the
+    alsensor lines look like the real ones
+'''
+
+ROWS = 20
+COLUMNS = 15
+MAZE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "algorithms", "mazes")
+
+#row and column step for moving forward in each direction. row 0 is the start zone side
+DIRECTIONS = {"u": (1, 0), "d": (-1, 0), "l": (0, -1), "r": (0, 1)}
+LEFT_OF = {"u": "l", "l": "d", "d": "r", "r": "u"}
+RIGHT_OF = {"u": "r", "r": "d", "d": "l", "l": "u"}
+
+#sensor position -> direction -> (row offset, column offset, row step, column step) from the robot center
+SENSOR_INFO = {
+    2: {"u": (1, -2, 0, -1), "d": (-1, 2, 0, 1), "l": (-2, -1, -1, 0), "r": (2, 1, 1, 0)},
+    3: {"u": (2, -1, 1, 0), "d": (-2, 1, -1, 0), "l": (-1, -2, 0, -1), "r": (1, 2, 0, 1)},
+    4: {"u": (2, 0, 1, 0), "d": (-2, 0, -1, 0), "l": (0, -2, 0, -1), "r": (0, 2, 0, 1)},
+    5: {"u": (2, 1, 1, 0), "d": (-2, -1, -1, 0), "l": (1, -2, 0, -1), "r": (-1, 2, 0, 1)},
+    6: {"u": (1, 2, 0, 1), "d": (-1, -2, 0, -1), "l": (2, -1, 1, 0), "r": (-2, 1, -1, 0)},
+    8: {"u": (-1, 2, 0, 1), "d": (1, -2, 0, -1), "l": (2, 1, 1, 0), "r": (-2, -1, -1, 0)}
+}
+
+#alsensor order on the Arduino: TL, TM, TR, BRT, BRB, BLT, with the cells each one can sense
+SENSORS = [(3, range(0, 3)), (4, range(0, 3)), (5, range(0, 3)), (6, range(0, 3)), (8, range(0, 1)), (2, range(0, 3))]
+
+
+def maze_paths():
+    return sorted(glob.glob(os.path.join(MAZE_DIR, "*.txt")))
+
+#returns a set of (row, col) obstacles from a map descriptor file
+def load_arena(path):
+    with open(path) as f:
+        part1, part2 = (f.read().split() + [""])[:2]
+    explored = bin(int(part1, 16))[2:].zfill(len(part1) * 4)[2:2 + ROWS * COLUMNS]
+    obstacles_bits = bin(int(part2, 16))[2:].zfill(len(part2) * 4) if part2 else ""
+    obstacles = set()
+    index = 0
+    for cell in range(ROWS * COLUMNS):
+        if explored[cell] == "1":
+            if obstacles_bits[index] == "1":
+                obstacles.add(divmod(cell, COLUMNS))
+            index += 1
+    return obstacles
+
+def is_blocked(obstacles, row, col):
+    return row < 0 or row >= ROWS or col < 0 or col >= COLUMNS or (row, col) in obstacles
+
+def to_hex(bits):
+    return "".join("{:x}".format(int(bits[i:i + 4], 2)) for i in range(0, len(bits), 4))
+
+
+class Robot(object):
+
+    def __init__(self, obstacles, row=1, col=1, direction="u"):
+        self.obstacles = obstacles
+        self.row = row
+        self.col = col
+        self.direction = direction
+
+    def pose(self):
+        return (self.row, self.col, self.direction)
+
+    #True if the 3x3 footprint fits one cell ahead in direction
+    def can_move(self, direction):
+        row_step, col_step = DIRECTIONS[direction]
+        row, col = self.row + row_step, self.col + col_step
+        return not any(is_blocked(self.obstacles, row + i, col + j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+
+    #moves up to cells forward, stopping at an obstacle like the bumper would. returns cells moved
+    def forward(self, cells):
+        moved = 0
+        while moved < cells and self.can_move(self.direction):
+            row_step, col_step = DIRECTIONS[self.direction]
+            self.row += row_step
+            self.col += col_step
+            moved += 1
+        return moved
+
+    def turn(self, degrees, left):
+        for _ in range(max(1, int(degrees) // 90)):
+            self.direction = LEFT_OF[self.direction] if left else RIGHT_OF[self.direction]
+
+    #(cells sensed, reading) for one sensor, same as the algorithm's SimulatedSensor
+    def sense(self, position, sense_range):
+        row_offset, col_offset, row_step, col_step = SENSOR_INFO[position][self.direction]
+        cells = []
+        for i in range(sense_range.stop):
+            row = self.row + row_offset + row_step * i
+            col = self.col + col_offset + col_step * i
+            cells.append((row, col))
+            if is_blocked(self.obstacles, row, col):
+                return cells, (i if i >= sense_range.start else -1)
+        return cells, sense_range.stop - 1
+
+    #the reading the Arduino sends after alsensor
+    def sensor_reading(self):
+        return ",".join(str(self.sense(position, sense_range)[1]) for position, sense_range in SENSORS)
+
+    #the cells the footprint and the sensors have seen from this pose
+    def seen(self):
+        cells = set((self.row + i, self.col + j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+        for position, sense_range in SENSORS:
+            for row, col in self.sense(position, sense_range)[0]:
+                if not is_blocked(set(), row, col):
+                    cells.add((row, col))
+        return cells
+
+
+#part 1 and part 2 of the map descriptor for the explored cells, as the algorithm sends in mdf{...}
+def map_descriptor(explored, obstacles):
+    part1 = "11" + "".join("1" if divmod(cell, COLUMNS) in explored else "0" for cell in range(ROWS * COLUMNS)) + "11"
+    part2 = "".join("1" if divmod(cell, COLUMNS) in obstacles else "0" for cell in range(ROWS * COLUMNS) if divmod(cell, COLUMNS) in explored)
+    part2 += "0" * (-len(part2) % 8)
+    return to_hex(part1), to_hex(part2)
+
+
+'''
+    Replays an exploration of the arena as the algorithm would drive it: a left wall follower from the
+    start zone until the robot is back at the start or max_steps is reached. Returns a list of steps,
+    each a dict of the pose, the sensor reading expected at that pose, the map descriptor so far and
+    the movement command sent to the Arduino
+'''
+def exploration_session(obstacles, max_steps=500):
+    robot = Robot(obstacles)
+    start = robot.pose()
+    explored = set()
+    steps = []
+    turned_left = False
+    left_start = False
+    while len(steps) < max_steps:
+        explored |= robot.seen()
+        step = {
+            "pose": robot.pose(),
+            "sensor": robot.sensor_reading(),
+            "mdf": map_descriptor(explored, obstacles)
+        }
+        #a left turn is always followed by a move, otherwise an open corner spins the robot in place
+        if not turned_left and robot.can_move(LEFT_OF[robot.direction]):
+            step["command"] = "a;90"
+            robot.turn(90, True)
+            turned_left = True
+        elif robot.can_move(robot.direction):
+            step["command"] = "w;10"
+            robot.forward(1)
+            turned_left = False
+            left_start = True
+        else:
+            step["command"] = "d;90"
+            robot.turn(90, False)
+            turned_left = False
+        steps.append(step)
+        #done once the robot is back in the start zone
+        if left_start and robot.pose()[:2] == start[:2]:
+            break
+    return steps
+
+
+'''
+    Shortest path from the start zone to the goal zone as the fastest path run sends it: forwards
+    grouped up to max_forward cells (w;30) and turns grouped into one command (a;180)
+'''
+def fastest_path(obstacles, goal=(ROWS - 2, COLUMNS - 2), max_forward=3):
+    robot = Robot(obstacles)
+    start = robot.pose()
+    parents = {start: None}
+    frontier = deque([start])
+    end = None
+    while frontier:
+        pose = frontier.popleft()
+        if pose[:2] == goal:
+            end = pose
+            break
+        row, col, direction = pose
+        robot.row, robot.col, robot.direction = pose
+        moves = [("a", (row, col, LEFT_OF[direction])), ("d", (row, col, RIGHT_OF[direction]))]
+        if robot.can_move(direction):
+            row_step, col_step = DIRECTIONS[direction]
+            moves.append(("w", (row + row_step, col + col_step, direction)))
+        for action, following in moves:
+            if following not in parents:
+                parents[following] = (pose, action)
+                frontier.append(following)
+    actions = []
+    while end is not None and parents[end] is not None:
+        end, action = parents[end]
+        actions.append(action)
+    actions.reverse()
+
+    commands = []
+    for action in actions:
+        if commands and commands[-1][0] == action and (action != "w" or commands[-1][1] < max_forward):
+            commands[-1][1] += 1
+        else:
+            commands.append([action, 1])
+    return ["{};{}".format(action, count * (10 if action == "w" else 90)) for action, count in commands]
@@ -0,0 +1,210 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pipe
+from arena import load_arena, maze_paths, exploration_session, fastest_path, MAZE_DIR
+from stand_ins import Recorder, FakeArduino, Tablet, ScriptedPc
+
+'''
+    Hardware-free simulation harness and load generator for the coordinator
+
+    Runs a build of the coordinator in a child process against stand-ins for every device: a pty
+    backed fake Arduino, a TCP server socket in place of RFCOMM, a scripted PC replaying an exploration
+    of an arena from algorithms/mazes, and a fake camera answering capture requests. Reports throughput,
+    per hop latency and message loss for each build, e.g.
+
+        python3 simulate.py --arena sample_arena1.txt --rate 0 --bt-rate 20
+        python3 simulate.py --builds threaded async --move-time 0.3 --rate 2
+        python3 simulate.py --mode fastest --move-time 0.2 --window 1
+
+    Needs the same packages as the coordinator (pyserial, pybluez), but no camera, adapter or Arduino
+'''
+
+RPI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#build name -> (directory, has the camera process)
+BUILDS = {
+    "threaded": (os.path.join(RPI_DIR, "run_with_cv"), True),
+    "async": (os.path.join(RPI_DIR, "run_with_cv"), True),
+    "without_cv": (os.path.join(RPI_DIR, "run_without_cv"), False)
+}
+
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+#answers capture requests like the capture and recognition threads, reporting no arrow after recognition_time
+def fake_camera(camera_endpoint, recog_endpoint, recognition_time):
+    while 1:
+        robot_status = camera_endpoint.recv()
+        camera_endpoint.send("Captured")
+        if recognition_time:
+            time.sleep(recognition_time)
+        recog_endpoint.send((robot_status, "NOT FOUND"))
+
+'''
+    Child process entry point. Builds the wrappers against the stand-ins and runs the build's listeners
+'''
+def serve(build, pc_port, bt_port, serial_port, recognition_time, window):
+    sys.path.insert(0, BUILDS[build][0])
+    from pc_interface import PcWrapper
+    from bluetooth_interface import BluetoothWrapper
+    from arduino_interface import ArduinoWrapper
+    from outbound_buffer import OutboundBuffer
+
+    #same wrapper over a local TCP server socket instead of an RFCOMM one
+    class TcpBluetoothWrapper(BluetoothWrapper):
+
+        def __init__(self, port):
+            self.client_socket = None
+            self.buffer = OutboundBuffer()
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind(("127.0.0.1", port))
+            self.server_socket.listen(1)
+            self.port = port
+
+    pc_wrapper = PcWrapper('127.0.0.1', pc_port)
+    bt_wrapper = TcpBluetoothWrapper(bt_port)
+    #the async build writes the port from its own link instead of a pump thread
+    ar_wrapper = ArduinoWrapper(ports=(serial_port,), window=window, pump=False) if build == "async" else ArduinoWrapper(ports=(serial_port,), window=window)
+
+    if build == "without_cv":
+        from coordinator import initialize_listeners
+        initialize_listeners(pc_wrapper, bt_wrapper, ar_wrapper)
+        return
+
+    listener_endpoint_pc, camera_endpoint = Pipe()
+    listener_endpoint_rpi, recog_endpoint = Pipe()
+    camera_thread = threading.Thread(target=fake_camera, args=(camera_endpoint, recog_endpoint, recognition_time))
+    camera_thread.daemon = True
+    camera_thread.start()
+    if build == "async":
+        from async_coordinator import initialize_async_listeners
+        initialize_async_listeners(listener_endpoint_pc, listener_endpoint_rpi, pc_wrapper, bt_wrapper, ar_wrapper)
+    else:
+        from coordinator import initialize_listeners
+        initialize_listeners(listener_endpoint_pc, listener_endpoint_rpi, pc_wrapper, bt_wrapper, ar_wrapper)
+
+'''
+    Runs one session of build against the stand-ins and returns the results
+'''
+def run_build(build, steps, obstacles, args):
+    recorder = Recorder()
+    arduino = FakeArduino(obstacles, recorder, args.move_time, args.ack_gap)
+    arduino.start()
+    pc_port, bt_port = free_port(), free_port()
+    #the camera hop is timed by the fake camera's NOT FOUND replies, which the coordinator holds back by default
+    env = dict(os.environ, RPI_LOG_LEVEL=os.environ.get("RPI_LOG_LEVEL", "WARNING"), RPI_ARROWS=os.environ.get("RPI_ARROWS", "all"))
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", build, "--pc-port", str(pc_port), "--bt-port", str(bt_port),
+         "--serial", arduino.slave_name, "--recognition-time", str(args.recognition_time), "--window", str(args.window)],
+        env=env, stdout=None if args.verbose else subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    pc = None
+    tablet = None
+    try:
+        #the PC listener accepts first, the Bluetooth one may be waiting on it
+        pc = ScriptedPc(pc_port, recorder, steps, args.rate, BUILDS[build][1], args.timeout)
+        tablet = Tablet(bt_port, recorder, args.bt_rate)
+        tablet.start()
+        tablet.send("al_starte")
+        start = time.monotonic()
+        if args.mode == "fastest":
+            pc.run_fastest(steps, not args.sequential)
+        else:
+            pc.run()
+        elapsed = time.monotonic() - start
+        #let messages in flight arrive before counting them lost
+        time.sleep(args.drain)
+        recorder.close()
+    finally:
+        if tablet is not None:
+            tablet.stop()
+        if pc is not None:
+            pc.stop()
+        child.terminate()
+        child.wait()
+    hops = recorder.summary()
+    return {
+        "build": build,
+        "steps": pc.completed,
+        "elapsed": elapsed,
+        "delivered": sum(hop["received"] for hop in hops),
+        "lost": sum(hop["lost"] for hop in hops),
+        "timeouts": pc.timeouts,
+        "mismatches": pc.mismatches,
+        "dead_ms": sum(arduino.dead_times) / len(arduino.dead_times) * 1e3 if arduino.dead_times else 0.0,
+        "hops": hops
+    }
+
+def print_report(results):
+    print("{:<12} {:>7} {:>10} {:>10} {:>7} {:>9} {:>11} {:>15}".format("build", "steps", "steps/sec", "msgs/sec", "lost", "timeouts", "mismatches", "dead ms/move"))
+    for result in results:
+        print("{:<12} {:>7} {:>10.1f} {:>10.1f} {:>7} {:>9} {:>11} {:>15.2f}".format(
+            result["build"], result["steps"], result["steps"] / result["elapsed"], result["delivered"] / result["elapsed"],
+            result["lost"], result["timeouts"], result["mismatches"], result["dead_ms"]))
+    print("")
+    print("{:<12} {:<16} {:>7} {:>9} {:>6} {:>11} {:>10} {:>10} {:>10}".format("build", "hop", "sent", "received", "lost", "unexpected", "p50 (ms)", "p99 (ms)", "max (ms)"))
+    for result in results:
+        for hop in result["hops"]:
+            if hop["sent"] == 0 and hop["unexpected"] == 0:
+                continue
+            print("{:<12} {hop:<16} {sent:>7} {received:>9} {lost:>6} {unexpected:>11} {p50_ms:>10.2f} {p99_ms:>10.2f} {max_ms:>10.2f}".format(result["build"], **hop))
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated exploration load test for the coordinator builds")
+    parser.add_argument("--builds", nargs="+", choices=sorted(BUILDS), default=["threaded", "async", "without_cv"], help="coordinator builds to run")
+    parser.add_argument("--mode", choices=["explore", "fastest"], default="explore", help="replay an exploration or a fastest path run")
+    parser.add_argument("--sequential", action="store_true", help="fastest path waits for every acknowledgement before the next command")
+    parser.add_argument("--window", type=int, default=4, help="Arduino commands in flight, 1 waits for every acknowledgement")
+    parser.add_argument("--arena", default="sample_arena1.txt", help="map descriptor file, a name in algorithms/mazes or 'all'")
+    parser.add_argument("--steps", type=int, default=500, help="maximum exploration steps per arena")
+    parser.add_argument("--rate", type=float, default=0.0, help="maximum PC steps per second, 0 for as fast as possible")
+    parser.add_argument("--bt-rate", type=float, default=5.0, help="tablet chatter messages per second")
+    parser.add_argument("--move-time", type=float, default=0.0, help="seconds the fake Arduino takes per movement")
+    parser.add_argument("--ack-gap", type=float, default=0.0, help="seconds between the fake Arduino's two fastest path acknowledgements")
+    parser.add_argument("--recognition-time", type=float, default=0.0, help="seconds the fake camera takes per recognition")
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds to wait for an Arduino reply")
+    parser.add_argument("--drain", type=float, default=0.5, help="seconds to wait for messages in flight at the end")
+    parser.add_argument("--verbose", action="store_true", help="show the coordinator's output")
+    parser.add_argument("--serve", choices=sorted(BUILDS), help=argparse.SUPPRESS)
+    parser.add_argument("--pc-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--bt-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serial", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.pc_port, args.bt_port, args.serial, args.recognition_time, args.window)
+        return
+
+    if args.arena == "all":
+        arenas = maze_paths()
+    elif os.path.exists(args.arena):
+        arenas = [args.arena]
+    else:
+        arenas = [os.path.join(MAZE_DIR, args.arena)]
+
+    results = []
+    for path in arenas:
+        obstacles = load_arena(path)
+        if args.mode == "fastest":
+            steps = fastest_path(obstacles)
+        else:
+            steps = exploration_session(obstacles, args.steps)
+        print("Arena {}: {} obstacles, {} {} steps".format(os.path.basename(path), len(obstacles), len(steps), args.mode))
+        for build in args.builds:
+            results.append(run_build(build, steps, obstacles, args))
+    print_report(results)
+
+#required
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
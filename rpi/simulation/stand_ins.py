@@ -0,0 +1,345 @@
+import os
+import pty
+import queue
+import socket
+import threading
+import time
+import tty
+from collections import deque
+from arena import Robot
+
+'''
+    Stand-ins for the devices around the coordinator
+
+    FakeArduino answers on a pty like the Arduino does on /dev/ttyACM0, Tablet connects to the TCP
+    stand-in for the RFCOMM server socket, and ScriptedPc replays an exploration session against the
+    PC socket. All three record send and receive times on a shared Recorder, so latency and loss are
+    measured per hop without touching the coordinator
+'''
+
+PC_TO_ARDUINO = "pc->arduino"
+PC_TO_BT = "pc->bt"
+PC_TO_CAMERA = "pc->camera->pc"
+ARDUINO_TO_PC = "arduino->pc"
+ARDUINO_TO_BT = "arduino->bt"
+BT_TO_PC = "bt->pc"
+HOPS = [PC_TO_ARDUINO, PC_TO_BT, PC_TO_CAMERA, ARDUINO_TO_PC, ARDUINO_TO_BT, BT_TO_PC]
+
+'''
+    Class Hop matches received messages to sent ones in order. Messages skipped over by a later match,
+    or never received by the end of the run, are counted as lost
+'''
+class Hop(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.latencies = []
+        self.sent = 0
+        self.lost = 0
+        self.unexpected = 0
+
+    def send(self, msg):
+        with self.lock:
+            self.pending.append((msg, time.monotonic()))
+            self.sent += 1
+
+    def receive(self, msg):
+        now = time.monotonic()
+        with self.lock:
+            for index, (pending, sent_at) in enumerate(self.pending):
+                if pending == msg:
+                    for _ in range(index):
+                        self.pending.popleft()
+                    self.pending.popleft()
+                    self.lost += index
+                    self.latencies.append(now - sent_at)
+                    return True
+            self.unexpected += 1
+            return False
+
+    #counts everything still in flight as lost
+    def close(self):
+        with self.lock:
+            self.lost += len(self.pending)
+            self.pending.clear()
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))] * 1e3
+        return {
+            "hop": self.name,
+            "sent": self.sent,
+            "received": len(latencies),
+            "lost": self.lost,
+            "unexpected": self.unexpected,
+            "p50_ms": percentile(50),
+            "p99_ms": percentile(99),
+            "max_ms": latencies[-1] * 1e3 if latencies else 0.0
+        }
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.hops = dict((name, Hop(name)) for name in HOPS)
+
+    def send(self, hop, msg):
+        self.hops[hop].send(msg)
+
+    def receive(self, hop, msg):
+        return self.hops[hop].receive(msg)
+
+    def close(self):
+        for hop in self.hops.values():
+            hop.close()
+
+    def summary(self):
+        return [self.hops[name].summary() for name in HOPS]
+
+
+#yields newline terminated lines from a blocking read function until it returns nothing
+def read_lines(read):
+    buffer = b""
+    while 1:
+        data = read()
+        if not data:
+            return
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode('ascii', errors='ignore').strip()
+
+
+'''
+    Class FakeArduino drives the robot over the arena behind a pty. The coordinator opens slave_name as
+    its serial port. Movements reply anok and alok after move_time, g sends alsensor and then echoes ang,
+    x replies alok. After x every move is acknowledged twice like the sketch does, ack_gap apart. Like the sketch it handles one
+    command at a time, and the time it sits idle between moves is recorded as dead time
+'''
+
+#seconds between the two acknowledgements of a move in fastest path mode, 0 sends them together
+FASTEST_ACK_GAP = 0.0
+
+class FakeArduino(object):
+
+    def __init__(self, obstacles, recorder, move_time=0.0, ack_gap=FASTEST_ACK_GAP):
+        self.robot = Robot(obstacles)
+        self.recorder = recorder
+        self.move_time = move_time
+        self.ack_gap = ack_gap
+        self.fastest_path = False
+        #seconds idle between the end of one move and the start of the next
+        self.dead_times = []
+        self.moved_at = None
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.slave_name = os.ttyname(self.slave)
+        self.thread = threading.Thread(target=self.run, name="fake-arduino")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def reply(self, *msgs):
+        for msg in msgs:
+            if msg.startswith("al"):
+                self.recorder.send(ARDUINO_TO_PC, msg[2:])
+            elif msg.startswith("an"):
+                self.recorder.send(ARDUINO_TO_BT, msg[2:])
+        #println terminates with \r\n
+        os.write(self.master, "".join("{}\r\n".format(msg) for msg in msgs).encode())
+
+    def handle(self, command):
+        self.recorder.receive(PC_TO_ARDUINO, command)
+        action, _, value = command.partition(";")
+        if action in ("w", "a", "d"):
+            if self.moved_at is not None:
+                self.dead_times.append(time.monotonic() - self.moved_at)
+            if action == "w":
+                self.robot.forward(max(1, int(value or 10) // 10))
+            else:
+                self.robot.turn(int(value or 90), action == "a")
+            if self.move_time:
+                time.sleep(self.move_time)
+            if not self.fastest_path:
+                self.reply("anok", "alok")
+            elif self.ack_gap:
+                self.reply("anok", "alok")
+                time.sleep(self.ack_gap)
+                self.reply("anok", "alok")
+            else:
+                self.reply("anok", "alok", "anok", "alok")
+            self.moved_at = time.monotonic()
+        elif action == "x":
+            self.fastest_path = True
+            self.reply("alok")
+        elif action == "g":
+            #the sketch prints the readings before it echoes the command to the tablet
+            self.reply("alsensor" + self.robot.sensor_reading(), "an" + command)
+
+    def run(self):
+        try:
+            for command in read_lines(lambda: os.read(self.master, 4096)):
+                if command:
+                    self.handle(command)
+        except OSError:
+            #the coordinator closed the port
+            pass
+
+
+#connects to host:port, retrying until the coordinator is listening or timeout runs out
+def connect(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while 1:
+        try:
+            conn = socket.create_connection(("127.0.0.1", port))
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return conn
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+'''
+    Class Tablet stands in for the Android tablet on the Bluetooth link. It starts exploration with
+    al_starte and sends waypoint chatter at rate messages per second while the session runs
+'''
+class Tablet(object):
+
+    def __init__(self, port, recorder, rate=0.0):
+        self.recorder = recorder
+        self.rate = rate
+        self.conn = connect(port)
+        self.running = True
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self.receive, name="tablet-receive"),
+            threading.Thread(target=self.chatter, name="tablet-chatter")
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def send(self, msg):
+        self.recorder.send(BT_TO_PC, msg[3:])
+        with self.lock:
+            self.conn.sendall("{}\n".format(msg).encode())
+
+    def receive(self):
+        for msg in read_lines(lambda: self.conn.recv(4096)):
+            #ok and the g echo come from the Arduino, everything else from the algorithm
+            if msg == "ok" or msg == "g":
+                self.recorder.receive(ARDUINO_TO_BT, msg)
+            elif msg:
+                self.recorder.receive(PC_TO_BT, msg)
+
+    def chatter(self):
+        count = 0
+        while self.running and self.rate > 0:
+            self.send("al_way{{{},{}}}".format(count % 15, count % 20))
+            count += 1
+            time.sleep(1.0 / self.rate)
+
+    def stop(self):
+        self.running = False
+        self.conn.close()
+
+
+'''
+    Class ScriptedPc replays an exploration session as the algorithm. For each step it asks for sensor
+    data, sends the robot position and map to the tablet, asks for a capture, then moves and waits for
+    the ok. rate caps the steps per second, 0 runs as fast as the replies come back
+'''
+class ScriptedPc(object):
+
+    def __init__(self, port, recorder, steps, rate=0.0, camera=True, timeout=2.0):
+        self.recorder = recorder
+        self.steps = steps
+        self.rate = rate
+        self.camera = camera
+        self.timeout = timeout
+        self.conn = connect(port)
+        self.replies = queue.Queue()
+        self.started = threading.Event()
+        self.timeouts = 0
+        self.mismatches = 0
+        self.completed = 0
+        self.thread = threading.Thread(target=self.receive, name="pc-receive")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, hop, msg, expected):
+        self.recorder.send(hop, expected)
+        self.conn.sendall("{}\n".format(msg).encode())
+
+    def receive(self):
+        for msg in read_lines(lambda: self.conn.recv(4096)):
+            if msg == "ok" or msg.startswith("sensor"):
+                self.recorder.receive(ARDUINO_TO_PC, msg)
+                self.replies.put(msg)
+            elif msg.startswith("arrfound") or msg == "NOT FOUND":
+                self.recorder.receive(PC_TO_CAMERA, msg)
+            elif msg:
+                self.recorder.receive(BT_TO_PC, msg)
+                if msg == "starte":
+                    self.started.set()
+
+    #waits for the next Arduino reply, None on timeout
+    def wait_reply(self):
+        try:
+            return self.replies.get(timeout=self.timeout)
+        except queue.Empty:
+            self.timeouts += 1
+            return None
+
+    def run(self):
+        self.started.wait(self.timeout)
+        for step in self.steps:
+            start = time.monotonic()
+            row, col, direction = step["pose"]
+            self.send(PC_TO_ARDUINO, "arg", "g")
+            reply = self.wait_reply()
+            if reply is not None and reply != "sensor" + step["sensor"]:
+                self.mismatches += 1
+            self.send(PC_TO_BT, "ancenter{{{},{},{}}}".format(col, row, direction), "center{{{},{},{}}}".format(col, row, direction))
+            self.send(PC_TO_BT, "anmdf{{{},{}}}".format(*step["mdf"]), "mdf{{{},{}}}".format(*step["mdf"]))
+            if self.camera:
+                self.send(PC_TO_CAMERA, "rpi{},{},{}".format(col, row, direction), "NOT FOUND")
+            else:
+                self.conn.sendall("rpi{},{},{}\n".format(col, row, direction).encode())
+            self.send(PC_TO_ARDUINO, "ar" + step["command"], step["command"])
+            self.wait_reply()
+            self.completed += 1
+            if self.rate > 0:
+                time.sleep(max(0.0, 1.0 / self.rate - (time.monotonic() - start)))
+
+    '''
+        Runs a fastest path. pipelined sends every command up front like the algorithm does now,
+        otherwise each command waits for its acknowledgements first. acks is how many the sketch sends per move
+    '''
+    def run_fastest(self, commands, pipelined=True, acks=2):
+        self.started.wait(self.timeout)
+        #like Connection.sendFastestPathCommandAndWait, the moves only go out once x is acknowledged
+        self.send(PC_TO_ARDUINO, "arx", "x")
+        self.wait_reply()
+        if pipelined:
+            for command in commands:
+                self.send(PC_TO_ARDUINO, "ar" + command, command)
+        for command in commands:
+            if not pipelined:
+                self.send(PC_TO_ARDUINO, "ar" + command, command)
+            for _ in range(acks):
+                self.wait_reply()
+            self.completed += 1
+
+    def stop(self):
+        self.conn.close()